@@ -3,7 +3,6 @@ from FEM.Geometry import Geometry3D
 from FEM.Solvers import LinealEigen
 import numpy as np
 import logging
-from scipy.sparse.linalg import eigsh
 from sendEmail import sendMailOutlook
 import sys
 
@@ -84,40 +83,16 @@ O = NonLocalElasticityFromTensor(
     geo, C, rho, l, 0.0, Lr, af, solver=LinealEigen, name=log_filename, verbose=True)
 logging.info(format(sys.argv))
 
-logging.info('Creating element matrices...')
-O.elementMatrices()
-logging.info('Done!')
-duration = O.logger.end_timer().total_seconds()
-O.properties['duration'] = duration
-for z in Z[::-1]:
-    logging.info(f'Solving for z={z}')
-    filename = f'SiCube_{L}_{l}_{z}.json'
-
-    O.z1 = z
-    O.z2 = 1-z
-    O.ensembling()
-    O.borderConditions()
-    logging.info('Converting to csr format')
-    O.K = O.K.tocsr()
-    logging.info('Solving...')
-    eigv, eigvec = eigsh(
-        O.K, 20, O.M, which='SM')
-    idx = eigv.argsort()
-    eigv = eigv[idx]
-    eigvec = eigvec[:, idx]
-    O.eigv = eigv
-    O.eigvec = eigvec
-    O.solver.solutions = eigvec.T
-    O.solver.solutions_info = [
-        {'solver-type': O.solver.type, 'eigv': ei} for ei in O.eigv]
-    O.solver.setSolution(0)
-    logging.info('Solved!')
-    O.properties['z1'] = O.z1
-
-    O.exportJSON(filename)
 
+def notify(record):
+    filename = record['path']
+    logging.info(f"z1={record['z1']} solved in {record['time']} s")
     try:
         sendMailOutlook(mss=f"{filename} ha terminado!",
                         secrests_path='secrets.txt', files=[f'nolocal_runner_{log_filename}.log'])
     except Exception as e:
         logging.error(e)
+
+
+records = O.sweep(Z[::-1], k=20, path=f'SiCube_{L}_{l}_{{z1}}.json',
+                  callback=notify)
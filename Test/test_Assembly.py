@@ -0,0 +1,98 @@
+"""Global assembly tests"""
+from FEM.Assembly import TripletAssembler, SparsityPattern
+from FEM.Geometry import Delaunay
+from FEM.Utils.polygonal import giveCoordsCircle
+from FEM.Torsion2D import Torsion2D
+from FEM.EulerBernoulliBeam import EulerBernoulliBeamNonLineal
+from FEM.Geometry import Lineal
+import unittest
+import numpy as np
+
+
+def circle():
+    vert, _ = giveCoordsCircle([0, 0], 1.0, n=30)
+    params = Delaunay._strdelaunay(
+        constrained=True, delaunay=True, a='0.01', o=2)
+    return Delaunay(vert, params, nvn=1)
+
+
+class TestAssembly(unittest.TestCase):
+    """Test the triplet assembly engine"""
+
+    def test_triplets(self):
+        """Triplets with repeated entries must be summed when the CSR matrix is created
+        """
+        K = TripletAssembler((4, 4))
+        K[np.ix_([0, 1], [0, 1])] += np.ones([2, 2])
+        K[np.ix_([1, 2], [1, 2])] += 2*np.ones([2, 2])
+        K[np.ix_([3], [3])] -= np.ones([1, 1])
+        K.addBatch(np.array([[0, 3], [2, 3]]), np.ones([2, 2, 2]))
+        dense = np.zeros([4, 4])
+        dense[np.ix_([0, 1], [0, 1])] += 1.0
+        dense[np.ix_([1, 2], [1, 2])] += 2.0
+        dense[3, 3] -= 1.0
+        dense[np.ix_([0, 3], [0, 3])] += 1.0
+        dense[np.ix_([2, 3], [2, 3])] += 1.0
+        self.assertTrue(np.allclose(K.tocsr().toarray(), dense))
+
+    def test_pattern(self):
+        """The scatter map of the sparsity pattern must give the same matrix as the triplets
+        """
+        gdlm = [[0, 1, 2], [2, 3, 4], [4, 0, 2], [5, 1]]
+        values = [np.arange(len(g)**2).reshape(len(g), len(g)) for g in gdlm]
+        K = TripletAssembler((6, 6))
+        for g, v in zip(gdlm, values):
+            K[np.ix_(g, g)] += v
+        pattern = SparsityPattern(gdlm, 6)
+        data = pattern.assemble(values)
+        self.assertTrue(np.allclose(
+            pattern.matrix(data).toarray(), K.tocsr().toarray()))
+        data = np.zeros(pattern.nnz)
+        pattern.scatter(data, [0, 1, 2], np.array(values[:3]))
+        pattern.scatter(data, [3], np.array(values[3:]))
+        self.assertTrue(np.allclose(
+            pattern.matrix(data).toarray(), K.tocsr().toarray()))
+
+    def test_sparse_ensembling(self):
+        """The sparse formulation must give the same solution as the dense one
+        """
+        geometry = circle()
+        O = Torsion2D(geometry, 1000.0, 1.0)
+        O.solve(plot=False)
+        U = O.U.copy()
+        geometry = circle()
+        O = Torsion2D(geometry, 1000.0, 1.0, sparse=True)
+        O.solve(plot=False)
+        self.assertTrue(np.allclose(U.flatten(), O.U.flatten()))
+
+    def test_sparse_replaced_elements(self):
+        """The sparsity pattern must follow the degrees of freedom of the Euler Bernoulli elements
+        """
+        solutions = []
+        for sparse in (False, True):
+            geometry = Lineal(100.0, 20, 1, 3)
+            geometry.cbe = [[0, 0.0], [1, 0.0], [2, 0.0],
+                            [-1, 0.0], [-2, 0.0], [-3, 0.0]]
+            O = EulerBernoulliBeamNonLineal(
+                geometry, 2.5e6, 3e7, 0.0, 10.0, sparse=sparse)
+            O.solve(plot=False)
+            solutions.append(np.array(O.U).flatten())
+        self.assertTrue(np.allclose(solutions[0], solutions[1]))
+
+    def test_essential_conditions(self):
+        """Symmetric, penalty and elimination essential border conditions must give the same solution with dense and sparse matrices
+        """
+        solutions = []
+        for sparse in (False, True):
+            for mode in ('symmetric', 'penalty', 'elimination'):
+                geometry = circle()
+                O = Torsion2D(geometry, 1000.0, 1.0,
+                              sparse=sparse, ebcMode=mode)
+                O.solve(plot=False)
+                solutions.append(O.U.flatten())
+        for U in solutions[1:]:
+            self.assertTrue(np.allclose(solutions[0], U, atol=1e-8))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,8 @@
 
 from FEM.Utils import polygonal
 from FEM.Geometry.Geometry import Geometry
+from FEM.Elements.E2D.Serendipity import Serendipity
+import numpy as np
 import unittest
 FILENAME = 'Test/resources/beam.json'
 
@@ -22,6 +24,50 @@ class TestGeometry(unittest.TestCase):
         self.assertEqual(len(geometry.elements), nex*ney)
         self.assertEqual(len(geometry.regions), 0)
 
+    def test_elementBlocks(self):
+        """Elements are created only when accessed and their geometry must match the element constructor
+        """
+        coords, dicc = polygonal.enmalladoFernando(2.0, 0.5, 8, 2)
+        geometry = Geometry(dicc, coords, ['C2V']*len(dicc), nvn=2)
+        self.assertEqual(geometry.elements.materialized(), 0)
+        e = geometry.elements[5]
+        self.assertEqual(geometry.elements.materialized(), 1)
+        d = dicc[5]
+        gdl = np.array([np.array(d)*2, np.array(d)*2+1])
+        reference = Serendipity(np.array(coords)[d], gdl)
+        self.assertEqual(e.gdlm, reference.gdlm)
+        for name in ['_x', '_p', 'jacs', 'detjac', 'dpx', '_xcenter']:
+            self.assertTrue(np.allclose(
+                getattr(e, name), getattr(reference, name)))
+        self.assertEqual(e.Ke.shape, (16, 16))
+
+    def test_nonlocalAdjacency(self):
+        """The bulk neighbours search must find, sorted, the elements of the centroid by centroid search
+        """
+        coords, dicc = polygonal.enmalladoFernando(2.0, 0.5, 12, 4)
+        geometry = Geometry(dicc, coords, ['C2V']*len(dicc), nvn=2)
+        indptr, indices, d = geometry.nonlocalAdjacency(0.3, distances=True)
+        self.assertEqual(len(indptr), len(dicc)+1)
+        for i, e in enumerate(geometry.elements):
+            enl = indices[indptr[i]:indptr[i+1]]
+            self.assertEqual(enl.tolist(), sorted(
+                geometry.KDTree.query_ball_point(e._xcenter, 0.3)))
+            self.assertTrue(np.allclose(d[indptr[i]:indptr[i+1]], np.linalg.norm(
+                geometry.KDTree.data[enl]-e._xcenter, axis=1)))
+
+    def test_gaussAdjacency(self):
+        """The strips of Gauss points must find the elements with a pair of Gauss points closer than Lr
+        """
+        coords, dicc = polygonal.enmalladoFernando(2.0, 0.5, 12, 4)
+        geometry = Geometry(dicc, coords, ['C2V']*len(dicc), nvn=2)
+        points = geometry.gaussPoints()
+        indptr, indices = geometry.gaussAdjacency(0.3, chunk=50)
+        for i in range(len(dicc)):
+            d = np.linalg.norm(points[i][:, None, None, :] -
+                               points[None, :, :, :], axis=-1).min(axis=(0, 2))
+            self.assertEqual(indices[indptr[i]:indptr[i+1]].tolist(),
+                             np.where(d <= 0.3)[0].tolist())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,265 @@
+"""Nonlocal formulations tests"""
+
+from FEM.Geometry import Geometry2D, Geometry3D
+from FEM.Elasticity2D import PlaneStressSparse, PlaneStressNonLocalSparse, PlaneStressNonLocalSparseNonHomogeneous
+from FEM.Elasticity3D import NonLocalElasticity
+from FEM.Kernels import strainMatrix2D, strainMatrix3D, interiorGamma
+from FEM.Solvers import IterativeSparse, LinealEigen
+import numpy as np
+import tempfile
+import unittest
+
+
+L = 0.1
+
+
+def af(rho):
+    return (1/(2*np.pi*L**2))*np.exp(-rho)
+
+
+def rectangle(nex: int = 6, ney: int = 2, a: float = 1.2, b: float = 0.4) -> Geometry2D:
+    x, y = np.meshgrid(np.linspace(0, a, nex+1),
+                       np.linspace(0, b, ney+1), indexing='ij')
+    coords = np.array([x.flatten(), y.flatten()]).T
+    dicc = [[i*(ney+1)+j, (i+1)*(ney+1)+j, (i+1)*(ney+1)+j+1, i*(ney+1)+j+1]
+            for i in range(nex) for j in range(ney)]
+    return Geometry2D(dicc, coords, ['C1V']*len(dicc), nvn=2, fast=True)
+
+
+def cube(n: int = 2, a: float = 1.0) -> Geometry3D:
+    coords = [[i*a/n, j*a/n, k*a/n] for i in range(n+1)
+              for j in range(n+1) for k in range(n+1)]
+
+    def node(i, j, k): return i*(n+1)**2+j*(n+1)+k
+    dicc = [[node(i, j, k), node(i+1, j, k), node(i+1, j+1, k), node(i, j+1, k),
+             node(i, j, k+1), node(i+1, j, k+1), node(i+1, j+1, k+1), node(i, j+1, k+1)]
+            for i in range(n) for j in range(n) for k in range(n)]
+    return Geometry3D(dicc, coords, ['B1V']*len(dicc), nvn=3, fast=True)
+
+
+def reference(O, strainMatrix, C: list, t: list, l: float, attenuation, cutoff: float = np.inf, amin: float = 0.0) -> np.ndarray:
+    KNL = np.zeros([O.ngdl, O.ngdl])
+    for ee, e in enumerate(O.elements):
+        B = strainMatrix(e.dpx)
+        for inl in e.enl:
+            enl = O.elements[inl]
+            Bnl = strainMatrix(enl.dpx)
+            for k in range(len(e.W)):
+                for knl in range(len(enl.W)):
+                    ro = np.linalg.norm(e._x[k]-enl._x[knl])/l
+                    a = attenuation(ro)
+                    if ro > cutoff or a < amin:
+                        continue
+                    KNL[np.ix_(e.gdlm, enl.gdlm)] += a*t[ee]*t[inl]*(B[k].T@C[ee]@Bnl[knl])*e.detjac[k] * \
+                        e.W[k]*enl.detjac[knl]*enl.W[knl]
+    return KNL
+
+
+def plane(geometry: Geometry2D, Lr: float, attenuation=af, **kargs) -> PlaneStressNonLocalSparse:
+    O = PlaneStressNonLocalSparse(
+        geometry, 20000, 0.2, 0.3, L, 0.5, Lr, attenuation, rho=1.0, **kargs)
+    O.elementMatrices()
+    O.ensembling()
+    return O
+
+
+class TestNonLocal(unittest.TestCase):
+    """Test the nonlocal matrices"""
+
+    def test_plane_stress_kernel(self):
+        """The batched nonlocal matrices must match the Gauss points pairs integration
+        """
+        O = plane(rectangle(3, 1), 2.0)
+        C = O.constitutiveMatrices(np.arange(len(O.elements)))
+        KNL = reference(O, strainMatrix2D, C, O.t, L, af)
+        self.assertTrue(np.allclose(O.KNL.toarray(), KNL, rtol=1e-12,
+                        atol=1e-12*np.abs(KNL).max()))
+        self.assertTrue(np.allclose(KNL, KNL.T, atol=1e-12*np.abs(KNL).max()))
+
+    def test_asymmetric_neighbours(self):
+        """If the nonlocal relation is not symmetric, every element must be integrated with all its nonlocal elements
+        """
+        O = PlaneStressNonLocalSparse(
+            rectangle(3, 1), 20000, 0.2, 0.3, L, 0.5, 2.0, af, rho=1.0)
+        O.elements[0].enl = [i for i in O.elements[0].enl if not i == 2]
+        O.elementMatrices()
+        O.ensembling()
+        C = O.constitutiveMatrices(np.arange(len(O.elements)))
+        KNL = reference(O, strainMatrix2D, C, O.t, L, af)
+        self.assertTrue(np.allclose(O.KNL.toarray(), KNL, rtol=1e-12,
+                        atol=1e-12*np.abs(KNL).max()))
+
+    def test_lazy_elements(self):
+        """The nonlocal matrices and the border segments must be calculated without creating the element objects.
+        The created elements must get their nonlocal elements from the adjacency arrays
+        """
+        for kargs in ({}, {'cutoff': True}, {'matrixFree': True}):
+            O = plane(rectangle(8, 3), 0.3, **kargs)
+            self.assertEqual(O.elements.materialized(), 0)
+        self.assertEqual(len(O.geometry.borderSegments()), 22)
+        self.assertEqual(O.elements.materialized(), 0)
+        indptr, indices = O.elements.adjacency()
+        self.assertEqual(O.elements[5].enl.tolist(),
+                         indices[indptr[5]:indptr[6]].tolist())
+
+    def test_plane_stress_constant_attenuation(self):
+        """With a constant attenuation and all the elements as nonlocal elements, KNL must be G.T@C@G
+        where G is the integral of the B matrices. The local matrices must match the local formulation
+        """
+        O = plane(rectangle(), 10.0, lambda rho: 1.0)
+        G = np.zeros([3, O.ngdl])
+        for e in O.elements:
+            B = strainMatrix2D(e.dpx)
+            G[:, e.gdlm] += 0.3*np.einsum('gsa,g->sa', B, e.detjac*e.W)
+        C = O.constitutiveMatrices([0])[0]
+        KNL = O.KNL.toarray()
+        self.assertTrue(np.allclose(KNL, G.T@C@G, atol=1e-10*np.abs(KNL).max()))
+        local = PlaneStressSparse(rectangle(), 20000, 0.2, 0.3, rho=1.0)
+        local.elementMatrices()
+        local.ensembling()
+        self.assertTrue(np.allclose(O.KL.toarray(), local.K.toarray()))
+        self.assertTrue(np.allclose(O.M.toarray(), local.M.toarray()))
+
+    def test_gauss_points_cutoff(self):
+        """With a cutoff, the nonlocal elements must be the elements with a Gauss point closer than Lr and only
+        the Gauss points pairs closer than Lr with attenuation over the threshold must be integrated
+        """
+        O = plane(rectangle(12, 4), 0.25, cutoff=True, threshold=1e-2)
+        for e in O.elements:
+            d = [np.linalg.norm(e._x[:, None, :]-enl._x[None, :, :], axis=-1).min()
+                 for enl in O.elements]
+            self.assertEqual(list(e.enl), np.where(np.array(d) <= 0.25)[0].tolist())
+        C = O.constitutiveMatrices(np.arange(len(O.elements)))
+        KNL = reference(O, strainMatrix2D, C, O.t, L, af, 0.25/L, 1e-2*af(0.0))
+        self.assertTrue(np.allclose(O.KNL.toarray(), KNL, rtol=1e-12,
+                        atol=1e-12*np.abs(KNL).max()))
+
+    def test_parallel_workers(self):
+        """The matrices calculated by several processes must match the matrices calculated in one process
+        """
+        serial = plane(rectangle(), 0.5)
+        parallel = plane(rectangle(), 0.5, workers=2)
+        for A, B in [(serial.KL, parallel.KL), (serial.KNL, parallel.KNL), (serial.M, parallel.M)]:
+            self.assertTrue(np.allclose(A.toarray(), B.toarray(), rtol=1e-12,
+                            atol=1e-12*np.abs(A).max()))
+
+    def test_cache(self):
+        """The matrices loaded from the cache must match the calculated matrices. Changing a nonlocal parameter must not use the cached matrices
+        """
+        with tempfile.TemporaryDirectory() as path:
+            first = plane(rectangle(), 0.5, cache=path, fy=lambda x: -1.0)
+            second = plane(rectangle(), 0.5, cache=path, fy=lambda x: -1.0)
+            self.assertTrue(first.cache.load(second.cacheKey()) is not None)
+            self.assertTrue(np.array_equal(first.K.toarray(), second.K.toarray()))
+            self.assertTrue(np.array_equal(first.M.toarray(), second.M.toarray()))
+            self.assertTrue(np.array_equal(first.F, second.F))
+            other = PlaneStressNonLocalSparse(
+                rectangle(), 20000, 0.2, 0.3, L, 0.5, 0.5, lambda rho: np.exp(-2*rho), rho=1.0, cache=path)
+            self.assertTrue(other.cache.load(other.cacheKey()) is None)
+
+    def test_matrix_free(self):
+        """The matrix free operator must match the assembled matrices and give the same static and eigen value solutions
+        """
+        def problem(**kargs):
+            geometry = rectangle(8, 3)
+            geometry.cbe = [[i, 0.0] for i in range(8)]
+            return PlaneStressNonLocalSparse(geometry, 20000, 0.2, 0.3, L, 0.5, 0.3, af, rho=1.0,
+                                             fy=lambda x: -1.0, cutoff=True, threshold=1e-3, **kargs)
+        O = plane(rectangle(8, 3), 0.3, cutoff=True, threshold=1e-3)
+        F = plane(rectangle(8, 3), 0.3, cutoff=True,
+                  threshold=1e-3, matrixFree=True)
+        x = np.random.default_rng(0).random(O.ngdl)
+        self.assertTrue(np.allclose(F.K@x, O.K@x, rtol=1e-12,
+                        atol=1e-12*np.abs(O.K@x).max()))
+        self.assertTrue(np.allclose(F.K.diagonal(), O.K.diagonal()))
+        G = plane(rectangle(8, 3), 0.3, cutoff=True,
+                  threshold=1e-3, matrixFree=True, onTheFly=True)
+        self.assertTrue(G.KNL.weights is None)
+        self.assertTrue(np.allclose(G.K@x, F.K@x, rtol=1e-12,
+                        atol=1e-12*np.abs(F.K@x).max()))
+        for mode in ('symmetric', 'penalty', 'elimination'):
+            O = problem(ebcMode=mode)
+            O.solve(plot=False)
+            for preconditioner in ('jacobi', 'ilu'):
+                F = problem(ebcMode=mode, matrixFree=True,
+                            solver=IterativeSparse)
+                F.solve(plot=False, preconditioner=preconditioner, rtol=1e-12)
+                self.assertTrue(np.allclose(O.U, F.U, rtol=1e-8,
+                                atol=1e-8*np.abs(O.U).max()))
+        O = problem(ebcMode='elimination', solver=LinealEigen)
+        O.solve(plot=False, k=4)
+        for method in ('shift-invert', 'lobpcg'):
+            F = problem(ebcMode='elimination', matrixFree=True,
+                        solver=LinealEigen)
+            F.solve(plot=False, k=4, method=method, tol=1e-8)
+            self.assertTrue(np.allclose(O.eigv, F.eigv, rtol=1e-6))
+
+    def test_non_homogeneous_gammas(self):
+        """The batched gamma functions must match the Gauss points integration. With a skin region, only the points
+        closer than Lr to the border must be integrated and the cached gamma functions must match the calculated ones
+        """
+        O = PlaneStressNonLocalSparseNonHomogeneous(
+            rectangle(12, 6, 1.2, 0.6), 20000, 0.2, 0.3, L, 0.5, 0.25, af, rho=1.0)
+        gammas = O.gammaFunctions()
+        for i, e in enumerate(O.elements):
+            for k, x in enumerate(e._x):
+                gamma = sum([O.t[i]*af(np.linalg.norm(x-xnl)/L)*w*dj for inl in e.enl
+                             for xnl, w, dj in zip(O.elements[inl]._x, O.elements[inl].W, O.elements[inl].detjac)])
+                self.assertAlmostEqual(gammas[i, k], gamma, delta=1e-12*gamma)
+        points = O.geometry.gaussPoints()
+        distance = np.minimum.reduce([points[..., 0], 1.2-points[..., 0],
+                                      points[..., 1], 0.6-points[..., 1]])
+        skin = distance < 0.25
+        with tempfile.TemporaryDirectory() as path:
+            S = PlaneStressNonLocalSparseNonHomogeneous(
+                rectangle(12, 6, 1.2, 0.6), 20000, 0.2, 0.3, L, 0.5, 0.25, af, rho=1.0, skin=True, cache=path)
+            first = S.gammaFunctions()
+            self.assertTrue(np.array_equal(first, S.gammaFunctions()))
+        self.assertTrue(np.allclose(first[skin], gammas[skin], rtol=1e-12))
+        self.assertTrue(np.allclose(
+            first[~skin], 0.3*interiorGamma(af, L, 0.25)))
+
+    def test_non_homogeneous_kernel(self):
+        """The batched nonlocal matrices of the non homogeneous model must match the Gauss points integration of the gamma and q terms
+        """
+        E = np.linspace(15000, 25000, 6).tolist()
+        O = PlaneStressNonLocalSparseNonHomogeneous(
+            rectangle(3, 2, 0.3, 0.2), E, 0.2, 0.3, L, 0.5, 0.2, af, rho=1.0)
+        O.elementMatrices()
+        O.ensembling()
+        C = O.constitutiveMatrices(np.arange(len(O.elements)))
+        KNL = np.zeros([O.ngdl, O.ngdl])
+        for ee, e in enumerate(O.elements):
+            B = strainMatrix2D(e.dpx)
+            for k in range(len(e.W)):
+                KNL[np.ix_(e.gdlm, e.gdlm)] += 0.3*O.gammas[ee, k]**2*(B[k].T@C[ee]@B[k])
+            for inl in e.enl:
+                enl = O.elements[inl]
+                Bnl = strainMatrix2D(enl.dpx)
+                for k in range(len(e.W)):
+                    for knl in range(len(enl.W)):
+                        q = sum([af(np.linalg.norm(e._x[k]-x2)/L)*af(np.linalg.norm(enl._x[knl]-x2)/L)*C[inl2]*0.3*w*dj
+                                 for inl2 in e.enl for x2, w, dj in zip(O.elements[inl2]._x, O.elements[inl2].W, O.elements[inl2].detjac)])
+                        J = (O.gammas[ee, k]*C[ee]+O.gammas[inl, knl]*C[inl]) * \
+                            af(np.linalg.norm(e._x[k]-enl._x[knl])/L) - q
+                        KNL[np.ix_(e.gdlm, enl.gdlm)] -= 0.09*(B[k].T@J@Bnl[knl])*e.detjac[k] * \
+                            e.W[k]*enl.detjac[knl]*enl.W[knl]
+        self.assertTrue(np.allclose(O.KNL.toarray(), KNL, rtol=1e-12,
+                        atol=1e-12*np.abs(KNL).max()))
+
+    def test_elasticity_kernel(self):
+        """The batched 3D nonlocal matrices must match the Gauss points pairs integration when the pairs have different materials
+        """
+        E = np.linspace(100.0, 200.0, 8)
+        O = NonLocalElasticity(cube(), E, 0.25, 1.0, 0.3, 0.5, 0.9,
+                               lambda rho: np.exp(-rho))
+        O.elementMatrices()
+        O.ensembling()
+        KNL = reference(O, strainMatrix3D, O.C, [1.0]*len(O.elements), 0.3,
+                        lambda rho: np.exp(-rho))
+        self.assertTrue(np.allclose(O.KNL.toarray(), KNL, rtol=1e-12,
+                        atol=1e-12*np.abs(KNL).max()))
+
+
+if __name__ == '__main__':
+    unittest.main()
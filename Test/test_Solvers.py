@@ -0,0 +1,277 @@
+"""Solvers tests"""
+
+from FEM.Geometry import Lineal, Geometry2D, Delaunay
+from FEM.Utils.polygonal import giveCoordsCircle
+from FEM.Torsion2D import Torsion2D
+from FEM.Heat1D import Heat1DTransient
+from FEM.NonLinealExample import NonLinealSimpleEquation
+from FEM.Elasticity2D import PlaneStressSparse, PlaneStressNonLocalSparse, PlaneStressNonLocalSparseNonHomogeneous
+from FEM.Solvers import Hyperbolic, CentralDifference, LinealEigen, IterativeSparse
+from FEM.Assembly import EssentialConditions
+import numpy as np
+import tempfile
+import os
+import unittest
+
+
+def heat(sparse: bool = False) -> Heat1DTransient:
+    geometry = Lineal(1.0, 40, 2)
+    geometry.cbe = [[0, 0.0], [-1, 0.5]]
+    O = Heat1DTransient(geometry, 1.0, 1.0, 1.0, 0.3, 0.1, sparse=sparse)
+    O.set_initial_condition(1.0)
+    O.set_alpha(0.5)
+    return O
+
+
+def circle():
+    vert, _ = giveCoordsCircle([0, 0], 1.0, n=30)
+    params = Delaunay._strdelaunay(
+        constrained=True, delaunay=True, a='0.01', o=2)
+    return Delaunay(vert, params, nvn=1)
+
+
+def cantilever(nex: int = 10, ney: int = 2, L: float = 2.0, h: float = 0.4) -> Geometry2D:
+    x, y = np.meshgrid(np.linspace(0, L, nex+1),
+                       np.linspace(0, h, ney+1), indexing='ij')
+    coords = np.array([x.flatten(), y.flatten()]).T
+    dicc = [[i*(ney+1)+j, (i+1)*(ney+1)+j, (i+1)*(ney+1)+j+1, i*(ney+1)+j+1]
+            for i in range(nex) for j in range(ney)]
+    geometry = Geometry2D(dicc, coords, ['C1V']*len(dicc), nvn=2, fast=True)
+    geometry.generateRegionFromCoords([0, 0], [0, h])
+    region = len(geometry.regions)-1
+    geometry.cbe = geometry.cbFromRegion(
+        region, 0.0, 1) + geometry.cbFromRegion(region, 0.0, 2)
+    return geometry
+
+
+class TestSolvers(unittest.TestCase):
+    """Test the finite element solvers"""
+
+    def test_parabolic_factorization(self):
+        """The parabolic solver must factorize the system matrix only when it changes
+        """
+        solutions = []
+        for sparse in (False, True):
+            O = heat(sparse)
+            O.solve(t0=0, tf=1, steps=20, dt=0.05, plot=False)
+            self.assertEqual(O.solver.factorization.factorizations, 1)
+            factorized = [info.get('factorized')
+                          for info in O.solver.solutions_info]
+            self.assertEqual(factorized.count(True), 1)
+            solutions.append(np.array(O.solver.solutions).reshape(
+                [len(O.solver.solutions), -1]))
+            O.solve(t0=1, tf=2, steps=10, dt=0.1, plot=False)
+            self.assertEqual(O.solver.factorization.factorizations, 2)
+        self.assertTrue(np.allclose(*solutions))
+
+    def test_newton_options(self):
+        """The modified Newton method, the line search and the residual criterion must give the full Newton solution
+        """
+        solutions = []
+        factorizations = []
+        for options in ({}, {'refactor': 3}, {'linesearch': True}, {'rtol': 1e-8, 'tol': 0.0}):
+            geometry = Lineal(1.0, 50, 1)
+            O = NonLinealSimpleEquation(
+                geometry, lambda x: 1, lambda x: -1, sparse=True)
+            O.cbe = [[-1, 2**0.5]]
+            O.cbn = [[0, 0]]
+            O.solve(plot=False, **options)
+            info = O.solver.solutions_info[0]
+            self.assertEqual(info['warnings'], 'No warnings')
+            self.assertEqual(len(info['times']), info['n-it']+1)
+            solutions.append(np.array(O.U).flatten())
+            factorizations.append(info['factorizations'])
+        for U in solutions[1:]:
+            self.assertTrue(np.allclose(solutions[0], U))
+        self.assertTrue(factorizations[1] < factorizations[0])
+
+    def test_sparse_newton(self):
+        """The sparse Newton iterations must reuse the sparsity pattern and give the dense solution
+        """
+        solutions = []
+        for sparse in (False, True):
+            for mode in ('symmetric', 'elimination'):
+                geometry = Lineal(1.0, 10, 1)
+                O = NonLinealSimpleEquation(
+                    geometry, lambda x: 1, lambda x: -1, sparse=sparse, ebcMode=mode)
+                O.cbe = [[-1, 2**0.5]]
+                O.cbn = [[0, 0]]
+                O.solve(plot=False)
+                solutions.append(np.array(O.U).flatten())
+        for U in solutions[1:]:
+            self.assertTrue(np.allclose(solutions[0], U))
+
+    def test_iterative_sparse(self):
+        """The preconditioned iterative solvers must give the direct sparse solution and record the residual history if requested
+        """
+        geometry = circle()
+        O = Torsion2D(geometry, 1000.0, 1.0, sparse=True)
+        O.solve(plot=False)
+        U = O.U.flatten()
+        for mode in ('symmetric', 'elimination'):
+            for method in ('cg', 'minres', 'gmres'):
+                for preconditioner in ('jacobi', 'block-jacobi', 'ilu'):
+                    geometry = circle()
+                    O = Torsion2D(geometry, 1000.0, 1.0,
+                                  sparse=True, solver=IterativeSparse, ebcMode=mode)
+                    O.solve(plot=False, method=method,
+                            preconditioner=preconditioner, rtol=1e-12, restart=100, history=True)
+                    info = O.solution_info
+                    self.assertTrue(np.allclose(U, O.U.flatten(), atol=1e-8))
+                    self.assertEqual(info['iterations'], len(info['residuals']))
+                    self.assertTrue(info['iterations'] > 0)
+        O = Torsion2D(circle(), 1000.0, 1.0, sparse=True, solver=IterativeSparse)
+        O.solve(plot=False, rtol=1e-12)
+        self.assertTrue(np.allclose(U, O.U.flatten(), atol=1e-8))
+        self.assertEqual(O.solution_info['residuals'], [])
+        self.assertTrue(O.solution_info['iterations'] > 0)
+
+    def test_hyperbolic(self):
+        """Newmark method must conserve the energy of the free vibration and the explicit central differences method must give the same vibration
+        """
+        O = PlaneStressSparse(cantilever(), 20000, 0.2,
+                              1.0, rho=1.0, fy=lambda x: -1.0)
+        O.solve(plot=False)
+        U0 = O.U.reshape([-1, 1]).copy()
+        solutions = []
+        for options, steps in (({}, 2000), ({'beta': 0.0, 'lumped': True}, 2000)):
+            O = PlaneStressSparse(cantilever(), 20000, 0.2,
+                                  1.0, rho=1.0, solver=Hyperbolic)
+            O.U = U0.copy()
+            with tempfile.TemporaryDirectory() as folder:
+                path = os.path.join(folder, 'history.npy')
+                O.solve(plot=False, t0=0, tf=0.5, steps=steps,
+                        save=steps//10, path=path, **options)
+                self.assertEqual(np.load(path).shape, (11, O.ngdl, 1))
+                solutions.append(np.array(O.solver.solutions))
+            saved = [info['step'] for info in O.solver.solutions_info]
+            self.assertEqual(saved, list(range(0, steps+1, steps//10)))
+            if not options:
+                ebc = EssentialConditions(O.cbe, O.ngdl)
+                K = ebc.reduce(O.K)
+                M = ebc.reduce(O.M)
+                u0 = ebc.reduceVector(U0)[:, 0]
+                u = ebc.reduceVector(O.U)[:, 0]
+                v = ebc.reduceVector(O.solver.velocity)[:, 0]
+                self.assertAlmostEqual(
+                    u@(K@u)+v@(M@v), u0@(K@u0), delta=1e-8*u0@(K@u0))
+                self.assertEqual(O.solver.factorization.factorizations, 1)
+                K, M, F = O.K.copy(), O.M.copy(), O.F.copy()
+                O.solve(plot=False, t0=0, tf=0.5, steps=10)
+                self.assertEqual(abs(O.K-K).max(), 0.0)
+                self.assertEqual(abs(O.M-M).max(), 0.0)
+                self.assertTrue(np.array_equal(O.F, F))
+            else:
+                self.assertEqual(O.solver.factorization.factorizations, 0)
+        error = np.max(np.abs(solutions[0]-solutions[1]))
+        self.assertTrue(error < 0.1*np.max(np.abs(solutions[0])))
+
+    def test_lumped_mass(self):
+        """HRZ lumping must keep the mass of high order elements with positive entries
+        """
+        geometry = Geometry2D.importJSON(
+            'Test/resources/beam_ws.json', fast=True)
+        O = PlaneStressSparse(geometry, 20000, 0.2, 0.3,
+                              rho=2.0, lumping='hrz')
+        O.elementMatrices()
+        O.ensembling()
+        self.assertTrue(np.all(O.Ml > 0))
+        self.assertAlmostEqual(O.Ml.sum(), O.M.sum())
+
+    def test_central_difference(self):
+        """The explicit method with the critical time step must give the implicit lumped mass vibration without factorizations
+        """
+        O = PlaneStressSparse(cantilever(), 20000, 0.2,
+                              1.0, rho=1.0, fy=lambda x: -1.0)
+        O.solve(plot=False)
+        U0 = O.U.reshape([-1, 1]).copy()
+        O = PlaneStressSparse(cantilever(), 20000, 0.2, 1.0,
+                              rho=1.0, solver=Hyperbolic, lumping='hrz')
+        O.U = U0.copy()
+        O.solve(plot=False, t0=0, tf=0.5, steps=2000, lumped=True)
+        U = O.U.copy()
+        O = PlaneStressSparse(cantilever(), 20000, 0.2, 1.0,
+                              rho=1.0, solver=CentralDifference, lumping='hrz')
+        O.U = U0.copy()
+        O.solve(plot=False, t0=0, tf=0.5)
+        dt = O.solver.solutions_info[-1]['dt']
+        self.assertTrue(dt < O.solver.criticalTimeStep())
+        self.assertAlmostEqual(
+            O.solver.solutions_info[-1]['time'], 0.5, delta=1e-12)
+        self.assertEqual(O.solver.factorization.factorizations, 0)
+        self.assertTrue(np.max(np.abs(O.U-U)) < 0.05*np.max(np.abs(U)))
+
+    def test_eigen_methods(self):
+        """Shift-invert and LOBPCG methods must give the smallest eigenvalues and reuse the shift-invert factorization
+        """
+        eigv = []
+        for method in ('eigsh', 'shift-invert', 'lobpcg'):
+            geometry = Geometry2D.importJSON(
+                'Test/resources/beam_ws.json', fast=True)
+            geometry.cbe = geometry.cbFromRegion(
+                3, 0.0, 1) + geometry.cbFromRegion(3, 0.0, 2)
+            O = PlaneStressSparse(geometry, 20000, 0.2, 0.3, rho=2.0,
+                                  solver=LinealEigen, ebcMode='elimination')
+            O.solve(plot=False, k=4, method=method)
+            info = O.solver.solutions_info
+            self.assertEqual(len(info), 4)
+            self.assertTrue(max(i['residual'] for i in info) < 1e-8)
+            eigv.append(O.eigv.copy())
+            if method == 'shift-invert':
+                self.assertTrue(info[0]['sigma'] < 0)
+                self.assertTrue(info[0]['iterations'] > 0)
+                self.assertTrue(O.solver.sigma is None)
+                O.solve(plot=False, k=2, method=method)
+                self.assertEqual(O.solver.factorization.factorizations, 1)
+        for e in eigv[1:]:
+            self.assertTrue(np.allclose(eigv[0], e, rtol=1e-6))
+
+    def test_nonlocal_sweep(self):
+        """The z1 sweep must give the eigenvalues of independent nonlocal problems and write one result per z1
+        """
+        l = 0.1
+
+        def af(rho):
+            return (1/(2*np.pi*l**2))*np.exp(-rho)
+        O = PlaneStressNonLocalSparse(cantilever(), 20000, 0.2, 1.0, l, 0.5, 6*l, af,
+                                      rho=1.0, ebcMode='elimination')
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'sweep_{z1}.json')
+            solved = []
+            records = O.sweep([1.0, 0.9, 0.5], k=4, path=path, callback=lambda r: solved.append(
+                os.path.exists(r['path'])), method='lobpcg', tol=1e-8)
+            self.assertEqual(solved, [True]*3)
+        self.assertEqual([r['z1'] for r in records], [1.0, 0.9, 0.5])
+        self.assertTrue(records[1]['iterations'] < records[0]['iterations'])
+        for z, record in zip((1.0, 0.5), (records[0], records[2])):
+            O = PlaneStressNonLocalSparse(cantilever(), 20000, 0.2, 1.0, l, z, 6*l, af,
+                                          rho=1.0, solver=LinealEigen, ebcMode='elimination')
+            O.solve(plot=False, k=4)
+            self.assertTrue(np.allclose(O.eigv, record['eigv'], rtol=1e-6))
+
+    def test_nonlocal_repeated_solve(self):
+        """Solving a nonlocal problem again, also after a z1 sweep, must restart the matrices and give the same eigenvalues
+        """
+        l = 0.1
+
+        def af(rho):
+            return (1/(2*np.pi*l**2))*np.exp(-rho)
+        for problem in (PlaneStressNonLocalSparse, PlaneStressNonLocalSparseNonHomogeneous):
+            O = problem(cantilever(), 20000, 0.2, 1.0, l, 0.5, 6*l, af,
+                        rho=1.0, solver=LinealEigen, ebcMode='elimination')
+            O.solve(plot=False, k=4)
+            eigv, K, M = O.eigv.copy(), O.K.copy(), O.M.copy()
+            O.solve(plot=False, k=4)
+            self.assertEqual(abs(O.K-K).max(), 0.0)
+            self.assertEqual(abs(O.M-M).max(), 0.0)
+            # The non homogeneous matrices are not exactly symmetric, so the eigen values change with the starting vector
+            self.assertTrue(np.allclose(O.eigv, eigv, rtol=1e-5))
+        O = PlaneStressNonLocalSparse(cantilever(), 20000, 0.2, 1.0, l, 0.5, 6*l, af,
+                                      rho=1.0, ebcMode='elimination')
+        records = O.sweep([0.5], k=4)
+        O.solve(plot=False, k=4)
+        self.assertTrue(np.allclose(O.eigv, records[0]['eigv'], rtol=1e-6))
+
+
+if __name__ == '__main__':
+    unittest.main()
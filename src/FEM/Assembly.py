@@ -0,0 +1,463 @@
+"""Global matrix assembly using coordinate (COO) triplets and precomputed sparsity patterns.
+
+Element contributions are stored as (row, column, value) triplets in preallocated arrays.
+The global matrix is created only once, in CSR format, summing the duplicated entries.
+When the mesh connectivity does not change, the CSR structure is calculated once and the
+element matrices are accumulated directly in the CSR data array.
+Essential border conditions are also applied over the CSR data array.
+"""
+
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator
+
+
+class TripletBlock():
+    """Element block of a triplet assembler. Used to support the A[np.ix_(gdl, gdl)] += Ke syntax.
+
+    Args:
+        key (tuple): Index tuple created with np.ix_
+    """
+
+    def __init__(self, key: tuple) -> None:
+        """Element block of a triplet assembler. Used to support the A[np.ix_(gdl, gdl)] += Ke syntax.
+
+        Args:
+            key (tuple): Index tuple created with np.ix_
+        """
+        self.key = key
+        self.values = None
+
+    def __iadd__(self, values: np.ndarray) -> 'TripletBlock':
+        self.values = np.asarray(values, dtype=float)
+        return self
+
+    def __isub__(self, values: np.ndarray) -> 'TripletBlock':
+        self.values = -np.asarray(values, dtype=float)
+        return self
+
+
+class TripletAssembler():
+    """Collects element matrices as (row, column, value) triplets and creates the global sparse matrix.
+
+    The assembler can replace a scipy.sparse.lil_matrix inside the elementMatrices methods
+    because it supports the A[np.ix_(rows, cols)] += Ke and A[np.ix_(rows, cols)] -= Ke syntax.
+
+    Args:
+        shape (tuple): Global matrix shape.
+        nnz (int, optional): Expected number of triplets. Used to preallocate the arrays. Defaults to 0.
+    """
+
+    def __init__(self, shape: tuple, nnz: int = 0) -> None:
+        """Collects element matrices as (row, column, value) triplets and creates the global sparse matrix.
+
+        Args:
+            shape (tuple): Global matrix shape.
+            nnz (int, optional): Expected number of triplets. Used to preallocate the arrays. Defaults to 0.
+        """
+        self.shape = tuple(shape)
+        self.rows = np.zeros(nnz, dtype=np.int64)
+        self.cols = np.zeros(nnz, dtype=np.int64)
+        self.values = np.zeros(nnz)
+        self.n = 0
+
+    def reserve(self, n: int) -> None:
+        """Makes room for n additional triplets. The arrays grow geometrically.
+
+        Args:
+            n (int): Number of triplets to be added.
+        """
+        required = self.n + n
+        if required > len(self.values):
+            size = max(required, 2*len(self.values))
+            for name in ('rows', 'cols', 'values'):
+                old = getattr(self, name)
+                new = np.zeros(size, dtype=old.dtype)
+                new[:self.n] = old[:self.n]
+                setattr(self, name, new)
+
+    def add(self, rows: np.ndarray, cols: np.ndarray, values: np.ndarray) -> None:
+        """Adds a dense element block.
+
+        Args:
+            rows (np.ndarray): Global rows of the block.
+            cols (np.ndarray): Global columns of the block.
+            values (np.ndarray): Block values with shape (len(rows), len(cols)).
+        """
+        rows = np.asarray(rows, dtype=np.int64).ravel()
+        cols = np.asarray(cols, dtype=np.int64).ravel()
+        nr, nc = len(rows), len(cols)
+        k = nr*nc
+        self.reserve(k)
+        s = slice(self.n, self.n+k)
+        self.rows[s] = np.repeat(rows, nc)
+        self.cols[s] = np.tile(cols, nr)
+        self.values[s] = np.asarray(values, dtype=float).reshape(k)
+        self.n += k
+
+    def addBatch(self, rows: np.ndarray, values: np.ndarray, cols: np.ndarray = None) -> None:
+        """Adds a batch of element blocks with the same size.
+
+        Args:
+            rows (np.ndarray): Global rows of every block with shape (ne, n).
+            values (np.ndarray): Blocks values with shape (ne, n, nc).
+            cols (np.ndarray, optional): Global columns of every block with shape (ne, nc). If not given, the rows are used. Defaults to None.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if cols is None:
+            cols = rows
+        cols = np.asarray(cols, dtype=np.int64)
+        ne, nr = rows.shape
+        nc = cols.shape[1]
+        k = ne*nr*nc
+        self.reserve(k)
+        s = slice(self.n, self.n+k)
+        self.rows[s] = np.broadcast_to(rows[:, :, None], (ne, nr, nc)).ravel()
+        self.cols[s] = np.broadcast_to(cols[:, None, :], (ne, nr, nc)).ravel()
+        self.values[s] = np.asarray(values, dtype=float).reshape(k)
+        self.n += k
+
+    def __getitem__(self, key: tuple) -> TripletBlock:
+        return TripletBlock(key)
+
+    def __setitem__(self, key: tuple, block: TripletBlock) -> None:
+        if not isinstance(block, TripletBlock) or block.values is None:
+            raise TypeError(
+                'Triplet assemblers only support accumulation (+= or -=) of element blocks.')
+        rows, cols = key
+        self.add(rows, cols, block.values)
+
+    def restart(self) -> None:
+        """Removes all the stored triplets. The allocated memory is kept.
+        """
+        self.n = 0
+
+    def tocoo(self) -> sparse.coo_matrix:
+        """Creates the global matrix in COO format. Duplicated entries are not summed.
+
+        Returns:
+            sparse.coo_matrix: Global matrix
+        """
+        n = self.n
+        return sparse.coo_matrix(
+            (self.values[:n], (self.rows[:n], self.cols[:n])), shape=self.shape)
+
+    def tocsr(self) -> sparse.csr_matrix:
+        """Creates the global matrix in CSR format summing all duplicated entries.
+
+        Returns:
+            sparse.csr_matrix: Global matrix
+        """
+        K = self.tocoo().tocsr()
+        K.sum_duplicates()
+        return K
+
+
+class SparsityPattern():
+    """Global CSR sparsity pattern of a mesh and the scatter map of every element matrix.
+
+    The pattern is calculated once from the elements degrees of freedom. For every element,
+    the map gives the position in the CSR data array of each entry of the flattened element matrix,
+    so reassembling a matrix only accumulates values in the data array.
+
+    Args:
+        gdlm (list): Flattened degrees of freedom of every element.
+        ngdl (int): Number of degrees of freedom of the problem.
+    """
+
+    def __init__(self, gdlm: list, ngdl: int) -> None:
+        """Global CSR sparsity pattern of a mesh and the scatter map of every element matrix.
+
+        Args:
+            gdlm (list): Flattened degrees of freedom of every element.
+            ngdl (int): Number of degrees of freedom of the problem.
+        """
+        self.shape = (ngdl, ngdl)
+        self.nelements = len(gdlm)
+        self.sizes = np.array([len(g) for g in gdlm], dtype=np.int64)
+        self.offsets = np.zeros(self.nelements+1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(self.sizes**2)
+        keys = np.zeros(self.offsets[-1], dtype=np.int64)
+        for n in np.unique(self.sizes):
+            idx = np.where(self.sizes == n)[0]
+            g = np.array([gdlm[i] for i in idx], dtype=np.int64)
+            position = self.offsets[idx][:, None] + np.arange(n*n)
+            keys[position] = (g[:, :, None]*ngdl + g[:, None, :]).reshape(
+                len(idx), n*n)
+        unique, self.slots = np.unique(keys, return_inverse=True)
+        self.slots = self.slots.reshape(-1)
+        self.nnz = len(unique)
+        rows = unique // ngdl
+        template = sparse.csr_matrix(
+            (np.zeros(self.nnz), unique % ngdl, np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=ngdl))])), shape=self.shape)
+        self.indices = template.indices
+        self.indptr = template.indptr
+
+    def matrix(self, data: np.ndarray = None) -> sparse.csr_matrix:
+        """Creates a CSR matrix with the pattern structure.
+
+        Args:
+            data (np.ndarray, optional): Matrix values in CSR order. If not given, a zero matrix is created. Defaults to None.
+
+        Returns:
+            sparse.csr_matrix: Matrix with the pattern structure.
+        """
+        if data is None:
+            data = np.zeros(self.nnz)
+        K = sparse.csr_matrix(
+            (data, self.indices, self.indptr), shape=self.shape, copy=False)
+        K.has_sorted_indices = True
+        K.has_canonical_format = True
+        return K
+
+    def isPatternOf(self, K) -> bool:
+        """Test if a matrix has the pattern structure.
+
+        Args:
+            K: Matrix to be tested.
+
+        Returns:
+            bool: True if the matrix data array can be used with the pattern scatter map.
+        """
+        return sparse.isspmatrix_csr(K) and K.shape == self.shape and K.nnz == self.nnz and len(K.data) == self.nnz
+
+    def elementSlots(self, elements: np.ndarray) -> np.ndarray:
+        """Gives the positions in the CSR data array of the entries of a group of elements with the same size.
+
+        Args:
+            elements (np.ndarray): Element indices.
+
+        Returns:
+            np.ndarray: Data positions with shape (len(elements), n*n).
+        """
+        elements = np.asarray(elements, dtype=np.int64)
+        n = self.sizes[elements[0]]
+        return self.slots[self.offsets[elements][:, None] + np.arange(n*n)]
+
+    def assemble(self, values: list) -> np.ndarray:
+        """Accumulates the matrices of all the elements in the CSR data order.
+
+        Args:
+            values (list): Element matrices in the same order of the elements used to create the pattern.
+
+        Returns:
+            np.ndarray: CSR data array.
+        """
+        values = np.concatenate([np.asarray(v, dtype=float).ravel()
+                                for v in values])
+        return np.bincount(self.slots, values, minlength=self.nnz)
+
+    def scatter(self, data: np.ndarray, elements: np.ndarray, values: np.ndarray) -> None:
+        """Accumulates a batch of element matrices with the same size in a CSR data array.
+
+        Args:
+            data (np.ndarray): CSR data array. Modified in place.
+            elements (np.ndarray): Element indices.
+            values (np.ndarray): Element matrices with shape (len(elements), n, n).
+        """
+        slots = self.elementSlots(elements)
+        data += np.bincount(slots.ravel(), np.asarray(values,
+                            dtype=float).ravel(), minlength=self.nnz)
+
+
+def _diagonal(K: sparse.csr_matrix, mask: np.ndarray) -> tuple:
+    """Finds the diagonal entries of the masked rows in the CSR data array.
+
+    Args:
+        K (sparse.csr_matrix): CSR matrix without duplicated entries.
+        mask (np.ndarray): Boolean mask of the rows.
+
+    Returns:
+        tuple: Row of every stored entry, positions in the data array of the masked diagonal entries and masked rows without a stored diagonal entry.
+    """
+    rows = np.repeat(np.arange(K.shape[0]), np.diff(K.indptr))
+    diagonal = mask[rows] & (rows == K.indices)
+    missing = np.setdiff1d(np.where(mask)[0], rows[diagonal])
+    return rows, diagonal, missing
+
+
+def _addDiagonal(K: sparse.csr_matrix, gdl: np.ndarray, value: float) -> sparse.csr_matrix:
+    if len(gdl):
+        K = K + sparse.csr_matrix((np.zeros(len(gdl))+value,
+                                  (gdl, gdl)), shape=K.shape)
+    return K
+
+
+def setIdentityRows(K: sparse.spmatrix, gdl: np.ndarray) -> sparse.csr_matrix:
+    """Sets to zero the rows and columns of the given degrees of freedom and sets 1 in their diagonal.
+    The operation is done over the CSR data array, so the matrix structure is kept.
+
+    Args:
+        K (sparse.spmatrix): Sparse matrix.
+        gdl (np.ndarray): Degrees of freedom.
+
+    Returns:
+        sparse.csr_matrix: Modified matrix. If K is a CSR matrix, it is modified in place.
+    """
+    K = K.tocsr()
+    K.sum_duplicates()
+    gdl = np.unique(np.asarray(gdl, dtype=np.int64) % K.shape[0])
+    mask = np.zeros(K.shape[0], dtype=bool)
+    mask[gdl] = True
+    rows, diagonal, missing = _diagonal(K, mask)
+    K.data[mask[rows] | mask[K.indices]] = 0.0
+    K.data[diagonal] = 1.0
+    return _addDiagonal(K, missing, 1.0)
+
+
+class EssentialConditions():
+    """Essential (Dirichlet) border conditions applied to global matrices in a single vectorized operation.
+
+    The following strategies are available:
+
+    - symmetric: rows and columns of the prescribed degrees of freedom are set to zero and 1 is set in their diagonal. The prescribed values are moved to the right hand side.
+    - penalty: a large value is added to the diagonal of the prescribed degrees of freedom. The matrix is not modified otherwise.
+    - elimination: the free degrees of freedom block is extracted and the solution is expanded with the prescribed values.
+
+    Sparse matrices are modified over the CSR data array, so they are never converted to dense matrices.
+    Matrix free operators (StiffnessOperator) are not modified, an operator with the border conditions is returned.
+
+    Args:
+        cbe (list): Essential border conditions. Each row is [degree of freedom, value]. If a degree of freedom is repeated, the last value is used.
+        ngdl (int): Number of degrees of freedom of the problem.
+    """
+
+    def __init__(self, cbe: list, ngdl: int) -> None:
+        """Essential (Dirichlet) border conditions applied to global matrices in a single vectorized operation.
+
+        Args:
+            cbe (list): Essential border conditions. Each row is [degree of freedom, value]. If a degree of freedom is repeated, the last value is used.
+            ngdl (int): Number of degrees of freedom of the problem.
+        """
+        cb = np.array(cbe, dtype=float).reshape([-1, 2])
+        gdl = cb[:, 0].astype(np.int64) % ngdl
+        _, last = np.unique(gdl[::-1], return_index=True)
+        last = len(gdl)-1-last
+        self.ngdl = ngdl
+        self.gdl = gdl[last]
+        self.values = cb[last, 1]
+        self.mask = np.zeros(ngdl, dtype=bool)
+        self.mask[self.gdl] = True
+        self.free = np.where(~self.mask)[0]
+        self.u = np.zeros([ngdl, 1])
+        self.u[self.gdl, 0] = self.values
+
+    def lift(self, K) -> np.ndarray:
+        """Calculates the contribution of the prescribed values to the system, K@u, where u has the prescribed values in the constrained degrees of freedom and 0 elsewhere.
+
+        Args:
+            K: Dense or sparse matrix or linear operator.
+
+        Returns:
+            np.ndarray: Vertical vector with shape (ngdl, 1)
+        """
+        if sparse.issparse(K) or isinstance(K, LinearOperator):
+            return np.asarray(K@self.u).reshape([self.ngdl, 1])
+        return K[:, self.gdl]@self.values.reshape([-1, 1])
+
+    def symmetric(self, K):
+        """Sets to zero the rows and columns of the prescribed degrees of freedom and sets 1 in their diagonal.
+
+        Args:
+            K: Dense or sparse matrix or stiffness operator.
+
+        Returns:
+            Modified matrix. Dense and CSR matrices are modified in place.
+        """
+        if isinstance(K, LinearOperator):
+            return K.constrained(self, 'symmetric')
+        if sparse.issparse(K):
+            return setIdentityRows(K, self.gdl)
+        K[self.gdl, :] = 0.0
+        K[:, self.gdl] = 0.0
+        K[self.gdl, self.gdl] = 1.0
+        return K
+
+    def penaltyValue(self, K, factor: float = 1e8) -> float:
+        """Calculates the penalty value as a factor of the largest diagonal entry of the matrix
+
+        Args:
+            K: Dense or sparse matrix.
+            factor (float, optional): Penalty factor. Defaults to 1e8.
+
+        Returns:
+            float: Penalty value
+        """
+        return factor*max(np.max(np.abs(K.diagonal())), 1.0)
+
+    def penalty(self, K, value: float):
+        """Adds the penalty value to the diagonal of the prescribed degrees of freedom.
+
+        Args:
+            K: Dense or sparse matrix or stiffness operator.
+            value (float): Penalty value
+
+        Returns:
+            Modified matrix. Dense and CSR matrices are modified in place.
+        """
+        if isinstance(K, LinearOperator):
+            return K.constrained(self, 'penalty', value)
+        if sparse.issparse(K):
+            K = K.tocsr()
+            K.sum_duplicates()
+            _, diagonal, missing = _diagonal(K, self.mask)
+            K.data[diagonal] += value
+            return _addDiagonal(K, missing, value)
+        K[self.gdl, self.gdl] += value
+        return K
+
+    def penaltyVector(self, value: float) -> np.ndarray:
+        """Gives the right hand side contribution of the penalty method
+
+        Args:
+            value (float): Penalty value
+
+        Returns:
+            np.ndarray: Vertical vector with shape (ngdl, 1)
+        """
+        return self.u*value
+
+    def reduce(self, K):
+        """Extracts the free degrees of freedom block of a matrix (elimination method).
+
+        Args:
+            K: Dense or sparse matrix or stiffness operator.
+
+        Returns:
+            Matrix of the free degrees of freedom. Sparse matrices are returned in CSR format.
+        """
+        if isinstance(K, LinearOperator):
+            return K.constrained(self, 'elimination')
+        if sparse.issparse(K):
+            K = K.tocsr()
+            return K[self.free][:, self.free]
+        return K[np.ix_(self.free, self.free)]
+
+    def reduceVector(self, b: np.ndarray) -> np.ndarray:
+        """Extracts the free degrees of freedom of a vector (elimination method).
+
+        Args:
+            b (np.ndarray): Vector with ngdl rows.
+
+        Returns:
+            np.ndarray: Free degrees of freedom rows
+        """
+        return b[self.free]
+
+    def expand(self, uf: np.ndarray, homogeneous: bool = False) -> np.ndarray:
+        """Creates the complete solution from the free degrees of freedom solution and the prescribed values (elimination method).
+
+        Args:
+            uf (np.ndarray): Free degrees of freedom solution. If it has more than one column, every column is expanded.
+            homogeneous (bool, optional): If True, the prescribed degrees of freedom are set to 0 instead of the prescribed values. Used for increments and mode shapes. Defaults to False.
+
+        Returns:
+            np.ndarray: Complete solution with ngdl rows
+        """
+        uf = np.asarray(uf).reshape([len(self.free), -1])
+        U = np.zeros([self.ngdl, uf.shape[1]])
+        if not homogeneous:
+            U += self.u
+        U[self.free] = uf
+        return U
@@ -0,0 +1,218 @@
+"""Persistent on disk cache of the nonlocal element relations and the global matrices.
+
+Every entry is a directory named with a hash of its content dependencies (nodes, connectivity, element types and
+problem parameters), so any change in them creates a new entry instead of reusing an invalid one.
+The arrays are stored as .npy files and loaded as memory maps, so a cached matrix is only read from disk when used.
+Sparse matrices are stored as their CSR arrays (data, indices and indptr).
+"""
+
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import numpy as np
+from scipy import sparse
+from typing import Callable
+from .Kernels import attenuation
+
+
+def _update(h: 'hashlib._Hash', item) -> None:
+    if isinstance(item, dict):
+        for k in sorted(item):
+            _update(h, k)
+            _update(h, item[k])
+        return
+    if isinstance(item, (list, tuple)) and len(item) and isinstance(item[0], (list, tuple, np.ndarray)):
+        _update(h, np.array([len(i) for i in item]))
+        _update(h, np.concatenate(
+            [np.asarray(i, dtype=float).ravel() for i in item]))
+        return
+    if sparse.issparse(item):
+        item = item.tocsr()
+        _update(h, [item.shape, item.indptr, item.indices, item.data])
+        return
+    a = np.asarray(item)
+    if a.dtype == object:
+        h.update(repr(item).encode())
+        return
+    h.update(f'{a.dtype.str}{a.shape}'.encode())
+    h.update(np.ascontiguousarray(a).tobytes())
+
+
+def contentHash(*items) -> str:
+    """Creates a hash of numbers, strings, arrays, sparse matrices and (ragged) lists of them
+
+    Returns:
+        str: Hexadecimal SHA-256 digest
+    """
+    h = hashlib.sha256()
+    for item in items:
+        _update(h, item)
+        h.update(b'|')
+    return h.hexdigest()
+
+
+def meshHash(geometry: 'Geometry') -> str:
+    """Creates a hash of the geometry nodes, connectivity and element types
+
+    Args:
+        geometry (Geometry): Geometry
+
+    Returns:
+        str: Hexadecimal SHA-256 digest
+    """
+    return contentHash(geometry.gdls, geometry.dictionary, list(geometry.types))
+
+
+def attenuationSamples(af: Callable, rhomax: float, n: int = 257) -> np.ndarray:
+    """Evaluates an attenuation function in equally spaced normalized distances. Functions can not be hashed, so they are identified by their values.
+
+    Args:
+        af (Callable): Attenuation function
+        rhomax (float): Maximum normalized distance
+        n (int, optional): Number of samples. Defaults to 257.
+
+    Returns:
+        np.ndarray: Attenuation values
+    """
+    return attenuation(af, np.linspace(0.0, rhomax, n))
+
+
+def fromCSR(indptr: np.ndarray, indices: np.ndarray) -> list:
+    """Creates the neighbours lists from CSR arrays
+
+    Args:
+        indptr (np.ndarray): Start of the neighbours of every element in indices
+        indices (np.ndarray): Neighbours of all the elements
+
+    Returns:
+        list: Neighbours of every element, as views of the indices array
+    """
+    return np.split(indices, np.asarray(indptr)[1:-1])
+
+
+class NonLocalCache():
+    """Content addressed cache of arrays and sparse matrices stored in a directory
+
+    Args:
+        path (str): Cache directory. It is created if it does not exist
+    """
+
+    def __init__(self, path: str) -> None:
+        """Content addressed cache of arrays and sparse matrices stored in a directory
+
+        Args:
+            path (str): Cache directory. It is created if it does not exist
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def entry(self, key: str) -> str:
+        """Directory of a cache entry
+
+        Args:
+            key (str): Entry hash
+
+        Returns:
+            str: Entry directory
+        """
+        return os.path.join(self.path, key)
+
+    def load(self, key: str) -> dict:
+        """Loads a cache entry. Arrays are loaded as read only memory maps.
+
+        Args:
+            key (str): Entry hash
+
+        Returns:
+            dict: Arrays and sparse matrices of the entry. None if the entry does not exist
+        """
+        folder = self.entry(key)
+        index = os.path.join(folder, 'entry.json')
+        if not os.path.isfile(index):
+            return None
+        with open(index) as f:
+            content = json.load(f)
+        result = {}
+        for name, info in content.items():
+            def array(suffix): return np.load(os.path.join(
+                folder, name+suffix+'.npy'), mmap_mode='r')
+            if info['format'] == 'csr':
+                result[name] = sparse.csr_matrix(
+                    (array('.data'), array('.indices'), array('.indptr')), shape=tuple(info['shape']), copy=False)
+            else:
+                result[name] = array('')
+        logging.info(f'Cache entry {key} loaded')
+        return result
+
+    def save(self, key: str, items: dict) -> None:
+        """Stores a cache entry. The entry is written in a temporary directory and then renamed, so incomplete entries are never loaded.
+
+        Args:
+            key (str): Entry hash
+            items (dict): Arrays and sparse matrices of the entry
+        """
+        folder = self.entry(key)
+        if os.path.isdir(folder):
+            return
+        tmp = tempfile.mkdtemp(prefix='.'+key, dir=self.path)
+        content = {}
+        try:
+            for name, value in items.items():
+                def save(suffix, a): return np.save(
+                    os.path.join(tmp, name+suffix+'.npy'), np.asarray(a))
+                if sparse.issparse(value):
+                    value = value.tocsr()
+                    save('.data', value.data)
+                    save('.indices', value.indices)
+                    save('.indptr', value.indptr)
+                    content[name] = {'format': 'csr',
+                                     'shape': list(value.shape)}
+                else:
+                    save('', value)
+                    content[name] = {'format': 'array'}
+            with open(os.path.join(tmp, 'entry.json'), 'w') as f:
+                json.dump(content, f)
+            os.replace(tmp, folder)
+            logging.info(f'Cache entry {key} saved')
+        except OSError:
+            # Another process stored the same entry
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(folder):
+                raise
+
+    def adjacency(self, geometry: 'Geometry', lr: float, gauss: bool = False) -> tuple:
+        """Nonlocal elements of every element as CSR arrays. If they are not in the cache, they are detected and stored.
+
+        Args:
+            geometry (Geometry): Geometry
+            lr (float): Distance to detect adjacent elements
+            gauss (bool, optional): To detect the elements with at least one pair of Gauss points closer than Lr. Defaults to False.
+
+        Returns:
+            tuple: Start of the neighbours of every element in indices and neighbours of all the elements
+        """
+        key = contentHash('neighbours', meshHash(geometry),
+                          float(lr), bool(gauss))
+        content = self.load(key)
+        if content is not None:
+            return np.asarray(content['indptr']), np.asarray(content['indices'])
+        indptr, indices = geometry.nonlocalAdjacency(lr, gauss=gauss)
+        self.save(key, {'indptr': indptr, 'indices': indices})
+        return indptr, indices
+
+    def neighbours(self, geometry: 'Geometry', lr: float, gauss: bool = False) -> list:
+        """Nonlocal elements of every element. If they are not in the cache, they are detected and stored.
+
+        Args:
+            geometry (Geometry): Geometry
+            lr (float): Distance to detect adjacent elements
+            gauss (bool, optional): To detect the elements with at least one pair of Gauss points closer than Lr. Defaults to False.
+
+        Returns:
+            list: Non local element dictionary
+        """
+        return fromCSR(*self.adjacency(geometry, lr, gauss))
@@ -7,12 +7,14 @@ The individual children classes must implement the method for calculating the el
 from typing import Union, Callable
 from tqdm import tqdm
 import numpy as np
+from scipy import sparse
 from .Geometry import Geometry
-from .Solvers import Lineal, NonLinealSolver, LinealSparse, Solver, Parabolic
+from .Solvers import Lineal, NonLinealSolver, LinealSparse, Solver, Parabolic, Hyperbolic
 import logging
 from .FEMLogger import FEMLogger
 from functools import partialmethod
-from .Elements import Element
+from .Elements import Element, ElementList
+from .Assembly import TripletAssembler, EssentialConditions
 import json
 
 
@@ -23,21 +25,25 @@ class Core():
             geometry (Geometry): Input geometry. The geometry must contain the elements, and the border conditions.
             You can create the geometry of the problem using the Geometry class.
             solver (Union[Lineal, NonLinealSolver], optional): Finite Element solver. If not provided, Lineal solver is used.
-            sparse (bool, optional): To use sparse matrix formulation. Defaults to False
+            sparse (bool, optional): To use sparse matrix formulation. The global matrices use the geometry sparsity pattern. Defaults to False
             verbose (bool, optional): To print console messages and progress bars. Defaults to False.
+            ebcMode (str, optional): Method used to apply the essential border conditions, 'symmetric', 'penalty' or 'elimination'. Defaults to 'symmetric'.
+            workers (int, optional): Number of processes used to calculate the element matrices. Defaults to 1.
 
     """
 
-    def __init__(self, geometry: Geometry, solver: Union[Lineal, NonLinealSolver] = None, sparse: bool = False, verbose: bool = False, name='') -> None:
+    def __init__(self, geometry: Geometry, solver: Union[Lineal, NonLinealSolver] = None, sparse: bool = False, verbose: bool = False, name='', ebcMode: str = 'symmetric', workers: int = 1) -> None:
         """Create the Finite Element problem.
 
             Args:
                 geometry (Geometry): Input geometry. The geometry must contain the elements, and the border conditions.
                 You can create the geometry of the problem using the Geometry class.
                 solver (Union[Lineal, NonLinealSolver], optional): Finite Element solver. If not provided, Lineal solver is used.
-                sparse (bool, optional): To use sparse matrix formulation. Defaults to False
+                sparse (bool, optional): To use sparse matrix formulation. The global matrices use the geometry sparsity pattern. Defaults to False
                 verbose (bool, optional): To print console messages and progress bars. Defaults to False.
                 name (str, optional): To print custom name on logging file. Defaults to ''.
+                ebcMode (str, optional): Method used to apply the essential border conditions, 'symmetric', 'penalty' or 'elimination'. Defaults to 'symmetric'.
+                workers (int, optional): Number of processes used to calculate the element matrices. Defaults to 1.
 
         """
         self.logger: FEMLogger = FEMLogger(name)
@@ -47,15 +53,21 @@ class Core():
             self.logger.setup_logging()
         self.geometry: Geometry = geometry
         self.ngdl: int = self.geometry.ngdl
+        self.sparse: bool = sparse
+        self.ebcMode: str = ebcMode
+        self.workers: int = workers
+        self.ebc: EssentialConditions = None
+        self.cbe: list = self.geometry.cbe
+        self.cbn: list = self.geometry.cbn
+        self.elements: list[Element] = self.geometry.elements
         if not sparse:
             self.K: np.ndarray = np.zeros([self.ngdl, self.ngdl])
+        else:
+            self.K: sparse.csr_matrix = self.geometry.sparsityPattern().matrix()
         self.F: np.ndarray = np.zeros([self.ngdl, 1])
         self.Q: np.ndarray = np.zeros([self.ngdl, 1])
         self.U: np.ndarray = np.zeros([self.ngdl, 1])
         self.S: np.ndarray = np.zeros([self.ngdl, 1])
-        self.cbe: list = self.geometry.cbe
-        self.cbn: list = self.geometry.cbn
-        self.elements: list[Element] = self.geometry.elements
         self.verbose: bool = verbose
         tqdm.__init__ = partialmethod(tqdm.__init__, disable=not verbose)
         self.name: str = 'Generic FEM '
@@ -67,26 +79,49 @@ class Core():
         else:
             self.solver: Solver = solver(self)
         if self.solver.type == 'non-lineal-newton':
-            self.T: np.ndarray = np.zeros([self.ngdl, self.ngdl])
+            if sparse:
+                self.T: sparse.csr_matrix = self.geometry.sparsityPattern().matrix()
+            else:
+                self.T: np.ndarray = np.zeros([self.ngdl, self.ngdl])
         elif self.solver.type == "Base":
             logging.error("Base solver should not be used.")
             raise Exception("Base solver should not be used.")
         self.properties: dict = {'verbose': self.verbose,
-                                 'name': name, 'problem': self.__class__.__name__}
+                                 'name': name, 'problem': self.__class__.__name__, 'workers': self.workers}
 
     def description(self):
         """Generates the problem description for loggin porpuses
         """
         return f'FEM problem using the {self.name} formulation.,DOF: {self.ngdl},Elements: {len(self.elements)},Solver: {self.solver.type},EBC: {len(self.cbe)},NBC: {len(self.cbn)}'
 
+    def sparseAssembler(self) -> TripletAssembler:
+        """Creates an empty triplet assembler with room for all the element matrices
+
+        Returns:
+            TripletAssembler: Triplet assembler with the shape of the global matrix
+        """
+        if isinstance(self.elements, ElementList):
+            gdlm = self.elements.dofs()
+        else:
+            gdlm = [e.gdlm for e in self.elements]
+        nnz = sum([len(g)**2 for g in gdlm])
+        return TripletAssembler((self.ngdl, self.ngdl), nnz)
+
     def ensembling(self) -> None:
         """Ensembling of equation system. This method use the element gdl
         and the element matrices. The element matrices degrees of fredom must
         match the dimension of the element gdl. For m>1 variables per node,
         the gdl will be flattened. This ensure that the element matrices will always
         be a 2-D Numpy Array.
+
+        If the problem is sparse, the element matrices are accumulated in the data
+        array of the CSR matrices using the geometry sparsity pattern.
         """
         logging.info('Ensembling equation system...')
+        if self.sparse:
+            self.sparseEnsembling()
+            logging.info('Done!')
+            return
 
         for e in self.elements:
             self.K[np.ix_(e.gdlm, e.gdlm)] += e.Ke
@@ -101,20 +136,112 @@ class Core():
                     raise e
         logging.info('Done!')
 
+    def sparseEnsembling(self) -> None:
+        """Ensembling of the sparse equation system. The element matrices of all the elements
+        are accumulated in the CSR data arrays in one pass, using the element scatter map
+        of the geometry sparsity pattern.
+        """
+        pattern = self.geometry.sparsityPattern()
+        if not pattern.isPatternOf(self.K):
+            self.K = pattern.matrix()
+        self.K.data += pattern.assemble([e.Ke for e in self.elements])
+        gdl = np.concatenate([e.gdlm for e in self.elements])
+        self.F[:, 0] += np.bincount(gdl, np.concatenate(
+            [e.Fe.ravel() for e in self.elements]), minlength=self.ngdl)
+        self.Q[:, 0] += np.bincount(gdl, np.concatenate(
+            [e.Qe.ravel() for e in self.elements]), minlength=self.ngdl)
+        if 'newton' in self.solver.type:
+            if not pattern.isPatternOf(self.T):
+                self.T = pattern.matrix()
+            try:
+                self.T.data += pattern.assemble(
+                    [e.Te for e in self.elements])
+            except Exception as e:
+                logging.error(
+                    "Impossible to access tangent matrix. Check tangent matrix creation in integration class.")
+                raise e
+
     def restartMatrix(self) -> None:
         """Sets all model matrices and vectors to 0 state
         """
-        self.K[:, :] = 0.0
+        if self.sparse:
+            self.K = self.restartSparse(self.K)
+        else:
+            self.K[:, :] = 0.0
         self.F[:, :] = 0.0
         self.Q[:, :] = 0.0
         self.S[:, :] = 0.0
         if 'newton' in self.solver.type:
             try:
-                self.T[:, :] = 0.0
+                if self.sparse:
+                    self.T = self.restartSparse(self.T)
+                else:
+                    self.T[:, :] = 0.0
             except Exception as e:
                 logging.error("Impossible to clear tangent matrix.")
                 raise e
 
+    def restartSparse(self, K: sparse.csr_matrix) -> sparse.csr_matrix:
+        """Sets a sparse matrix to 0 keeping the geometry sparsity pattern
+
+        Args:
+            K (sparse.csr_matrix): Sparse matrix
+
+        Returns:
+            sparse.csr_matrix: Matrix with zero values and the sparsity pattern structure
+        """
+        pattern = self.geometry.sparsityPattern()
+        if pattern.isPatternOf(K):
+            K.data[:] = 0.0
+            return K
+        return pattern.matrix()
+
+    def naturalConditions(self) -> None:
+        """Assign the natural border conditions to the Q vector
+        """
+        if self.cbn:
+            cb = np.array(self.cbn, dtype=float).reshape([-1, 2])
+            self.Q[cb[:, 0].astype(int), 0] = cb[:, 1]
+
+    def essentialConditions(self, matrices: list) -> None:
+        """Assign the essential border conditions to the system vector and the given matrices.
+        All the border conditions are applied at once. Sparse matrices are kept sparse.
+
+        The method is selected with the ebcMode attribute:
+
+        - symmetric: rows and columns of the prescribed degrees of freedom are set to zero and 1 is set in their diagonal.
+        - penalty: a large value is added to the diagonal of the prescribed degrees of freedom. The mass matrix is not modified.
+        - elimination: the matrices are not modified. The solver solves only the free degrees of freedom and scatters the prescribed values.
+
+        Args:
+            matrices (list): Names of the matrices to be modified.
+        """
+        if not self.cbe:
+            self.S = self.S + self.F + self.Q
+            self.ebc = None
+            return
+        ebc = EssentialConditions(self.cbe, self.ngdl)
+        if self.ebcMode == 'elimination':
+            self.S = self.S + self.F + self.Q
+        elif self.ebcMode == 'symmetric':
+            self.S = self.S - ebc.lift(self.K)
+            for name in matrices:
+                setattr(self, name, ebc.symmetric(getattr(self, name)))
+            self.S = self.S + self.F + self.Q
+            self.S[ebc.gdl, 0] = ebc.values
+        elif self.ebcMode == 'penalty':
+            value = ebc.penaltyValue(self.K)
+            for name in matrices:
+                if not name == 'M':
+                    setattr(self, name, ebc.penalty(
+                        getattr(self, name), value))
+            self.S = self.S + self.F + self.Q + ebc.penaltyVector(value)
+        else:
+            logging.error(f'Unknown essential border conditions mode {self.ebcMode}.')
+            raise Exception(
+                f'Unknown essential border conditions mode {self.ebcMode}.')
+        self.ebc = ebc
+
     def borderConditions(self) -> None:
         """Assign border conditions to the system. 
         The border conditios are assigned in this order:
@@ -126,33 +253,11 @@ class Core():
         the essential border conditions will be applied.
         """
         logging.info('Border conditions...')
-        for i in tqdm(self.cbn, unit=' Natural'):
-            self.Q[int(i[0])] = i[1]
-
-        if self.cbe:
-            border_conditions = np.zeros([self.ngdl, 1])
-            cb = np.array(self.cbe)
-            ncb = len(cb)
-            border_conditions[np.ix_(cb[:, 0].astype(int))
-                              ] = cb[:, 1].reshape([ncb, 1])
-            # FIXME esto puede resultar en pasar la matriz dwe lil a densa!!
-            self.S = self.S - (border_conditions.T@self.K).T
-            for i in tqdm(self.cbe, unit=' Essential'):
-                self.K[int(i[0]), :] = 0
-                self.K[:, int(i[0])] = 0
-                self.K[int(i[0]), int(i[0])] = 1
-                if 'newton' in self.solver.type:
-                    try:
-                        self.T[int(i[0]), :] = 0
-                        self.T[:, int(i[0])] = 0
-                        self.T[int(i[0]), int(i[0])] = 1
-                    except Exception as e:
-                        logging.error("Impossible to access tangent matrix.")
-                        raise e
-
-        self.S = self.S + self.F + self.Q
-        for i in self.cbe:
-            self.S[int(i[0])] = i[1]
+        self.naturalConditions()
+        matrices = ['K']
+        if 'newton' in self.solver.type:
+            matrices.append('T')
+        self.essentialConditions(matrices)
         logging.info('Done!')
 
     def condensedSystem(self) -> None:
@@ -165,40 +270,14 @@ class Core():
         This ensures that in a node with 2 border conditions
         the essential border conditions will be applied.
         """
-        # FIXME tiene que funcionar para todos los casos
-        # self.borderConditions()
         logging.info('Border conditions...')
-        for i in tqdm(self.cbn, unit=' Natural'):
-            self.Q[int(i[0])] = i[1]
-
-        if self.cbe:
-            border_conditions = np.zeros([self.ngdl, 1])
-            cb = np.array(self.cbe)
-            ncb = len(cb)
-            border_conditions[np.ix_(cb[:, 0].astype(int))
-                              ] = cb[:, 1].reshape([ncb, 1])
-            # FIXME esto puede resultar en pasar la matriz dwe lil a densa!!
-            self.S = self.S - (border_conditions.T@self.K).T
-            for i in tqdm(self.cbe, unit=' Essential'):
-                self.K[int(i[0]), :] = 0
-                self.K[:, int(i[0])] = 0
-                self.K[int(i[0]), int(i[0])] = 1
-                if self.calculateMass:
-                    self.M[int(i[0]), :] = 0
-                    self.M[:, int(i[0])] = 0
-                    self.M[int(i[0]), int(i[0])] = 1
-                if 'newton' in self.solver.type:
-                    try:
-                        self.T[int(i[0]), :] = 0
-                        self.T[:, int(i[0])] = 0
-                        self.T[int(i[0]), int(i[0])] = 1
-                    except Exception as e:
-                        logging.error("Impossible to access tangent matrix.")
-                        raise e
-
-        self.S = self.S + self.F + self.Q
-        for i in self.cbe:
-            self.S[int(i[0])] = i[1]
+        self.naturalConditions()
+        matrices = ['K']
+        if self.calculateMass:
+            matrices.append('M')
+        if 'newton' in self.solver.type:
+            matrices.append('T')
+        self.essentialConditions(matrices)
         logging.info('Done!')
 
     def solveES(self, **kargs) -> None:
@@ -225,6 +304,19 @@ class Core():
         self.properties['duration'] = duration
         logging.info("End!")
 
+    def setElementsSolution(self, U: np.ndarray) -> None:
+        """Assigns the local solution of every element. If the elements are stored in blocks,
+        the solution is assigned to the block arrays without creating the element objects.
+
+        Args:
+                U (np.ndarray): Global solution
+        """
+        if isinstance(self.elements, ElementList):
+            self.elements.setUe(U)
+            return
+        for e in self.elements:
+            e.setUe(U)
+
     def solveFromFile(self, file: str, plot: bool = True, **kargs) -> None:
         """Load a solution file and show the post process for a given geometry
 
@@ -234,8 +326,7 @@ class Core():
         """
         logging.info('Loading File...')
         self.U = np.loadtxt(file)
-        for e in self.elements:
-            e.setUe(self.U)
+        self.setElementsSolution(self.U)
         logging.info('Done!')
         if plot:
             logging.info('Post processing solution...')
@@ -251,8 +342,7 @@ class Core():
         """
         logging.info('Casting solution')
         self.U = solution
-        for e in self.elements:
-            e.setUe(self.U)
+        self.setElementsSolution(self.U)
         logging.info('Done!')
         if plot:
             logging.info('Post processing solution...')
@@ -294,9 +384,9 @@ class CoreTransient(Core):
     """docstring for CoreTransient
     """
 
-    def __init__(self, geometry: Geometry, solver: Solver = None, verbose: bool = False, name='') -> None:
+    def __init__(self, geometry: Geometry, solver: Solver = None, verbose: bool = False, name='', sparse: bool = False, ebcMode: str = 'symmetric', workers: int = 1) -> None:
         Core.__init__(self, geometry=geometry, solver=solver,
-                      verbose=verbose, name=name, sparse=False)
+                      verbose=verbose, name=name, sparse=sparse, ebcMode=ebcMode, workers=workers)
         self.dt: float = 0.1
         self.t: float = 0.0
 
@@ -322,6 +412,10 @@ class CoreTransient(Core):
 
     def ensembling(self) -> None:
         logging.info('Ensembling equation system...')
+        if self.sparse:
+            self.sparseEnsembling()
+            logging.info('Done!')
+            return
         for e in self.elements:
             self.K[np.ix_(e.gdlm, e.gdlm)] += e.Ke
             self.F[np.ix_(e.gdlm)] += e.Fe
@@ -332,11 +426,11 @@ class CoreParabolic(CoreTransient):
     """docstring for CoreParabolic
     """
 
-    def __init__(self, geometry: Geometry, solver: Solver = None, verbose: bool = False, name=''):
+    def __init__(self, geometry: Geometry, solver: Solver = None, verbose: bool = False, name='', sparse: bool = False, ebcMode: str = 'symmetric', workers: int = 1):
         if not solver:
             solver = Parabolic
         CoreTransient.__init__(self, geometry=geometry, solver=solver,
-                               verbose=verbose, name=name)
+                               verbose=verbose, name=name, sparse=sparse, ebcMode=ebcMode, workers=workers)
 
         self.alpha: float = 0.5  # Crack nocholson. Subclases maybe???
 
@@ -354,9 +448,16 @@ class CoreHiperbolic(CoreTransient):
     """docstring for CoreParabolic
     """
 
-    def __init__(self, geometry: Geometry, solver: Solver = None, verbose: bool = False, name=''):
+    def __init__(self, geometry: Geometry, solver: Solver = None, verbose: bool = False, name='', sparse: bool = False, ebcMode: str = 'symmetric', workers: int = 1):
+        if not solver:
+            solver = Hyperbolic
         CoreTransient.__init__(self, geometry=geometry, solver=solver,
-                               verbose=verbose, name=name)
+                               verbose=verbose, name=name, sparse=sparse, ebcMode=ebcMode, workers=workers)
+        self.calculateMass = True
+        if sparse:
+            self.M = self.geometry.sparsityPattern().matrix()
+        else:
+            self.M = np.zeros([self.ngdl, self.ngdl])
         self.U_dot: np.ndarray = np.zeros([self.ngdl, 1])
         self.U_dot_dot: np.ndarray = np.zeros([self.ngdl, 1])
         self.du0: list[float] = [0.0]*self.ngdl
@@ -393,4 +494,17 @@ class CoreHiperbolic(CoreTransient):
         self.U[:, 0] = self.u0
         self.dU[:, 0] = self.du0
         self.ddU[:, 0] = self.ddu0
-        self.solver.setSolution(-1, True)
+        for i in self.cbe:
+            self.U[int(i[0]), 0] = i[1]
+        self.setElementsSolution(self.U)
+
+    def ensembling(self) -> None:
+        CoreTransient.ensembling(self)
+        if self.sparse:
+            pattern = self.geometry.sparsityPattern()
+            if not pattern.isPatternOf(self.M):
+                self.M = pattern.matrix()
+            self.M.data += pattern.assemble([e.Me for e in self.elements])
+            return
+        for e in self.elements:
+            self.M[np.ix_(e.gdlm, e.gdlm)] += e.Me
@@ -8,12 +8,16 @@ import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib import gridspec
 from tqdm import tqdm
-from scipy import sparse
 
-from .Solvers import LinealSparse
+from .Solvers import LinealSparse, LinealEigen
 
 
 from .Core import Core, Geometry, logging
+from .Assembly import TripletAssembler
+from .Operators import NonLocalOperator, StiffnessOperator
+from .Parallel import parallelTasks, parallelMap
+from .Cache import NonLocalCache, contentHash, meshHash, attenuationSamples, fromCSR
+from .Kernels import elementGroups, elementDofs, gaussPointsGeometry, strainMatrix2D, stiffnessMatrices, massMatrices, lumpedMasses, loadVectors, nonlocalGeometry, nonlocalElementMatrices, symmetricNeighbours, gammaFunctions, interiorGamma, attenuation
 
 
 class PlaneStressOrthotropic(Core):
@@ -30,9 +34,10 @@ class PlaneStressOrthotropic(Core):
             rho (Tuple[float, list], optional): Density. If not given, mass matrix will not be calculated. Defaults to None.
             fx (Callable, optional): Force in x direction. Defaults to lambdax:0.
             fy (Callable, optional): Force in y direction. Defaults to lambdax:0.
+            lumping (str, optional): Mass lumping method, 'rowsum' or 'hrz'. If given, the diagonal of the lumped mass matrix is stored in the Ml vector. Only used by the sparse formulation. Defaults to None.
         """
 
-    def __init__(self, geometry: Geometry, E1: Tuple[float, list], E2: Tuple[float, list], G12: Tuple[float, list], v12: Tuple[float, list], t: Tuple[float, list], rho: Tuple[float, list] = None, fx: Callable = lambda x: 0, fy: Callable = lambda x: 0, **kargs) -> None:
+    def __init__(self, geometry: Geometry, E1: Tuple[float, list], E2: Tuple[float, list], G12: Tuple[float, list], v12: Tuple[float, list], t: Tuple[float, list], rho: Tuple[float, list] = None, fx: Callable = lambda x: 0, fy: Callable = lambda x: 0, lumping: str = None, **kargs) -> None:
         """Creates a plane stress problem with orthotropic formulation
 
         Args:
@@ -45,6 +50,7 @@ class PlaneStressOrthotropic(Core):
             rho (Tuple[float, list], optional): Density. If not given, mass matrix will not be calculated. Defaults to None.
             fx (Callable, optional): Force in x direction. Defaults to lambdax:0.
             fy (Callable, optional): Force in y direction. Defaults to lambdax:0.
+            lumping (str, optional): Mass lumping method, 'rowsum' or 'hrz'. If given, the diagonal of the lumped mass matrix is stored in the Ml vector. Only used by the sparse formulation. Defaults to None.
         """
         if isinstance(t, float) or isinstance(t, int):
             t = [t]*len(geometry.elements)
@@ -61,7 +67,10 @@ class PlaneStressOrthotropic(Core):
         if rho:
             if isinstance(rho, int) or isinstance(rho, float):
                 self.rho = [rho]*len(geometry.elements)
+            else:
+                self.rho = rho
             self.calculateMass = True
+        self.lumping = lumping
         self.t = t
         self.E1 = E1
         self.E2 = E2
@@ -103,75 +112,115 @@ class PlaneStressOrthotropic(Core):
         self.properties['t'] = self.t
         self.properties['rho'] = self.rho
         self.properties['calculateMass'] = self.calculateMass
+        self.properties['lumping'] = self.lumping
 
     def elementMatrices(self) -> None:
-        """Calculate the element matrices usign Reddy's (2005) finite element model
+        """Calculate the element matrices usign Reddy's (2005) finite element model.
+        The elements are grouped by type and the matrices of each group are calculated with stacked arrays.
         """
 
-        for ee, e in enumerate(tqdm(self.elements, unit='Element')):
-            m = len(e.gdl.T)
-            Fux = np.zeros([m, 1])
-            Fvx = np.zeros([m, 1])
-            # Gauss points in global coordinates and Shape functions evaluated in gauss points
-            _x, _p = e.T(e.Z.T)
-            # Jacobian evaluated in gauss points and shape functions derivatives in natural coordinates
-            jac, dpz = e.J(e.Z.T)
-            detjac = np.linalg.det(jac)
-            _j = np.linalg.inv(jac)  # Jacobian inverse
-            dpx = _j @ dpz  # Shape function derivatives in global coordinates
-            c11 = self.C11[ee]
-            c12 = self.C12[ee]
-            c22 = self.C22[ee]
-            c66 = self.C66[ee]
-            C = np.array([
-                [c11, c12, 0.0],
-                [c12, c22, 0.0],
-                [0.0, 0.0, c66]])
-
-            Fe = np.zeros([2*m, 1])
-            Ke = np.zeros([2*m, 2*m])
-            if self.calculateMass:
-                Me = np.zeros([2*m, 2*m])
-
-            o = [0.0]*m
-            for k in range(len(e.Z)):  # Iterate over gauss points on domain
-                B = np.array([
-                    [*dpx[k, 0, :], *o],
-                    [*o, *dpx[k, 1, :]],
-                    [*dpx[k, 1, :], *dpx[k, 0, :]]])
-
-                P = np.array([
-                    [*_p[k], *o],
-                    [*o, *_p[k]]])
-                Ke += self.t[ee]*(B.T@C@B)*detjac[k]*e.W[k]
+        tasks = parallelTasks(elementGroups(self.elements), self.workers)
+        results = parallelMap(self, 'groupMatrices', tasks, self.workers)
+        for idx, (Ke, Fe, Me) in zip(tasks, tqdm(results, total=len(tasks), unit='Group')):
+            for i, ee in enumerate(idx):
+                e = self.elements[ee]
+                e.Ke = Ke[i]
+                e.Fe = Fe[i].reshape([-1, 1])
                 if self.calculateMass:
-                    Me += self.rho[ee]*self.t[ee]*(P.T@P)*detjac[k]*e.W[k]
-                Fe += self.t[ee]*(P.T@np.array([[self.fx(_x[k])],
-                                                [self.fy(_x[k])]]))*detjac[k]*e.W[k]
-
-            if e.intBorders:  # Cambiar esto a la notación matricial
-                for j in range(len(e.borders)):
-                    border = e.borders[j]
-                    if (len(border.properties['load_x']) + len(border.properties['load_y'])):
-                        _x, _p = e.T(e.Tj[j](border.Z.T))
-                        _s = border.TS(border.Z.T)
-                        detjac = border.coords[-1, 0]*0.5
-                        for i in range(m):
-                            for fx in border.properties['load_x']:
-                                for k in range(len(border.Z)):
-                                    Fux[i, 0] += fx(_s[k, 0])*_p[k, i] * \
-                                        detjac*border.W[k]
-                            for fy in border.properties['load_y']:
-                                for k in range(len(border.Z)):
-                                    Fvx[i, 0] += fy(_s[k, 0])*_p[k, i] * \
-                                        detjac*border.W[k]
-            subm = np.linspace(0, 2*m-1, 2*m).reshape([2, m]).astype(int)
-            e.Fe = Fe
-            e.Ke = Ke
-            if self.calculateMass:
-                e.Me = Me
-            e.Fe[np.ix_(subm[0])] += Fux
-            e.Fe[np.ix_(subm[1])] += Fvx
+                    e.Me = Me[i]
+
+    def constitutiveMatrices(self, idx: np.ndarray) -> np.ndarray:
+        """Creates the constitutive matrices of a group of elements
+
+        Args:
+            idx (np.ndarray): Element indices
+
+        Returns:
+            np.ndarray: Constitutive matrices with shape (ne, 3, 3)
+        """
+        C = np.zeros([len(idx), 3, 3])
+        C[:, 0, 0] = np.array(self.C11)[idx]
+        C[:, 0, 1] = np.array(self.C12)[idx]
+        C[:, 1, 0] = np.array(self.C12)[idx]
+        C[:, 1, 1] = np.array(self.C22)[idx]
+        C[:, 2, 2] = np.array(self.C66)[idx]
+        return C
+
+    def waveSpeeds(self) -> np.ndarray:
+        """Calculates the largest elastic wave speed of every element. Used to estimate the critical time step of explicit methods.
+
+        Returns:
+            np.ndarray: Wave speeds
+        """
+        C = np.maximum(np.array(self.C11), np.array(self.C22))
+        return np.sqrt(C/np.array(self.rho, dtype=float))
+
+    def groupMatrices(self, idx: np.ndarray) -> tuple:
+        """Calculates the stiffness matrices, force vectors and mass matrices of a group of elements with the same type
+
+        Args:
+            idx (np.ndarray): Element indices
+
+        Returns:
+            tuple: Stiffness matrices (ne, 2m, 2m), force vectors (ne, 2m) and mass matrices (ne, 2m, 2m). If mass is not calculated, mass matrices are None.
+        """
+        _x, _p, dpx, dv = gaussPointsGeometry(self.elements, idx)
+        w = np.array(self.t, dtype=float)[idx][:, None]*dv
+        B = strainMatrix2D(dpx)
+        Ke = stiffnessMatrices(B, self.constitutiveMatrices(idx), w)
+        Fe = loadVectors([self.fx, self.fy], _x, _p, w)
+        Me = None
+        if self.calculateMass:
+            Me = massMatrices(_p, 2, np.array(self.rho, dtype=float)[
+                              idx][:, None]*w)
+        for i in np.where(self.geometry.intBorders[idx])[0]:
+            Fe[i] += self.borderLoads(self.elements[idx[i]])
+        return Ke, Fe, Me
+
+    def groupLoads(self, idx: np.ndarray) -> np.ndarray:
+        """Calculates the force vectors of a group of elements with the same type
+
+        Args:
+            idx (np.ndarray): Element indices
+
+        Returns:
+            np.ndarray: Force vectors (ne, 2m)
+        """
+        _x, _p, _, dv = gaussPointsGeometry(self.elements, idx)
+        w = np.array(self.t, dtype=float)[idx][:, None]*dv
+        Fe = loadVectors([self.fx, self.fy], _x, _p, w)
+        for i in np.where(self.geometry.intBorders[idx])[0]:
+            Fe[i] += self.borderLoads(self.elements[idx[i]])
+        return Fe
+
+    def borderLoads(self, e: 'Element') -> np.ndarray:
+        """Calculates the force vector of the loads applied over the element borders
+
+        Args:
+            e (Element): Element
+
+        Returns:
+            np.ndarray: Force vector with shape (2m,)
+        """
+        m = len(e.gdl.T)
+        Fux = np.zeros([m, 1])
+        Fvx = np.zeros([m, 1])
+        for j in range(len(e.borders)):
+            border = e.borders[j]
+            if (len(border.properties['load_x']) + len(border.properties['load_y'])):
+                _x, _p = e.borderT(j)
+                _s = border.TS(border.Z.T)
+                detjac = border.coords[-1, 0]*0.5
+                for i in range(m):
+                    for fx in border.properties['load_x']:
+                        for k in range(len(border.Z)):
+                            Fux[i, 0] += fx(_s[k, 0])*_p[k, i] * \
+                                detjac*border.W[k]
+                    for fy in border.properties['load_y']:
+                        for k in range(len(border.Z)):
+                            Fvx[i, 0] += fy(_s[k, 0])*_p[k, i] * \
+                                detjac*border.W[k]
+        return np.concatenate([Fux[:, 0], Fvx[:, 0]])
 
     def postProcess(self, mult: float = 1000, gs=None, levels=1000, **kargs) -> None:
         """Generate the stress surfaces and displacement fields for the geometry
@@ -361,85 +410,38 @@ class PlaneStressOrthotropicSparse(PlaneStressOrthotropic):
             geometry.initialize()
         PlaneStressOrthotropic.__init__(
             self, geometry, E1, E2, G12, v12, t, rho, fx, fy, sparse=True, **kargs)
-        self.K = sparse.lil_matrix((self.ngdl, self.ngdl))
         if self.calculateMass:
-            self.M = sparse.lil_matrix((self.ngdl, self.ngdl))
+            self.M = self.geometry.sparsityPattern().matrix()
+        if self.calculateMass and self.lumping:
+            self.Ml = np.zeros(self.ngdl)
         self.name = 'Plane Stress Orthotropic sparse'
 
     def elementMatrices(self) -> None:
-        """Calculate the element matrices usign Reddy's (2005) finite element model
+        """Calculate the element matrices usign Reddy's (2005) finite element model.
+        The matrices of each group of elements are accumulated directly in the CSR data arrays.
         """
-
-        for ee, e in enumerate(tqdm(self.elements, unit='Element')):
-            m = len(e.gdl.T)
-            Fux = np.zeros([m, 1])
-            Fvx = np.zeros([m, 1])
-            # Gauss points in global coordinates and Shape functions evaluated in gauss points
-            _x, _p = e.T(e.Z.T)
-            # Jacobian evaluated in gauss points and shape functions derivatives in natural coordinates
-            jac, dpz = e.J(e.Z.T)
-            detjac = np.linalg.det(jac)
-            _j = np.linalg.inv(jac)  # Jacobian inverse
-            dpx = _j @ dpz  # Shape function derivatives in global coordinates
-            c11 = self.C11[ee]
-            c12 = self.C12[ee]
-            c22 = self.C22[ee]
-            c66 = self.C66[ee]
-            C = np.array([
-                [c11, c12, 0.0],
-                [c12, c22, 0.0],
-                [0.0, 0.0, c66]])
-
-            Fe = np.zeros([2*m, 1])
-            Ke = np.zeros([2*m, 2*m])
-            if self.calculateMass:
-                Me = np.zeros([2*m, 2*m])
-
-            o = [0.0]*m
-            for k in range(len(e.Z)):  # Iterate over gauss points on domain
-                B = np.array([
-                    [*dpx[k, 0, :], *o],
-                    [*o, *dpx[k, 1, :]],
-                    [*dpx[k, 1, :], *dpx[k, 0, :]]])
-
-                P = np.array([
-                    [*_p[k], *o],
-                    [*o, *_p[k]]])
-                Ke += self.t[ee]*(B.T@C@B)*detjac[k]*e.W[k]
-                if self.calculateMass:
-                    Me += self.rho[ee]*self.t[ee]*(P.T@P)*detjac[k]*e.W[k]
-                Fe += self.t[ee]*(P.T@np.array([[self.fx(_x[k])],
-                                                [self.fy(_x[k])]]))*detjac[k]*e.W[k]
-
-            if e.intBorders:  # Cambiar esto a la notación matricial
-                for j in range(len(e.borders)):
-                    border = e.borders[j]
-                    if (len(border.properties['load_x']) + len(border.properties['load_y'])):
-                        _x, _p = e.T(e.Tj[j](border.Z.T))
-                        _s = border.TS(border.Z.T)
-                        detjac = border.coords[-1, 0]*0.5
-                        for i in range(m):
-                            for fx in border.properties['load_x']:
-                                for k in range(len(border.Z)):
-                                    Fux[i, 0] += fx(_s[k, 0])*_p[k, i] * \
-                                        detjac*border.W[k]
-                            for fy in border.properties['load_y']:
-                                for k in range(len(border.Z)):
-                                    Fvx[i, 0] += fy(_s[k, 0])*_p[k, i] * \
-                                        detjac*border.W[k]
-            subm = np.linspace(0, 2*m-1, 2*m).reshape([2, m]).astype(int)
-            Fe[np.ix_(subm[0])] += Fux
-            Fe[np.ix_(subm[1])] += Fvx
-            self.F[np.ix_(e.gdlm)] += Fe
-
-            self.K[np.ix_(e.gdlm, e.gdlm)] += Ke
-
+        pattern = self.geometry.sparsityPattern()
+        if not pattern.isPatternOf(self.K):
+            self.K = pattern.matrix()
+        if self.calculateMass and not pattern.isPatternOf(self.M):
+            self.M = pattern.matrix()
+        tasks = parallelTasks(elementGroups(self.elements), self.workers)
+        results = parallelMap(self, 'groupMatrices', tasks, self.workers)
+        for idx, (Ke, Fe, Me) in zip(tasks, tqdm(results, total=len(tasks), unit='Group')):
+            gdlm = elementDofs(self.elements, idx)
+            pattern.scatter(self.K.data, idx, Ke)
+            self.F[:, 0] += np.bincount(gdlm.ravel(),
+                                        Fe.ravel(), minlength=self.ngdl)
             if self.calculateMass:
-                self.M[np.ix_(e.gdlm, e.gdlm)] += Me
+                pattern.scatter(self.M.data, idx, Me)
+                if self.lumping:
+                    self.Ml += np.bincount(gdlm.ravel(), lumpedMasses(
+                        Me, 2, self.lumping).ravel(), minlength=self.ngdl)
 
     def ensembling(self) -> None:
         """Creation of the system sparse matrix. Force vector is ensembled in integration method"""
         logging.info('Ensembling equation system...')
+        self.K = self.K.tocsr()
         if self.calculateMass:
             self.M = self.M.tocsr()
         logging.info('Done!')
@@ -607,9 +609,14 @@ class PlaneStressNonLocalSparse(PlaneStressSparse):
                 rho (int or float or list, optional): Density. If not given, mass matrix will not be calculated. Defaults to None.
                 fx (function, optional): Function fx, if fx is constant you can use fx = lambda x: [value]. Defaults to lambda x:0.
                 fy (function, optional): Function fy, if fy is constant you can use fy = lambda x: [value]. Defaults to lambda x:0.
+                cache (str, optional): Directory of the persistent cache of the nonlocal elements and the global matrices. If not given, nothing is cached. Defaults to None.
+                cutoff (bool, optional): To integrate only the Gauss points pairs closer than Lr. The nonlocal elements are the elements with at least one Gauss point closer than Lr. Defaults to False.
+                threshold (float, optional): Gauss points pairs with attenuation lower than threshold*af(0) are not integrated. Defaults to None.
+                matrixFree (bool, optional): To apply the nonlocal matrix without assembling it, so K is a StiffnessOperator. The global matrices are not cached. It must be solved with IterativeSparse or LinealEigen. Defaults to False.
+                onTheFly (bool, optional): To calculate the attenuation of the Gauss points pairs of the matrix free problem in every product instead of storing it. The stored attenuation is faster but it can need more memory than the assembled nonlocal matrix. Defaults to False.
         """
 
-    def __init__(self, geometry: Geometry, E: Tuple[float, list], v: Tuple[float, list], t: Tuple[float, list], l: float, z1: float, Lr: float, af: Callable, rho: Tuple[float, list] = None, fx: Callable = lambda x: 0, fy: Callable = lambda x: 0, notCalculateNonLocal=True, **kargs) -> None:
+    def __init__(self, geometry: Geometry, E: Tuple[float, list], v: Tuple[float, list], t: Tuple[float, list], l: float, z1: float, Lr: float, af: Callable, rho: Tuple[float, list] = None, fx: Callable = lambda x: 0, fy: Callable = lambda x: 0, notCalculateNonLocal=True, cache: str = None, cutoff: bool = False, threshold: float = None, matrixFree: bool = False, onTheFly: bool = False, **kargs) -> None:
         """Create a Plain Stress nonlocal problem using sparse matrices and the Pisano 2006 formulation.
 
         Args:
@@ -624,6 +631,11 @@ class PlaneStressNonLocalSparse(PlaneStressSparse):
                 rho (int or float or list, optional): Density. If not given, mass matrix will not be calculated. Defaults to None.
                 fx (function, optional): Function fx, if fx is constant you can use fx = lambda x: [value]. Defaults to lambda x:0.
                 fy (function, optional): Function fy, if fy is constant you can use fy = lambda x: [value]. Defaults to lambda x:0.
+                cache (str, optional): Directory of the persistent cache of the nonlocal elements and the global matrices. If not given, nothing is cached. Defaults to None.
+                cutoff (bool, optional): To integrate only the Gauss points pairs closer than Lr. The nonlocal elements are the elements with at least one Gauss point closer than Lr. Defaults to False.
+                threshold (float, optional): Gauss points pairs with attenuation lower than threshold*af(0) are not integrated. Defaults to None.
+                matrixFree (bool, optional): To apply the nonlocal matrix without assembling it, so K is a StiffnessOperator. The global matrices are not cached. It must be solved with IterativeSparse or LinealEigen. Defaults to False.
+                onTheFly (bool, optional): To calculate the attenuation of the Gauss points pairs of the matrix free problem in every product instead of storing it. The stored attenuation is faster but it can need more memory than the assembled nonlocal matrix. Defaults to False.
         """
 
         self.l = l
@@ -639,123 +651,153 @@ class PlaneStressNonLocalSparse(PlaneStressSparse):
         self.properties['af'] = None
         self.properties['z1'] = self.z1
         self.properties['z2'] = self.z2
+        self.properties['cache'] = cache
+        self.properties['cutoff'] = cutoff
+        self.properties['threshold'] = threshold
+        self.properties['matrixFree'] = matrixFree
+        self.properties['onTheFly'] = onTheFly
+        self.cutoff = cutoff
+        self.threshold = threshold
+        self.matrixFree = matrixFree
+        self.onTheFly = onTheFly
+        self.cache = None
+        if cache:
+            self.cache = NonLocalCache(cache)
         if notCalculateNonLocal:
-            nonlocals = self.geometry.detectNonLocal(Lr)
-            for e, dno in zip(self.elements, nonlocals):
-                e.enl = dno
+            if self.cache:
+                indptr, indices = self.cache.adjacency(
+                    self.geometry, Lr, cutoff)
+            else:
+                indptr, indices = self.geometry.nonlocalAdjacency(
+                    Lr, gauss=cutoff)
+            self.elements.setNeighbours(indptr, indices)
         self.name = 'Plane Stress Isotropic non local sparse'
 
-        self.KL = sparse.lil_matrix((self.ngdl, self.ngdl))
-        self.KNL = sparse.lil_matrix((self.ngdl, self.ngdl))
+        self.KL = self.sparseAssembler()
+        self.KNL = TripletAssembler((self.ngdl, self.ngdl))
+        self.nonlocalData = None
         if self.calculateMass:
-            self.M = sparse.lil_matrix((self.ngdl, self.ngdl))
+            self.M = self.sparseAssembler()
 
     def elementMatrices(self) -> None:
-        """Calculate the elements matrices
+        """Calculate the elements matrices.
+        The local matrices are calculated by groups of elements. The nonlocal matrices of every element
+        are integrated at once over all the Gauss points pairs of its nonlocal elements.
+        If the nonlocal relation is symmetric, every pair of elements is calculated once.
+        If the problem has a cache, the global matrices are loaded from the cache (only the force vector is calculated) or stored in it.
+        If the problem is matrix free, the nonlocal matrices are not integrated and KNL is a NonLocalOperator.
+        The matrices are restarted as empty triplet assemblers, so they can be calculated again after the ensembling.
         """
-        for ee in tqdm(range(len(self.elements)), unit='Local'):
-            self.elementMatrix(ee)
+        self.KL = self.sparseAssembler()
+        self.KNL = TripletAssembler((self.ngdl, self.ngdl))
+        if self.calculateMass:
+            self.M = self.sparseAssembler()
+        groups = elementGroups(self.elements)
+        key = None
+        if self.cache and not self.matrixFree:
+            key = self.cacheKey()
+            matrices = self.cache.load(key)
+            if matrices is not None:
+                self.KL = matrices['KL']
+                self.KNL = matrices['KNL']
+                if self.calculateMass:
+                    self.M = matrices['M']
+                for idx in groups:
+                    gdlm = elementDofs(self.elements, idx)
+                    self.F[:, 0] += np.bincount(gdlm.ravel(),
+                                                self.groupLoads(idx).ravel(), minlength=self.ngdl)
+                return
+        tasks = parallelTasks(groups, self.workers)
+        results = parallelMap(self, 'groupMatrices', tasks, self.workers)
+        for idx, (Ke, Fe, Me) in zip(tasks, tqdm(results, total=len(tasks), unit='Group')):
+            gdlm = elementDofs(self.elements, idx)
+            self.KL.addBatch(gdlm, Ke)
+            self.F[:, 0] += np.bincount(gdlm.ravel(),
+                                        Fe.ravel(), minlength=self.ngdl)
+            if self.calculateMass:
+                self.M.addBatch(gdlm, Me)
+        neighbours = fromCSR(*self.elements.adjacency())
+        if self.matrixFree:
+            self.KNL = NonLocalOperator(self.elements, groups, strainMatrix2D, self.constitutiveMatrices(np.arange(len(self.elements))),
+                                        self.l, self.af, neighbours, self.ngdl, self.t, self.cutoffDistance(), self.threshold, onTheFly=self.onTheFly)
+            return
+        geometry = nonlocalGeometry(
+            self.elements, groups, strainMatrix2D, self.t)
+        Cs = None
+        if symmetricNeighbours(neighbours):
+            Cs = self.constitutiveMatrices(np.arange(len(self.elements)))
+        self.nonlocalData = (geometry, Cs, neighbours)
+        tasks = parallelTasks(
+            [np.arange(len(self.elements))], self.workers, chunk=256)
+        results = parallelMap(self, 'nonlocalBlocks', tasks, self.workers)
+        for blocks in tqdm(results, total=len(tasks), unit='Nonlocal'):
+            for gdlm, Knl, gdlmnl in blocks:
+                self.KNL.addBatch(gdlm, Knl, gdlmnl)
+        self.nonlocalData = None
+        if self.cache:
+            self.KL = self.KL.tocsr()
+            self.KNL = self.KNL.tocsr()
+            matrices = {'KL': self.KL, 'KNL': self.KNL}
+            if self.calculateMass:
+                self.M = self.M.tocsr()
+                matrices['M'] = self.M
+            self.cache.save(key, matrices)
 
-    def elementMatrix(self, ee: 'Element') -> None:
-        """Calculates a single element local and nonlocal matrices
+    def cacheKey(self) -> str:
+        """Creates the hash of the global matrices. It depends on the mesh, the nonlocal elements, the constitutive matrices, the thickness, the density and the nonlocal parameters.
 
-        Args:
-            ee (Element): Element to be calculated
+        Returns:
+            str: Hexadecimal SHA-256 digest
         """
-        e = self.elements[ee]
-        m = len(e.gdl.T)
+        n = len(self.elements)
+        return contentHash(self.name, meshHash(self.geometry), *self.elements.adjacency(), self.constitutiveMatrices(np.arange(n)),
+                           np.asarray(self.t, dtype=float), self.rho, float(self.l), float(self.Lr), attenuationSamples(self.af, 2*self.Lr/self.l), self.cutoff, self.threshold)
 
-        Fux = np.zeros([m, 1])
-        Fvx = np.zeros([m, 1])
+    def cutoffDistance(self) -> float:
+        """Maximum normalized distance of the integrated Gauss points pairs
 
-        _x, _p = e._x, e._p
-        detjac = e.detjac
-        dpx = e.dpx
-
-        c11 = self.C11[ee]
-        c12 = self.C12[ee]
-        c22 = self.C22[ee]
-        c66 = self.C66[ee]
-        C = np.array([
-            [c11, c12, 0.0],
-            [c12, c22, 0.0],
-            [0.0, 0.0, c66]])
-
-        Fe = np.zeros([2*m, 1])
-        Ke = np.zeros([2*m, 2*m])
-        if self.calculateMass:
-            Me = np.zeros([2*m, 2*m])
-
-        o = [0.0]*m
-        for k in range(len(e.Z)):  # Iterate over gauss points on domain
-            B = np.array([
-                [*dpx[k, 0, :], *o],
-                [*o, *dpx[k, 1, :]],
-                [*dpx[k, 1, :], *dpx[k, 0, :]]])
-
-            P = np.array([
-                [*_p[k], *o],
-                [*o, *_p[k]]])
-            Ke += self.t[ee]*(B.T@C@B)*detjac[k]*e.W[k]
-            if self.calculateMass:
-                Me += self.rho[ee]*self.t[ee]*(P.T@P)*detjac[k]*e.W[k]
-            Fe += self.t[ee]*(P.T@np.array([[self.fx(_x[k])],
-                                            [self.fy(_x[k])]]))*detjac[k]*e.W[k]
-
-        if e.intBorders:  # Cambiar esto a la notación matricial
-            for j in range(len(e.borders)):
-                border = e.borders[j]
-                if (len(border.properties['load_x']) + len(border.properties['load_y'])):
-                    _x, _p = e.T(e.Tj[j](border.Z.T))
-                    _s = border.TS(border.Z.T)
-                    detjac = border.coords[-1, 0]*0.5
-                    for i in range(m):
-                        for fx in border.properties['load_x']:
-                            for k in range(len(border.Z)):
-                                Fux[i, 0] += fx(_s[k, 0])*_p[k, i] * \
-                                    detjac*border.W[k]
-                        for fy in border.properties['load_y']:
-                            for k in range(len(border.Z)):
-                                Fvx[i, 0] += fy(_s[k, 0])*_p[k, i] * \
-                                    detjac*border.W[k]
-        subm = np.linspace(0, 2*m-1, 2*m).reshape([2, m]).astype(int)
-        Fe[np.ix_(subm[0])] += Fux
-        Fe[np.ix_(subm[1])] += Fvx
-        self.F[np.ix_(e.gdlm)] += Fe
-
-        self.KL[np.ix_(e.gdlm, e.gdlm)] += Ke
+        Returns:
+            float: Lr/l if the Gauss points pairs are cut off, None otherwise
+        """
+        if self.cutoff:
+            return self.Lr/self.l
+        return None
 
-        if self.calculateMass:
-            self.M[np.ix_(e.gdlm, e.gdlm)] += Me
-
-        # e.knls = []
-        for inl in tqdm(e.enl, unit=' Nolocal'):
-            enl = self.elements[inl]
-            mnl = len(enl.gdl.T)
-            onl = [0.0]*mnl
-            Knl = np.zeros([2*m, 2*mnl])
-            _xnl = enl._x
-            detjacnl = enl.detjac
-            dpxnl = enl.dpx
-
-            for k in range(len(e.Z)):
-                B = np.array([
-                    [*dpx[k, 0, :], *o],
-                    [*o, *dpx[k, 1, :]],
-                    [*dpx[k, 1, :], *dpx[k, 0, :]]])
-
-                for knl in range(len(enl.Z)):
-                    ro = np.linalg.norm(_x[k]-_xnl[knl])/self.l
-                    azn = self.af(ro)
-                    Bnl = np.array([
-                        [*dpxnl[knl, 0, :], *onl],
-                        [*onl, *dpxnl[knl, 1, :]],
-                        [*dpxnl[knl, 1, :], *dpxnl[knl, 0, :]]])
-
-                    Knl += self.t[ee]*self.t[inl]*azn*(Bnl.T@C@B)*detjac[k] * \
-                        e.W[k]*detjacnl[knl]*enl.W[knl]
-            # e.knls.append(Knl)
-            self.KNL[np.ix_(e.gdlm, enl.gdlm)] += Knl.T
+    def nonlocalBlocks(self, idx: np.ndarray) -> list:
+        """Calculates the nonlocal matrices of a chunk of elements. The stacked geometry, the constitutive matrices and the nonlocal elements are taken from the nonlocalData attribute.
+
+        Args:
+            idx (np.ndarray): Element indices
+
+        Returns:
+            list: Triplet blocks with the rows degrees of freedom, the nonlocal matrices and the columns degrees of freedom
+        """
+        geometry, Cs, neighbours = self.nonlocalData
+        blocks = []
+        for ee in idx:
+            if len(neighbours[ee]):
+                C = self.constitutiveMatrices([ee])[0]
+                blocks += nonlocalElementMatrices(geometry, ee, neighbours[ee], C, self.l, self.af, Cs,
+                                                  self.cutoffDistance(), self.threshold)
+        return blocks
+
+    def elementMatrix(self, ee: int, geometry: tuple = None, Cs: np.ndarray = None) -> None:
+        """Calculates a single element nonlocal matrices
+
+        Args:
+            ee (int): Element index
+            geometry (tuple, optional): Stacked geometry of all the elements, as given by nonlocalGeometry. If not given, it is calculated. Defaults to None.
+            Cs (np.ndarray, optional): Constitutive matrices of all the elements. If given, the nonlocal relation is assumed symmetric and only the pairs with the nonlocal elements of greater or equal index are calculated, with both blocks added. Defaults to None.
+        """
+        if geometry is None:
+            geometry = nonlocalGeometry(self.elements, elementGroups(
+                self.elements), strainMatrix2D, self.t)
+        e = self.elements[ee]
+        if not len(e.enl):
+            return
+        C = self.constitutiveMatrices([ee])[0]
+        for gdlm, Knl, gdlmnl in nonlocalElementMatrices(geometry, ee, e.enl, C, self.l, self.af, Cs, self.cutoffDistance(), self.threshold):
+            self.KNL.addBatch(gdlm, Knl, gdlmnl)
 
     def profile(self, p0: list, p1: list, n: float = 100, plot=True) -> None:
         """Generate a profile between selected points
@@ -807,14 +849,41 @@ class PlaneStressNonLocalSparse(PlaneStressSparse):
         return _X, U1, U2, U3, U
 
     def ensembling(self) -> None:
-        """Creation of the system sparse matrix. Force vector is ensembled in integration method
+        """Creation of the system sparse matrix. Force vector is ensembled in integration method.
+        If the problem is matrix free, the system matrix is a StiffnessOperator
         """
         logging.info('Ensembling equation system...')
-        self.K = self.KL*self.z1 + self.KNL*self.z2
+        self.KL = self.KL.tocsr()
+        if self.matrixFree:
+            self.K = StiffnessOperator(self.KL, self.KNL, self.z1, self.z2)
+        else:
+            self.KNL = self.KNL.tocsr()
+            self.K = self.KL*self.z1 + self.KNL*self.z2
         if self.calculateMass:
             self.M = self.M.tocsr()
         logging.info('Done!')
 
+    def sweep(self, Z: list, k: int = 20, path: str = '', callback: Callable = None, **kargs) -> list:
+        """Solves the smallest k eigenvalues for several z1 factors. The local and nonlocal matrices are calculated only once.
+        If the problem solver is not an eigen value solver, a LinealEigen solver is used.
+
+        Args:
+            Z (list): z1 factors. z2 is calculated as 1-z1.
+            k (int, optional): Number of eigenvalues to calculate. Defaults to 20.
+            path (str, optional): Filename of the results of every z1 factor, formatted with the z1 factor. Example: 'results_{z1}.json'. Defaults to ''.
+            callback (Callable, optional): Function called with the result record of every z1 factor as soon as it is solved. Defaults to None.
+            **kargs: Any of the LinealEigen options (method, sigma, preconditioner, tol, maxiter).
+
+        Returns:
+            list: Result record of every z1 factor
+        """
+        if not isinstance(self.solver, LinealEigen):
+            self.solver = LinealEigen(self)
+        records = self.solver.sweep(Z, k, path, callback, **kargs)
+        duration = self.logger.end_timer().total_seconds()
+        self.properties['duration'] = duration
+        return records
+
     def postProcess(self, mult: float = 1000, gs=None, levels=1000, **kargs) -> None:
         """Generate the stress surfaces and displacement fields for the geometry
 
@@ -866,7 +935,7 @@ class PlaneStressNonLocalSparse(PlaneStressSparse):
 
 
 class PlaneStressNonLocalSparseNonHomogeneous(PlaneStressSparse):
-    def __init__(self, geometry: Geometry, E: Tuple[float, list], v: Tuple[float, list], t: Tuple[float, list], l: float, alpha: float, Lr: float, af: Callable, rho: Tuple[float, list] = None, fx: Callable = lambda x: 0, fy: Callable = lambda x: 0, **kargs) -> None:
+    def __init__(self, geometry: Geometry, E: Tuple[float, list], v: Tuple[float, list], t: Tuple[float, list], l: float, alpha: float, Lr: float, af: Callable, rho: Tuple[float, list] = None, fx: Callable = lambda x: 0, fy: Callable = lambda x: 0, cache: str = None, skin: bool = False, **kargs) -> None:
         """Creates a plane stress non local non homogeneous finite element problem.
         This class implements the model proposed by Pisano et al (2009).
         It is not possible to use different tickness
@@ -883,6 +952,8 @@ class PlaneStressNonLocalSparseNonHomogeneous(PlaneStressSparse):
             rho (Tuple[float, list], optional): Density. Defaults to None.
             fx (_type_, optional): Force in X direction. Defaults to lambdax:0.
             fy (_type_, optional): Force in Y direction. Defaults to lambdax:0.
+            cache (str, optional): Directory of the persistent cache of the nonlocal elements and the gamma functions. If not given, nothing is cached. Defaults to None.
+            skin (bool, optional): To integrate the gamma functions only in the skin region (Gauss points closer than Lr to the border). The other Gauss points use the integral of the attenuation function over a circle of radius Lr. Defaults to False.
         """
 
         self.l = l
@@ -896,190 +967,197 @@ class PlaneStressNonLocalSparseNonHomogeneous(PlaneStressSparse):
         self.properties['Lr'] = self.Lr
         self.properties['af'] = None
         self.properties['alpha'] = self.alpha
-        nonlocals = self.geometry.detectNonLocal(Lr)
-        for e, dno in zip(self.elements, nonlocals):
-            e.enl = dno
+        self.properties['cache'] = cache
+        self.properties['skin'] = skin
+        self.skin = skin
+        self.cache = None
+        if cache:
+            self.cache = NonLocalCache(cache)
+            indptr, indices = self.cache.adjacency(self.geometry, Lr)
+        else:
+            indptr, indices = self.geometry.nonlocalAdjacency(Lr)
+        self.elements.setNeighbours(indptr, indices)
         self.name = 'Plane Stress Isotropic non local sparse'
 
-        self.KL = sparse.lil_matrix((self.ngdl, self.ngdl))
-        self.KNL = sparse.lil_matrix((self.ngdl, self.ngdl))
+        self.KL = self.sparseAssembler()
+        self.KNL = TripletAssembler((self.ngdl, self.ngdl))
+        self.gammas = None
+        self.B = None
+        self.nonlocalData = None
         if self.calculateMass:
-            self.M = sparse.lil_matrix((self.ngdl, self.ngdl))
+            self.M = self.sparseAssembler()
 
     def elementMatrices(self) -> None:
-        """Calculate the elements matrices
+        """Calculate the elements matrices.
+        The local matrices are calculated by groups of elements.
+        The B matrices of all the Gauss points are calculated once and used by the gamma and the nonlocal matrices.
+        The gamma functions are calculated once (or loaded from the cache) and the gamma matrices are integrated by groups of elements.
+        The nonlocal matrices of every element are integrated at once over the Gauss points of its nonlocal elements.
+        The matrices are restarted as empty triplet assemblers, so they can be calculated again after the ensembling.
         """
-        logging.info('Calculating gamma functions for all elements')
-        for i, e in enumerate(tqdm(self.elements, unit='Local')):
-            m = len(e.gdl.T)
-            c11 = self.C11[i]
-            c12 = self.C12[i]
-            c22 = self.C22[i]
-            c66 = self.C66[i]
-            C = np.array([
-                [c11, c12, 0.0],
-                [c12, c22, 0.0],
-                [0.0, 0.0, c66]])
-            o = [0.0]*m
-            dpx = e.dpx
-            e.gammas = []
-            knonlocn = 0.0
-            k = -1
-            for _xloc, _wloc, _detjacloc in zip(e._x, e.W, e.detjac):
-                # TODO Hay que hacer que este ciclo recorra los dpx tambien porque son los
-                # mismos que los puntos de Gauss
-                k += 1
-                # El B debería calcularse una sola vez, se vuelve a calcular abajo
-                B = np.array([
-                    [*dpx[k, 0, :], *o],
-                    [*o, *dpx[k, 1, :]],
-                    [*dpx[k, 1, :], *dpx[k, 0, :]]])
-                gamma = 0.0
-                for inl in e.enl:
-                    enl = self.elements[inl]
-                    for _xnloc, _wnloc, _detjacnloc in zip(enl._x, enl.W, enl.detjac):
-                        # TODO Esta integral solo debe hacerse si el elemento esta en la skin region
-                        ro = np.linalg.norm(_xloc-_xnloc)/self.l
-                        gamma += self.properties['t'][i] * \
-                            self.af(ro) * _wnloc*_detjacnloc
-                e.gammas.append(gamma)
-                knonlocn += self.properties['t'][i]*B.T@((gamma**2) * C)@B
-            # TODO El elemento no debería guardar esta matríz, debería ensamblarse directamente
-            e.knonlocn = knonlocn
-            self.KNL[np.ix_(e.gdlm, e.gdlm)] += knonlocn
-            e.gammas = np.array(e.gammas)  # Esto si es estrictamente necesario
-        for e in tqdm(range(len(self.elements)), unit='Local'):
-            self.elementMatrix(e)
-
-    def elementMatrix(self, ee: 'Element') -> None:
-        """Calculates a single element local and nonlocal matrices
+        self.KL = self.sparseAssembler()
+        self.KNL = TripletAssembler((self.ngdl, self.ngdl))
+        if self.calculateMass:
+            self.M = self.sparseAssembler()
+        groups = elementGroups(self.elements)
+        if self.B is None:
+            self.B = [None]*len(self.elements)
+            for idx in groups:
+                _, _, dpx, _ = gaussPointsGeometry(self.elements, idx)
+                for i, B in zip(idx, strainMatrix2D(dpx)):
+                    self.B[i] = B
+        if self.gammas is None:
+            logging.info('Calculating gamma functions for all elements')
+            self.gammas = self.gammaFunctions()
+        if self.nonlocalData is None:
+            self.nonlocalData = self.nonlocalArrays()
+        t = np.asarray(self.t, dtype=float)
+        tasks = parallelTasks(groups, self.workers)
+        results = parallelMap(self, 'groupMatrices', tasks, self.workers)
+        for idx, (Ke, Fe, Me) in zip(tasks, tqdm(results, total=len(tasks), unit='Group')):
+            gdlm = elementDofs(self.elements, idx)
+            self.KL.addBatch(gdlm, Ke)
+            self.F[:, 0] += np.bincount(gdlm.ravel(),
+                                        Fe.ravel(), minlength=self.ngdl)
+            if self.calculateMass:
+                self.M.addBatch(gdlm, Me)
+            B = np.array([self.B[i] for i in idx])
+            g = self.gammas[idx, :B.shape[1]]
+            Kg = np.einsum('e,egsa,eg,est,egtb->eab', t[idx], B, g**2,
+                           self.constitutiveMatrices(idx), B, optimize=True)
+            self.KNL.addBatch(gdlm, Kg)
+        tasks = parallelTasks(
+            [np.arange(len(self.elements))], self.workers, chunk=256)
+        results = parallelMap(self, 'nonlocalBlocks', tasks, self.workers)
+        for blocks in tqdm(results, total=len(tasks), unit='Nonlocal'):
+            for gdlm, Knl, gdlmnl in blocks:
+                self.KNL.addBatch(gdlm, Knl, gdlmnl)
+
+    def gammaFunctions(self) -> np.ndarray:
+        """Calculates the gamma functions of all the Gauss points at once over the pairs of nonlocal elements.
+        If the problem has a skin region, only the elements with Gauss points in the skin region are integrated.
+        If the problem has a cache, the gamma functions are loaded from the cache or stored in it.
 
-        Args:
-            ee (int): Element to be calculated
+        Returns:
+            np.ndarray: Gamma functions with shape (ne, ng). Elements with less Gauss points are padded
         """
-        e = self.elements[ee]
-        m = len(e.gdl.T)
+        key = None
+        if self.cache:
+            key = contentHash('gammas', meshHash(self.geometry), *self.elements.adjacency(), np.asarray(self.t, dtype=float),
+                              float(self.l), float(self.Lr), attenuationSamples(self.af, 2*self.Lr/self.l), self.skin)
+            content = self.cache.load(key)
+            if content is not None:
+                return np.array(content['gammas'])
+        points = self.geometry.gaussPoints()
+        valid = ~np.isnan(points[..., 0])
+        points[~valid] = 0.0
+        dv = np.zeros(valid.shape)
+        for idx in elementGroups(self.elements):
+            w = gaussPointsGeometry(self.elements, idx)[3]
+            dv[idx, :w.shape[1]] = w
+        indptr, indices = self.elements.adjacency()
+        rows = np.repeat(np.arange(len(self.elements)), np.diff(indptr))
+        cols = np.asarray(indices, dtype=np.int64)
+        t = np.asarray(self.t, dtype=float)[:, None]
+        if self.skin:
+            skin = np.zeros(valid.shape, dtype=bool)
+            skin[valid] = self.geometry.skinPoints(points[valid], self.Lr)
+            selected = np.any(skin, axis=1)[rows]
+            gammas = t*gammaFunctions(points, dv, rows[selected],
+                                      cols[selected], self.l, self.af)
+            gammas = np.where(skin, gammas, t *
+                              interiorGamma(self.af, self.l, self.Lr))
+        else:
+            gammas = t*gammaFunctions(points, dv, rows, cols, self.l, self.af)
+        if self.cache:
+            self.cache.save(key, {'gammas': gammas})
+        return gammas
+
+    def nonlocalArrays(self) -> tuple:
+        """Stacks the Gauss points, the B matrices, the integration weights multiplied by the thickness, the degrees of freedom
+        and the constitutive matrices of all the elements. Elements with less Gauss points or nodes are padded with zeros.
 
-        Fux = np.zeros([m, 1])
-        Fvx = np.zeros([m, 1])
+        Returns:
+            tuple: Gauss points (ne, ng, 2), B matrices (ne, ng, 3, n), weights (ne, ng), degrees of freedom (ne, n), constitutive matrices (ne, 3, 3) and the nonlocal elements as CSR arrays
+        """
+        points = self.geometry.gaussPoints()
+        points[np.isnan(points)] = 0.0
+        ne, ng = points.shape[:2]
+        groups = elementGroups(self.elements)
+        n = max([elementDofs(self.elements, idx).shape[1] for idx in groups])
+        B = np.zeros([ne, ng, 3, n])
+        w = np.zeros([ne, ng])
+        gdlm = np.zeros([ne, n], dtype=np.int64)
+        for idx in groups:
+            dofs = elementDofs(self.elements, idx)
+            dv = gaussPointsGeometry(self.elements, idx)[3]
+            for i in idx:
+                B[i, :self.B[i].shape[0], :, :self.B[i].shape[2]] = self.B[i]
+            w[idx, :dv.shape[1]] = np.asarray(self.t, dtype=float)[
+                idx][:, None]*dv
+            gdlm[idx, :dofs.shape[1]] = dofs
+        C = self.constitutiveMatrices(np.arange(ne))
+        return points, B, w, gdlm, C, self.elements.adjacency()
+
+    def nonlocalBlocks(self, idx: np.ndarray) -> list:
+        """Calculates the nonlocal matrices of a chunk of elements with all their nonlocal elements.
+        The q term of every pair of Gauss points is integrated over the Gauss points of the nonlocal elements of the element,
+        which are also the Gauss points of the pairs. The stacked arrays are taken from the nonlocalData attribute.
 
-        _x, _p = e._x, e._p
-        detjac = e.detjac
-        dpx = e.dpx
-
-        c11 = self.C11[ee]
-        c12 = self.C12[ee]
-        c22 = self.C22[ee]
-        c66 = self.C66[ee]
-        C = np.array([
-            [c11, c12, 0.0],
-            [c12, c22, 0.0],
-            [0.0, 0.0, c66]])
-
-        Fe = np.zeros([2*m, 1])
-        Ke = np.zeros([2*m, 2*m])
-        if self.calculateMass:
-            Me = np.zeros([2*m, 2*m])
-
-        o = [0.0]*m
-        for k in range(len(e.Z)):  # Iterate over gauss points on domain
-            B = np.array([
-                [*dpx[k, 0, :], *o],
-                [*o, *dpx[k, 1, :]],
-                [*dpx[k, 1, :], *dpx[k, 0, :]]])
-
-            P = np.array([
-                [*_p[k], *o],
-                [*o, *_p[k]]])
-            Ke += self.t[ee]*(B.T@C@B)*detjac[k]*e.W[k]
-            if self.calculateMass:
-                Me += self.rho[ee]*self.t[ee]*(P.T@P)*detjac[k]*e.W[k]
-            Fe += self.t[ee]*(P.T@np.array([[self.fx(_x[k])],
-                                            [self.fy(_x[k])]]))*detjac[k]*e.W[k]
-
-        if e.intBorders:  # Cambiar esto a la notación matricial
-            for j in range(len(e.borders)):
-                border = e.borders[j]
-                if (len(border.properties['load_x']) + len(border.properties['load_y'])):
-                    _x, _p = e.T(e.Tj[j](border.Z.T))
-                    _s = border.TS(border.Z.T)
-                    detjac = border.coords[-1, 0]*0.5
-                    for i in range(m):
-                        for fx in border.properties['load_x']:
-                            for k in range(len(border.Z)):
-                                Fux[i, 0] += fx(_s[k, 0])*_p[k, i] * \
-                                    detjac*border.W[k]
-                        for fy in border.properties['load_y']:
-                            for k in range(len(border.Z)):
-                                Fvx[i, 0] += fy(_s[k, 0])*_p[k, i] * \
-                                    detjac*border.W[k]
-        subm = np.linspace(0, 2*m-1, 2*m).reshape([2, m]).astype(int)
-        Fe[np.ix_(subm[0])] += Fux
-        Fe[np.ix_(subm[1])] += Fvx
-        self.F[np.ix_(e.gdlm)] += Fe
-
-        self.KL[np.ix_(e.gdlm, e.gdlm)] += Ke
+        Args:
+            idx (np.ndarray): Element indices
 
+        Returns:
+            list: Triplet blocks with the rows degrees of freedom, the nonlocal matrices and the columns degrees of freedom
+        """
+        points, B, w, gdlm, C, (indptr, indices) = self.nonlocalData
+        ng = w.shape[1]
+        blocks = []
+        for ee in idx:
+            enl = indices[indptr[ee]:indptr[ee+1]]
+            if not len(enl):
+                continue
+            x = points[enl].reshape([-1, 2])
+            wnl = w[enl]
+            a = attenuation(self.af, np.linalg.norm(
+                points[ee][:, None, :]-x[None, :, :], axis=-1)/self.l)
+            q = np.zeros([ng, len(x), 3, 3])
+            step = max(1, 2**21//(len(x)*ng))
+            for k in range(0, len(x), step):
+                a2 = attenuation(self.af, np.linalg.norm(
+                    x[k:k+step, None, :]-x[None, :, :], axis=-1)/self.l)
+                r = np.einsum('kmj,qmj,mj->kqm', a.reshape([ng, len(enl), ng]),
+                              a2.reshape([-1, len(enl), ng]), wnl)
+                q[:, k:k+step] = np.einsum('kqm,mst->kqst', r, C[enl])
+            gammas = self.gammas[enl].ravel()[:, None, None] * \
+                np.repeat(C[enl], ng, axis=0)
+            J = a[:, :, None, None]*(self.gammas[ee][:, None, None, None]
+                                     * C[ee] + gammas[None]) - q
+            Knl = np.einsum('k,ksa,kmjst,mjtb,mj->mab', w[ee], B[ee], J.reshape(
+                [ng, len(enl), ng, 3, 3]), B[enl], wnl, optimize=True)
+            blocks.append((np.repeat(gdlm[ee][None], len(enl), axis=0),
+                           -Knl, gdlm[enl]))
+        return blocks
+
+    def elementMatrix(self, ee: int) -> None:
+        """Calculates a single element local and nonlocal matrices. The local matrices are calculated as a group of one element
+        and the nonlocal matrices are taken from nonlocalBlocks. The gamma matrix is not included.
+
+        Args:
+            ee (int): Element index
+        """
+        idx = np.array([ee])
+        gdlm = elementDofs(self.elements, idx)
+        Ke, Fe, Me = self.groupMatrices(idx)
+        self.KL.addBatch(gdlm, Ke)
+        self.F[:, 0] += np.bincount(gdlm.ravel(),
+                                    Fe.ravel(), minlength=self.ngdl)
         if self.calculateMass:
-            self.M[np.ix_(e.gdlm, e.gdlm)] += Me
-
-        # e.knls = []
-        for inl in tqdm(e.enl, unit=' Nolocal'):
-            c11nl = self.C11[inl]
-            c12nl = self.C12[inl]
-            c22nl = self.C22[inl]
-            c66nl = self.C66[inl]
-            Cnl = np.array([
-                [c11nl, c12nl, 0.0],
-                [c12nl, c22nl, 0.0],
-                [0.0, 0.0, c66nl]])
-
-            enl = self.elements[inl]
-            mnl = len(enl.gdl.T)
-            onl = [0.0]*mnl
-            Knl = np.zeros([2*m, 2*mnl])
-            _xnl = enl._x
-            detjacnl = enl.detjac
-            dpxnl = enl.dpx
-
-            for k in range(len(e.Z)):
-                B = np.array([
-                    [*dpx[k, 0, :], *o],
-                    [*o, *dpx[k, 1, :]],
-                    [*dpx[k, 1, :], *dpx[k, 0, :]]])
-
-                for knl in range(len(enl.Z)):
-                    ro = np.linalg.norm(_x[k]-_xnl[knl])/self.l
-                    azn = self.af(ro)
-                    Bnl = np.array([
-                        [*dpxnl[knl, 0, :], *onl],
-                        [*onl, *dpxnl[knl, 1, :]],
-                        [*dpxnl[knl, 1, :], *dpxnl[knl, 0, :]]])
-
-                    q = 0.0
-                    for inl2 in e.enl:
-                        enl2 = self.elements[inl2]
-                        c11nl2 = self.C11[inl2]
-                        c12nl2 = self.C12[inl2]
-                        c22nl2 = self.C22[inl2]
-                        c66nl2 = self.C66[inl2]
-                        Cnl2 = np.array([
-                            [c11nl2, c12nl2, 0.0],
-                            [c12nl2, c22nl2, 0.0],
-                            [0.0, 0.0, c66nl2]])
-                        for kk in range(len(enl2.Z)):
-                            rho1 = np.linalg.norm(_x[k]-enl2._x[kk])/self.l
-                            rho2 = np.linalg.norm(_xnl[knl]-enl2._x[kk])/self.l
-                            az1 = self.af(rho1)
-                            az2 = self.af(rho2)
-                            q += az1*az2*Cnl2*self.t[inl2] * \
-                                enl2.detjac[kk]*enl2.W[kk]
-                    J = (e.gammas[k]*C+enl.gammas[knl]*Cnl)*azn - q
-                    Knl += self.t[ee]*self.t[inl]*(Bnl.T@J@B)*detjac[k] * \
-                        e.W[k]*detjacnl[knl]*enl.W[knl]
-            # e.knls.append(Knl)
-            # ESTA DEBE SER TRANSPUESTA!!!!!!!!!!!!!!!
-            self.KNL[np.ix_(e.gdlm, enl.gdlm)] -= Knl.T
+            self.M.addBatch(gdlm, Me)
+        if self.nonlocalData is None:
+            self.nonlocalData = self.nonlocalArrays()
+        for gdlm, Knl, gdlmnl in self.nonlocalBlocks([ee]):
+            self.KNL.addBatch(gdlm, Knl, gdlmnl)
 
     def profile(self, p0: list, p1: list, n: float = 100) -> None:
         """Generate a profile between selected points
@@ -1133,6 +1211,8 @@ class PlaneStressNonLocalSparseNonHomogeneous(PlaneStressSparse):
         """Creation of the system sparse matrix. Force vector is ensembled in integration method
         """
         logging.info('Ensembling equation system...')
+        self.KL = self.KL.tocsr()
+        self.KNL = self.KNL.tocsr()
         self.K = self.KL + self.KNL*self.alpha
         if self.calculateMass:
             self.M = self.M.tocsr()
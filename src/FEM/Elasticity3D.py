@@ -4,9 +4,14 @@ from typing import Callable, Tuple
 import numpy as np
 from tqdm import tqdm
 from scipy import sparse
-from FEM.Solvers.Lineal import LinealSparse
+from FEM.Solvers.Lineal import LinealSparse, LinealEigen
 from .Elements.E2D import Quadrilateral
 from .Core import Core, Geometry, logging
+from .Assembly import TripletAssembler
+from .Operators import NonLocalOperator, StiffnessOperator
+from .Parallel import parallelTasks, parallelMap
+from .Cache import NonLocalCache, contentHash, meshHash, attenuationSamples, fromCSR
+from .Kernels import elementGroups, elementDofs, gaussPointsGeometry, strainMatrix3D, stiffnessMatrices, massMatrices, lumpedMasses, loadVectors, nonlocalGeometry, nonlocalElementMatrices, symmetricNeighbours
 
 
 class Elasticity(Core):
@@ -20,9 +25,11 @@ class Elasticity(Core):
         fx (Callable, optional): Force in x direction. Defaults to lambdax:0.
         fy (Callable, optional): Force in y direction. Defaults to lambdax:0.
         fz (Callable, optional): Force in z direction. Defaults to lambdax:0.
+        chunk (int, optional): Maximum number of elements whose matrices are calculated at the same time. If not given, all the elements of the same type are calculated at once. Defaults to None.
+        lumping (str, optional): Mass lumping method, 'rowsum' or 'hrz'. If given, the diagonal of the lumped mass matrix is stored in the Ml vector. Defaults to None.
     """
 
-    def __init__(self, geometry: Geometry, E: Tuple[float, list], v: Tuple[float, list], rho: Tuple[float, list], fx: Callable = lambda x: 0, fy: Callable = lambda x: 0, fz: Callable = lambda x: 0, **kargs) -> None:
+    def __init__(self, geometry: Geometry, E: Tuple[float, list], v: Tuple[float, list], rho: Tuple[float, list], fx: Callable = lambda x: 0, fy: Callable = lambda x: 0, fz: Callable = lambda x: 0, chunk: int = None, lumping: str = None, **kargs) -> None:
         """Creates a 3D Elasticity problem
 
         Args:
@@ -33,6 +40,8 @@ class Elasticity(Core):
             fx (Callable, optional): Force in x direction. Defaults to lambdax:0.
             fy (Callable, optional): Force in y direction. Defaults to lambdax:0.
             fz (Callable, optional): Force in z direction. Defaults to lambdax:0.
+            chunk (int, optional): Maximum number of elements whose matrices are calculated at the same time. If not given, all the elements of the same type are calculated at once. Defaults to None.
+            lumping (str, optional): Mass lumping method, 'rowsum' or 'hrz'. If given, the diagonal of the lumped mass matrix is stored in the Ml vector. Defaults to None.
         """
         if isinstance(E, float) or isinstance(E, int):
             E = [E]*len(geometry.elements)
@@ -56,6 +65,8 @@ class Elasticity(Core):
         self.fx = fx
         self.fy = fy
         self.fz = fz
+        self.chunk = chunk
+        self.lumping = lumping
         if not geometry.nvn == 3:
             print(
                 'Border conditions lost, please usea a geometry with 3 variables per node (nvn=3)\nRegenerating Geoemtry...')
@@ -65,8 +76,9 @@ class Elasticity(Core):
             geometry.initialize()
         Core.__init__(self, geometry, sparse=True, **kargs)
 
-        self.K = sparse.lil_matrix((self.ngdl, self.ngdl))
-        self.M = sparse.lil_matrix((self.ngdl, self.ngdl))
+        self.M = self.geometry.sparsityPattern().matrix()
+        if self.lumping:
+            self.Ml = np.zeros(self.ngdl)
         self.name = 'Isotropic Elasticity sparse'
         self.properties['E'] = self.E
         self.properties['v'] = self.v
@@ -74,57 +86,75 @@ class Elasticity(Core):
         self.properties['fy'] = None
         self.properties['fz'] = None
         self.properties['rho'] = self.rho
+        self.properties['lumping'] = self.lumping
 
     def elementMatrices(self) -> None:
-        """Calculate the element matrices usign Reddy's (2005) finite element model
+        """Calculate the element matrices usign Reddy's (2005) finite element model.
+        The elements are grouped by type (and chunks, if given) and the matrices of each group are
+        calculated with stacked arrays and accumulated directly in the CSR data arrays.
         """
+        pattern = self.geometry.sparsityPattern()
+        if not pattern.isPatternOf(self.K):
+            self.K = pattern.matrix()
+        if not pattern.isPatternOf(self.M):
+            self.M = pattern.matrix()
+        tasks = parallelTasks(elementGroups(
+            self.elements, self.chunk), self.workers)
+        results = parallelMap(self, 'groupMatrices', tasks, self.workers)
+        for idx, (Ke, Fe, Me) in zip(tasks, tqdm(results, total=len(tasks), unit='Group')):
+            gdlm = elementDofs(self.elements, idx)
+            pattern.scatter(self.K.data, idx, Ke)
+            pattern.scatter(self.M.data, idx, Me)
+            self.F[:, 0] += np.bincount(gdlm.ravel(),
+                                        Fe.ravel(), minlength=self.ngdl)
+            if self.lumping:
+                self.Ml += np.bincount(gdlm.ravel(), lumpedMasses(
+                    Me, 3, self.lumping).ravel(), minlength=self.ngdl)
+
+    def waveSpeeds(self) -> np.ndarray:
+        """Calculates the longitudinal elastic wave speed of every element. Used to estimate the critical time step of explicit methods.
 
-        for ee, e in enumerate(tqdm(self.elements, unit='Element')):
-            m = len(e.gdl.T)
-
-            _x, _p = e._x, e._p
-            # jac, dpz = e.jacs, e.dpz
-            detjac = e.detjac
-            # _j = np.linalg.inv(jac)
-            dpx = e.dpx
-
-            C = self.C[ee]
-            o = [0.0]*m
-            Ke = np.zeros([3*m, 3*m])
-            Me = np.zeros([3*m, 3*m])
-            Fe = np.zeros([3*m, 1])
+        Returns:
+            np.ndarray: Wave speeds
+        """
+        C = np.array([c[0, 0] for c in self.C])
+        return np.sqrt(C/np.array(self.rho, dtype=float))
 
-            for k in range(len(e.Z)):  # Iterate over gauss points on domain
-                B = np.array([
-                    [*dpx[k, 0, :], *o, *o],
-                    [*o, *dpx[k, 1, :], *o],
-                    [*o, *o, *dpx[k, 2, :]],
-                    [*dpx[k, 2, :], *o, *dpx[k, 0, :]],
-                    [*o, *dpx[k, 2, :], *dpx[k, 1, :]],
-                    [*dpx[k, 1, :], *dpx[k, 0, :], *o]])
-                P = np.array([
-                    [*_p[k], *o, *o],
-                    [*o, *_p[k], *o],
-                    [*o, *o, *_p[k]]])
+    def groupMatrices(self, idx: np.ndarray) -> tuple:
+        """Calculates the stiffness matrices, force vectors and mass matrices of a group of elements with the same type
 
-                Ke += (B.T@C@B)*detjac[k]*e.W[k]
-                Me += self.rho[ee]*(P.T@P)*detjac[k]*e.W[k]
+        Args:
+            idx (np.ndarray): Element indices
 
-                _fx = self.fx(_x[k])
-                _fy = self.fy(_x[k])
-                _fz = self.fz(_x[k])
+        Returns:
+            tuple: Stiffness matrices (ne, 3m, 3m), force vectors (ne, 3m) and mass matrices (ne, 3m, 3m)
+        """
+        _x, _p, dpx, dv = gaussPointsGeometry(self.elements, idx)
+        B = strainMatrix3D(dpx)
+        C = np.array([self.C[i] for i in idx])
+        Ke = stiffnessMatrices(B, C, dv)
+        Fe = loadVectors([self.fx, self.fy, self.fz], _x, _p, dv)
+        Me = massMatrices(_p, 3, np.array(self.rho, dtype=float)[
+                          idx][:, None]*dv)
+        return Ke, Fe, Me
+
+    def groupLoads(self, idx: np.ndarray) -> np.ndarray:
+        """Calculates the force vectors of a group of elements with the same type
 
-                F = np.array([[_fx], [_fy], [_fz]])
-                Fe += (P.T @ F)*detjac[k]*e.W[k]
+        Args:
+            idx (np.ndarray): Element indices
 
-            self.F[np.ix_(e.gdlm)] += Fe
-            self.K[np.ix_(e.gdlm, e.gdlm)] += Ke
-            self.M[np.ix_(e.gdlm, e.gdlm)] += Me
+        Returns:
+            np.ndarray: Force vectors (ne, 3m)
+        """
+        _x, _p, _, dv = gaussPointsGeometry(self.elements, idx)
+        return loadVectors([self.fx, self.fy, self.fz], _x, _p, dv)
 
     def ensembling(self) -> None:
         """Creation of the system sparse matrix. Force vector is ensembled in integration method
         """
         logging.info('Ensembling equation system...')
+        self.K = self.K.tocsr()
         self.M = self.M.tocsr()
         logging.info('Done!')
 
@@ -188,9 +218,14 @@ class NonLocalElasticity(Elasticity):
         fx (Callable, optional): Force in x direction. Defaults to lambdax:0.
         fy (Callable, optional): Force in y direction. Defaults to lambdax:0.
         fz (Callable, optional): Force in z direction. Defaults to lambdax:0.
+        cache (str, optional): Directory of the persistent cache of the nonlocal elements and the global matrices. If not given, nothing is cached. Defaults to None.
+        cutoff (bool, optional): To integrate only the Gauss points pairs closer than Lr. The nonlocal elements are the elements with at least one Gauss point closer than Lr. Defaults to False.
+        threshold (float, optional): Gauss points pairs with attenuation lower than threshold*af(0) are not integrated. Defaults to None.
+        matrixFree (bool, optional): To apply the nonlocal matrix without assembling it, so K is a StiffnessOperator. The global matrices are not cached. It must be solved with IterativeSparse or LinealEigen. Defaults to False.
+        onTheFly (bool, optional): To calculate the attenuation of the Gauss points pairs of the matrix free problem in every product instead of storing it. The stored attenuation is faster but it can need more memory than the assembled nonlocal matrix. Defaults to False.
     """
 
-    def __init__(self, geometry: Geometry, E: Tuple[float, list], v: Tuple[float, list], rho: Tuple[float, list], l: float, z1: float, Lr: float, af: Callable, fx: Callable = lambda x: 0, fy: Callable = lambda x: 0, fz: Callable = lambda x: 0, **kargs) -> None:
+    def __init__(self, geometry: Geometry, E: Tuple[float, list], v: Tuple[float, list], rho: Tuple[float, list], l: float, z1: float, Lr: float, af: Callable, fx: Callable = lambda x: 0, fy: Callable = lambda x: 0, fz: Callable = lambda x: 0, cache: str = None, cutoff: bool = False, threshold: float = None, matrixFree: bool = False, onTheFly: bool = False, **kargs) -> None:
         """Creates a 3D Elasticity problem
 
         Args:
@@ -205,6 +240,11 @@ class NonLocalElasticity(Elasticity):
             fx (Callable, optional): Force in x direction. Defaults to lambdax:0.
             fy (Callable, optional): Force in y direction. Defaults to lambdax:0.
             fz (Callable, optional): Force in z direction. Defaults to lambdax:0.
+            cache (str, optional): Directory of the persistent cache of the nonlocal elements and the global matrices. If not given, nothing is cached. Defaults to None.
+            cutoff (bool, optional): To integrate only the Gauss points pairs closer than Lr. The nonlocal elements are the elements with at least one Gauss point closer than Lr. Defaults to False.
+            threshold (float, optional): Gauss points pairs with attenuation lower than threshold*af(0) are not integrated. Defaults to None.
+            matrixFree (bool, optional): To apply the nonlocal matrix without assembling it, so K is a StiffnessOperator. The global matrices are not cached. It must be solved with IterativeSparse or LinealEigen. Defaults to False.
+            onTheFly (bool, optional): To calculate the attenuation of the Gauss points pairs of the matrix free problem in every product instead of storing it. The stored attenuation is faster but it can need more memory than the assembled nonlocal matrix. Defaults to False.
         """
         Elasticity.__init__(self, geometry, E, v, rho, fx, fy, fz, **kargs)
         self.l = l
@@ -219,113 +259,166 @@ class NonLocalElasticity(Elasticity):
         self.properties['z2'] = self.z2
         self.properties['Lr'] = self.Lr
         self.properties['af'] = None
-
-        nonlocals = self.geometry.detectNonLocal(Lr)
-        for e, dno in zip(self.elements, nonlocals):
-            e.enl = dno
+        self.properties['cache'] = cache
+        self.properties['cutoff'] = cutoff
+        self.properties['threshold'] = threshold
+        self.properties['matrixFree'] = matrixFree
+        self.properties['onTheFly'] = onTheFly
+        self.cutoff = cutoff
+        self.threshold = threshold
+        self.matrixFree = matrixFree
+        self.onTheFly = onTheFly
+        self.cache = None
+        if cache:
+            self.cache = NonLocalCache(cache)
+
+        if self.cache:
+            indptr, indices = self.cache.adjacency(self.geometry, Lr, cutoff)
+        else:
+            indptr, indices = self.geometry.nonlocalAdjacency(Lr, gauss=cutoff)
+        self.elements.setNeighbours(indptr, indices)
         self.name = 'Non Local Elasticity sparse-lil'
-        self.KL = sparse.lil_matrix((self.ngdl, self.ngdl))
-        self.KNL = sparse.lil_matrix((self.ngdl, self.ngdl))
-        self.M = sparse.lil_matrix((self.ngdl, self.ngdl))
+        self.KL = self.sparseAssembler()
+        self.KNL = TripletAssembler((self.ngdl, self.ngdl))
+        self.nonlocalData = None
+        self.M = self.sparseAssembler()
 
     def elementMatrices(self) -> None:
-        """Calculate the element matrices usign Reddy's (2005) finite element model
+        """Calculate the element matrices usign Reddy's (2005) finite element model.
+        The local matrices are calculated by groups of elements. The B matrices of all the Gauss points
+        are calculated once and the nonlocal matrices of every element are integrated at once over
+        all the Gauss points pairs of its nonlocal elements and added as triplets.
+        If the nonlocal relation is symmetric, every pair of elements is calculated once.
+        If the problem has a cache, the global matrices are loaded from the cache (only the force vector is calculated) or stored in it.
+        If the problem is matrix free, the nonlocal matrices are not integrated and KNL is a NonLocalOperator.
+        The matrices are restarted as empty triplet assemblers, so they can be calculated again after the ensembling.
         """
+        self.KL = self.sparseAssembler()
+        self.KNL = TripletAssembler((self.ngdl, self.ngdl))
+        self.M = self.sparseAssembler()
+        groups = elementGroups(self.elements, self.chunk)
+        key = None
+        if self.cache and not self.matrixFree:
+            key = self.cacheKey()
+            matrices = self.cache.load(key)
+            if matrices is not None:
+                self.KL = matrices['KL']
+                self.KNL = matrices['KNL']
+                self.M = matrices['M']
+                if self.lumping:
+                    self.Ml += matrices['Ml']
+                for idx in groups:
+                    gdlm = elementDofs(self.elements, idx)
+                    self.F[:, 0] += np.bincount(gdlm.ravel(),
+                                                self.groupLoads(idx).ravel(), minlength=self.ngdl)
+                return
+        tasks = parallelTasks(groups, self.workers)
+        results = parallelMap(self, 'groupMatrices', tasks, self.workers)
+        for idx, (Ke, Fe, Me) in zip(tasks, tqdm(results, total=len(tasks), unit='Group')):
+            gdlm = elementDofs(self.elements, idx)
+            self.KL.addBatch(gdlm, Ke)
+            self.M.addBatch(gdlm, Me)
+            self.F[:, 0] += np.bincount(gdlm.ravel(),
+                                        Fe.ravel(), minlength=self.ngdl)
+            if self.lumping:
+                self.Ml += np.bincount(gdlm.ravel(), lumpedMasses(
+                    Me, 3, self.lumping).ravel(), minlength=self.ngdl)
+        neighbours = fromCSR(*self.elements.adjacency())
+        if self.matrixFree:
+            self.KNL = NonLocalOperator(self.elements, groups, strainMatrix3D, np.array(self.C), self.l, self.af,
+                                        neighbours, self.ngdl, cutoff=self.cutoffDistance(), threshold=self.threshold, onTheFly=self.onTheFly)
+            return
+        geometry = nonlocalGeometry(self.elements, groups, strainMatrix3D)
+        Cs = None
+        if symmetricNeighbours(neighbours):
+            Cs = np.array(self.C)
+        self.nonlocalData = (geometry, Cs, neighbours)
+        tasks = parallelTasks(
+            [np.arange(len(self.elements))], self.workers, chunk=256)
+        results = parallelMap(self, 'nonlocalBlocks', tasks, self.workers)
+        for blocks in tqdm(results, total=len(tasks), unit='Nonlocal'):
+            for gdlm, Knl, gdlmnl in blocks:
+                self.KNL.addBatch(gdlm, Knl, gdlmnl)
+        self.nonlocalData = None
+        if self.cache:
+            self.KL = self.KL.tocsr()
+            self.KNL = self.KNL.tocsr()
+            self.M = self.M.tocsr()
+            matrices = {'KL': self.KL, 'KNL': self.KNL, 'M': self.M}
+            if self.lumping:
+                matrices['Ml'] = self.Ml
+            self.cache.save(key, matrices)
+
+    def cacheKey(self) -> str:
+        """Creates the hash of the global matrices. It depends on the mesh, the nonlocal elements, the constitutive matrices, the density, the mass lumping method and the nonlocal parameters.
 
-        for ee, e in enumerate(tqdm(self.elements, unit='Element')):
-            m = len(e.gdl.T)
-
-            # Gauss points in global coordinates and Shape functions evaluated in gauss points
-            _x, _p = e._x, e._p
-            # Jacobian evaluated in gauss points and shape functions derivatives in natural coordinates
-            # jac, dpz = e.J(e.Z.T)
-            detjac = e.detjac
-            # _j = np.linalg.inv(jac)  # Jacobian inverse
-            dpx = e.dpx  # Shape function derivatives in global coordinates
-
-            C = self.C[ee]
-            o = [0.0]*m
-            Ke = np.zeros([3*m, 3*m])
-            Me = np.zeros([3*m, 3*m])
-            Fe = np.zeros([3*m, 1])
-
-            for k in range(len(e.Z)):  # Iterate over gauss points on domain
-                B = np.array([
-                    [*dpx[k, 0, :], *o, *o],
-                    [*o, *dpx[k, 1, :], *o],
-                    [*o, *o, *dpx[k, 2, :]],
-                    [*dpx[k, 2, :], *o, *dpx[k, 0, :]],
-                    [*o, *dpx[k, 2, :], *dpx[k, 1, :]],
-                    [*dpx[k, 1, :], *dpx[k, 0, :], *o]])
-                P = np.array([
-                    [*_p[k], *o, *o],
-                    [*o, *_p[k], *o],
-                    [*o, *o, *_p[k]]])
-
-                Ke += (B.T@C@B)*detjac[k]*e.W[k]
-                Me += self.rho[ee]*(P.T@P)*detjac[k]*e.W[k]
-
-                _fx = self.fx(_x[k])
-                _fy = self.fy(_x[k])
-                _fz = self.fz(_x[k])
+        Returns:
+            str: Hexadecimal SHA-256 digest
+        """
+        return contentHash(self.name, meshHash(self.geometry), *self.elements.adjacency(), np.array(self.C), self.rho, self.lumping,
+                           float(self.l), float(self.Lr), attenuationSamples(self.af, 2*self.Lr/self.l), self.cutoff, self.threshold)
 
-                F = np.array([[_fx], [_fy], [_fz]])
-                Fe += (P.T @ F)*detjac[k]*e.W[k]
+    def cutoffDistance(self) -> float:
+        """Maximum normalized distance of the integrated Gauss points pairs
 
-            self.F[np.ix_(e.gdlm)] += Fe
-            self.KL[np.ix_(e.gdlm, e.gdlm)] += Ke
-            self.M[np.ix_(e.gdlm, e.gdlm)] += Me
-            # print('Ensembling equation system...')
-            # for e in tqdm(self.elements, unit='Element'):
-            #     self.K[np.ix_(e.gdlm, e.gdlm)] += e.Ke*self.z1
-            #     for i, eee in enumerate(e.enl):
-            #         enl = self.elements[eee]
-            #         self.K[np.ix_(e.gdlm, enl.gdlm)] += e.knls[i]*self.z2
-            #     self.F[np.ix_(e.gdlm)] += e.Fe
-            #     self.Q[np.ix_(e.gdlm)] += e.Qe
-            # print('Done!')
+        Returns:
+            float: Lr/l if the Gauss points pairs are cut off, None otherwise
+        """
+        if self.cutoff:
+            return self.Lr/self.l
+        return None
 
-            e.knls = []
-            for inl in tqdm(e.enl, unit=' Nolocal'):
-                enl = self.elements[inl]
-                mnl = len(enl.gdl.T)
-                Knl = np.zeros([3*m, 3*mnl])
-                _xnl = enl._x
-                detjacnl = enl.detjac
-                dpxnl = enl.dpx
+    def nonlocalBlocks(self, idx: np.ndarray) -> list:
+        """Calculates the nonlocal matrices of a chunk of elements. The stacked geometry, the constitutive matrices and the nonlocal elements are taken from the nonlocalData attribute.
 
-                for k in range(len(e.Z)):
-                    B = np.array([
-                        [*dpx[k, 0, :], *o, *o],
-                        [*o, *dpx[k, 1, :], *o],
-                        [*o, *o, *dpx[k, 2, :]],
-                        [*dpx[k, 2, :], *o, *dpx[k, 0, :]],
-                        [*o, *dpx[k, 2, :], *dpx[k, 1, :]],
-                        [*dpx[k, 1, :], *dpx[k, 0, :], *o]])
-
-                    for knl in range(len(enl.Z)):
-                        ro = np.linalg.norm(_x[k]-_xnl[knl])/self.l
-                        azn = self.af(ro)
-                        Bnl = np.array([
-                            [*dpxnl[knl, 0, :], *o, *o],
-                            [*o, *dpxnl[knl, 1, :], *o],
-                            [*o, *o, *dpxnl[knl, 2, :]],
-                            [*dpxnl[knl, 2, :], *o, *dpxnl[knl, 0, :]],
-                            [*o, *dpxnl[knl, 2, :], *dpxnl[knl, 1, :]],
-                            [*dpxnl[knl, 1, :], *dpxnl[knl, 0, :], *o]])
+        Args:
+            idx (np.ndarray): Element indices
 
-                        Knl += azn*(Bnl.T@C@B)*detjac[k] * \
-                            e.W[k]*detjacnl[knl]*enl.W[knl]
-                self.KNL[np.ix_(e.gdlm, enl.gdlm)] += Knl.T
+        Returns:
+            list: Triplet blocks with the rows degrees of freedom, the nonlocal matrices and the columns degrees of freedom
+        """
+        geometry, Cs, neighbours = self.nonlocalData
+        blocks = []
+        for ee in idx:
+            blocks += nonlocalElementMatrices(geometry, ee, neighbours[ee], self.C[ee], self.l, self.af, Cs,
+                                              self.cutoffDistance(), self.threshold)
+        return blocks
 
     def ensembling(self) -> None:
-        """Creation of the system sparse matrix. Force vector is ensembled in integration method
+        """Creation of the system sparse matrix. Force vector is ensembled in integration method.
+        If the problem is matrix free, the system matrix is a StiffnessOperator
         """
         logging.info('Ensembling equation system...')
-        self.K = self.KL*self.z1 + self.KNL*self.z2
+        self.KL = self.KL.tocsr()
+        if self.matrixFree:
+            self.K = StiffnessOperator(self.KL, self.KNL, self.z1, self.z2)
+        else:
+            self.KNL = self.KNL.tocsr()
+            self.K = self.KL*self.z1 + self.KNL*self.z2
         self.M = self.M.tocsr()
         logging.info('Done!')
 
+    def sweep(self, Z: list, k: int = 20, path: str = '', callback: Callable = None, **kargs) -> list:
+        """Solves the smallest k eigenvalues for several z1 factors. The local and nonlocal matrices are calculated only once.
+        If the problem solver is not an eigen value solver, a LinealEigen solver is used.
+
+        Args:
+            Z (list): z1 factors. z2 is calculated as 1-z1.
+            k (int, optional): Number of eigenvalues to calculate. Defaults to 20.
+            path (str, optional): Filename of the results of every z1 factor, formatted with the z1 factor. Example: 'results_{z1}.json'. Defaults to ''.
+            callback (Callable, optional): Function called with the result record of every z1 factor as soon as it is solved. Defaults to None.
+            **kargs: Any of the LinealEigen options (method, sigma, preconditioner, tol, maxiter).
+
+        Returns:
+            list: Result record of every z1 factor
+        """
+        if not isinstance(self.solver, LinealEigen):
+            self.solver = LinealEigen(self)
+        records = self.solver.sweep(Z, k, path, callback, **kargs)
+        duration = self.logger.end_timer().total_seconds()
+        self.properties['duration'] = duration
+        return records
+
 
 class NonLocalElasticityFromTensor(NonLocalElasticity):
 
@@ -385,9 +478,7 @@ class NonLocalElasticityLegacy(Elasticity):
 
         self.af = af
         self.Lr = Lr
-        nonlocals = self.geometry.detectNonLocal(Lr)
-        for e, dno in zip(self.elements, nonlocals):
-            e.enl = dno
+        self.elements.setNeighbours(*self.geometry.nonlocalAdjacency(Lr))
         self.name = 'Non Local Elasticity sparse'
         self.zs = []
 
@@ -399,9 +490,9 @@ class NonLocalElasticityLegacy(Elasticity):
             m = len(e.gdl.T)
 
             # Gauss points in global coordinates and Shape functions evaluated in gauss points
-            _x, _p = e.T(e.Z.T)
+            _x, _p = e._x, e._p
             # Jacobian evaluated in gauss points and shape functions derivatives in natural coordinates
-            jac, dpz = e.J(e.Z.T)
+            jac, dpz = e.jacs, e.dpz
             detjac = np.linalg.det(jac)
             _j = np.linalg.inv(jac)  # Jacobian inverse
             dpx = _j @ dpz  # Shape function derivatives in global coordinates
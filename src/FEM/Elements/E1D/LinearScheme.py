@@ -2,6 +2,7 @@
 """
 
 import numpy as np
+from ..Element import gaussLegendre
 
 
 class LinearScheme():
@@ -18,5 +19,5 @@ class LinearScheme():
             n (int): Number of gauss points
         """
         self.center = np.array([[0.0]])
-        self.Z, self.W = np.polynomial.legendre.leggauss(n)
+        self.Z, self.W = gaussLegendre(n)
         self.domain = np.array([[-1] + self.Z.tolist() + [1]])[0]
@@ -3,6 +3,7 @@
 
 
 import numpy as np
+from ..Element import gaussLegendre
 
 
 class RectangularScheme():
@@ -24,7 +25,7 @@ class RectangularScheme():
             lambda s: np.array([-1*s, 1*(s-s+1)]),
             lambda s: np.array([-1*(s-s+1), -1*s]),
         ]
-        _Z, _W = np.polynomial.legendre.leggauss(n)
+        _Z, _W = gaussLegendre(n)
         self.Z = []
         self.W = []
         for i, z in enumerate(_Z):
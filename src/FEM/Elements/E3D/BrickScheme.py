@@ -3,6 +3,7 @@
 
 
 import numpy as np
+from ..Element import gaussLegendre
 
 
 class BrickScheme():
@@ -19,7 +20,7 @@ class BrickScheme():
             n (int): Number of gauss points
         """
 
-        _Z, _W = np.polynomial.legendre.leggauss(n)
+        _Z, _W = gaussLegendre(n)
         self.Z = []
         self.W = []
         for i, z in enumerate(_Z):
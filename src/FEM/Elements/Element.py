@@ -5,9 +5,34 @@
 import logging
 import numpy as np
 from typing import Callable
+from functools import lru_cache
 
 # TODO make list of avaliable Element atributes.
 
+REFERENCE_TABLES = {}
+"""Shape functions and derivatives at the reference points of every element type.
+The keys are (element class, number of Gauss points)."""
+
+
+def _readOnly(a: np.ndarray) -> np.ndarray:
+    a = np.array(a, dtype=float)
+    a.flags.writeable = False
+    return a
+
+
+@lru_cache(maxsize=None)
+def gaussLegendre(n: int) -> tuple:
+    """Gauss-Legendre quadrature points and weights. The rules are calculated once and shared by all the elements
+
+    Args:
+        n (int): Number of points
+
+    Returns:
+        tuple: Read only points and weights arrays
+    """
+    Z, W = np.polynomial.legendre.leggauss(n)
+    return _readOnly(Z), _readOnly(W)
+
 
 class Element():
     """Generates a generic element.
@@ -17,9 +42,12 @@ class Element():
         _coords (np.ndarray): Vertical coordinates matrix for graphical interfaces
         gdl (np.ndarray): Degree of freedom matrix. Each row is a variable.
         border (bool): True if the element is part of the border domain of another element.
+        fast (bool): If True, the element does not record Ke, Me, Fe, Qe. Defaults to False.
+        block (ElementBlock): Element block that stores the element arrays. Defaults to None.
+        blockIndex (int): Row of the element in the block. Defaults to None.
     """
 
-    def __init__(self, coords: np.ndarray, _coords: np.ndarray, gdl: np.ndarray, border: bool = False, fast: bool = False) -> None:
+    def __init__(self, coords: np.ndarray, _coords: np.ndarray, gdl: np.ndarray, border: bool = False, fast: bool = False, block: 'ElementBlock' = None, blockIndex: int = None) -> None:
         """Generates a generic element.
 
         Args:
@@ -28,6 +56,8 @@ class Element():
             gdl (np.ndarray): Degree of freedom matrix. Each row is a variable.
             border (bool): True if the element is part of the border domain of another element.
             fast (bool): If True, the element does not record Ke, Me, Fe, Qe. Defaults to False.
+            block (ElementBlock): Element block that stores the element arrays. If given, the element attributes are views of the block arrays and the Gauss points geometry is not calculated. Defaults to None.
+            blockIndex (int): Row of the element in the block. Defaults to None.
         """
 
         self.coords = coords
@@ -35,37 +65,114 @@ class Element():
         self.border = border
         self.gdl = gdl
         self.fast = fast
-        self.gdlm = []
-        for i in range(len(self.gdl)):
-            for j in range(len(self.gdl[i])):
-                self.gdlm.append(self.gdl[i, j])
+        self.block = block
+        self.blockIndex = blockIndex
         self.n = int(len(self.gdl)*len(self.gdl[0]))
         # TODO this was only intended for 2D plane stress/strain elements
         self.properties = {'load_x': [], 'load_y': []}
         self.intBorders = False
-        self._x, self._p = self.T(self.Z.T)
-        self.jacs, self.dpz = self.J(self.Z.T)
-        self._xcenter = self.T(self.center.T)[0].flatten()
+        if block is not None:
+            k = blockIndex
+            self.coords = block.coords[k]
+            self.gdl = block.gdl[k]
+            self.gdlm = block.gdlm[k].tolist()
+            self._x, self._p = block._x[k], block._p
+            self.jacs, self.dpz = block.jacs[k], block.dpz
+            self._xcenter = block.centers[k]
+            self.detjac = block.detjac[k]
+            self.dpx = block.dpx[k]
+            self.Ue = block.Ue[k]
+            return
+        self.gdlm = []
+        for i in range(len(self.gdl)):
+            for j in range(len(self.gdl[i])):
+                self.gdlm.append(self.gdl[i, j])
+        tables = self.referenceTables()
+        self._p, self.dpz = tables['Z']
+        self._x = self._p @ self.coords
+        self.jacs = self.dpz @ self.coords
+        self._xcenter = (tables['center'][0] @ self.coords).flatten()
         if not self.border:
-            if not self.fast:
-                self.Ke = np.zeros([self.n, self.n])
-                self.Fe = np.zeros([self.n, 1])
-                self.Qe = np.zeros([self.n, 1])
-
             # Specific transformations
             self.detjac = np.linalg.det(self.jacs)
             _j = np.linalg.inv(self.jacs)
             self.dpx = _j @ self.dpz
         self.Ue = np.zeros(self.gdl.shape)
 
+    def __getattr__(self, name: str) -> np.ndarray:
+        """Allocates the element matrices and vectors (Ke, Fe, Qe) the first time they are used
+
+        Args:
+            name (str): Attribute name
+
+        Returns:
+            np.ndarray: Zero element matrix or vector
+        """
+        if name in ('Ke', 'Fe', 'Qe') and 'n' in self.__dict__:
+            n = self.n
+            value = np.zeros([n, n]) if name == 'Ke' else np.zeros([n, 1])
+            setattr(self, name, value)
+            return value
+        raise AttributeError(
+            f"'{self.__class__.__name__}' object has no attribute '{name}'")
+
+    def referenceTables(self) -> dict:
+        """Gives the shape functions and their natural derivatives at the Gauss points ('Z'),
+        the domain sample points ('domain') and the center ('center') of the element type.
+        The tables are calculated once per element class and number of Gauss points and shared by all the elements.
+
+        Returns:
+            dict: Tuples of shape functions (n, m) and derivatives (n, dim, m) of every set of points
+        """
+        key = (self.__class__, len(self.Z))
+        tables = REFERENCE_TABLES.get(key)
+        if tables is None:
+            tables = {}
+            for name in ('Z', 'domain', 'center'):
+                z = getattr(self, name).T
+                tables[name] = (_readOnly(self.psis(z)),
+                                _readOnly(self.dpsis(z).T))
+            REFERENCE_TABLES[key] = tables
+        return tables
+
+    def borderTables(self, j: int) -> tuple:
+        """Gives the shape functions and their natural derivatives at the Gauss points of an element border.
+        The tables are shared by all the elements of the same type.
+
+        Args:
+            j (int): Border index
+
+        Returns:
+            tuple: Shape functions (n, m) and derivatives (n, dim, m)
+        """
+        tables = self.referenceTables()
+        key = ('border', j, len(self.borders[j].Z))
+        if key not in tables:
+            z = self.Tj[j](self.borders[j].Z.T)
+            tables[key] = (_readOnly(self.psis(z)),
+                           _readOnly(self.dpsis(z).T))
+        return tables[key]
+
+    def borderT(self, j: int) -> tuple:
+        """Give the global coordinates and shape functions at the Gauss points of an element border
+
+        Args:
+            j (int): Border index
+
+        Returns:
+            tuple: Global coordinates matrix and shape functions
+        """
+        _p = self.borderTables(j)[0]
+        return _p@self.coords, _p
+
     def restartMatrix(self) -> None:
         """Sets all element matrices and vectors to 0 state
         """
         if not self.border:
-            self.Ke[:, :] = 0.0
-            self.Fe[:, :] = 0.0
+            for name in ('Ke', 'Fe', 'Qe'):
+                if name in self.__dict__:
+                    self.__dict__[name][:, :] = 0.0
             self.Ue[:, :] = 0.0
-            self.Qe[:, :] = 0.0
 
     def T(self, z: np.ndarray) -> np.ndarray:
         """Give the global coordinates of given natural coordiantes over element
@@ -137,12 +244,11 @@ class Element():
             np.ndarray: Arrays of coordinates, solutions and second variables solutions.
         """
 
-        _z = self.domain
-        if domain == 'gauss-points':
-            _z = self.Z
-        _x, _p = self.T(_z.T)
+        _p, dpz = self.referenceTables()[
+            'Z' if domain == 'gauss-points' else 'domain']
+        _x = _p@self.coords
         if SVSolution:
-            j, dpz = self.J(_z.T)
+            j = dpz @ self.coords
             dpx = np.linalg.inv(j) @ dpz
             # print((self.Ue @ np.transpose(dpx,axes=[0,2,1])).shape)
             return _x, self.Ue@_p.T, self.Ue @ np.transpose(dpx, axes=[0, 2, 1])
@@ -0,0 +1,212 @@
+"""Element block class
+"""
+
+
+import numpy as np
+
+
+class ElementBlock():
+    """Struct of arrays storage of a group of elements with the same type and number of nodes.
+
+    The connectivity, coordinates, degrees of freedom and Gauss points geometry of all the elements
+    are stored as contiguous arrays. The element objects are views of a block row, so the element
+    attributes (coords, gdl, _x, dpx, detjac, Ue...) are not copied.
+
+    Args:
+        etype (type): Element class
+        indices (np.ndarray): Global indices of the block elements
+        connectivity (np.ndarray): Nodes of every element with shape (ne, m)
+        gdls (np.ndarray): Geometry nodes coordinates
+        nvn (int): Number of variables per node
+        fast (bool, optional): If True, the element views does not record Ke, Me, Fe, Qe. Defaults to False.
+    """
+
+    def __init__(self, etype: type, indices: np.ndarray, connectivity: np.ndarray, gdls: np.ndarray, nvn: int, fast: bool = False) -> None:
+        """Struct of arrays storage of a group of elements with the same type and number of nodes.
+
+        Args:
+            etype (type): Element class
+            indices (np.ndarray): Global indices of the block elements
+            connectivity (np.ndarray): Nodes of every element with shape (ne, m)
+            gdls (np.ndarray): Geometry nodes coordinates
+            nvn (int): Number of variables per node
+            fast (bool, optional): If True, the element views does not record Ke, Me, Fe, Qe. Defaults to False.
+        """
+        self.type = etype
+        self.fast = fast
+        self.nvn = nvn
+        self.indices = np.array(indices, dtype=int)
+        self.connectivity = np.array(connectivity, dtype=int)
+        ne, m = self.connectivity.shape
+        self.coords = np.array(gdls)[self.connectivity]
+        self.gdl = self.connectivity[:, None, :] * \
+            nvn + np.arange(nvn)[None, :, None]
+        self.gdlm = self.gdl.reshape([ne, nvn*m])
+
+        prototype = etype(self.coords[0], self.gdl[0], fast=True)
+        self.Z = prototype.Z
+        self.W = prototype.W
+        self.corners = len(prototype._coords)
+        tables = prototype.referenceTables()
+        self._p, self.dpz = tables['Z']
+        pcenter = tables['center'][0]
+
+        self._x = np.einsum('gm,emd->egd', self._p, self.coords)
+        self.jacs = np.einsum('gdm,emk->egdk', self.dpz, self.coords)
+        self.detjac = np.linalg.det(self.jacs)
+        self.dpx = np.linalg.inv(self.jacs) @ self.dpz
+        self.centers = np.einsum('cm,emd->ecd', pcenter, self.coords)[:, 0, :]
+        self.Ue = np.zeros([ne, nvn, m])
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def element(self, k: int) -> 'Element':
+        """Creates the element view of a block row
+
+        Args:
+            k (int): Row of the element in the block
+
+        Returns:
+            Element: Element whose attributes are views of the block arrays
+        """
+        e = self.type(self.coords[k], self.gdl[k],
+                      fast=self.fast, block=self, blockIndex=k)
+        e.index = int(self.indices[k])
+        return e
+
+
+class ElementList():
+    """Sequence of the elements of a geometry. The element objects are created from their blocks only
+    when they are accessed, so the geometry can be created without creating Python objects for every element.
+
+    Args:
+        blocks (list): Element blocks
+        n (int): Total number of elements
+    """
+
+    def __init__(self, blocks: list, n: int) -> None:
+        """Sequence of the elements of a geometry. The element objects are created from their blocks only
+        when they are accessed, so the geometry can be created without creating Python objects for every element.
+
+        Args:
+            blocks (list): Element blocks
+            n (int): Total number of elements
+        """
+        self.blocks = blocks
+        self.block = np.zeros(n, dtype=int)
+        self.row = np.zeros(n, dtype=int)
+        for b, block in enumerate(blocks):
+            self.block[block.indices] = b
+            self.row[block.indices] = np.arange(len(block))
+        self._elements = [None]*n
+        self.enlIndptr = None
+        self.enlIndices = None
+
+    def __len__(self) -> int:
+        return len(self._elements)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = range(len(self))[i]
+        e = self._elements[i]
+        if e is None:
+            e = self.blocks[self.block[i]].element(self.row[i])
+            if self.enlIndptr is not None:
+                e.enl = self.enlIndices[self.enlIndptr[i]:self.enlIndptr[i+1]]
+            self._elements[i] = e
+        return e
+
+    def __setitem__(self, i: int, e: 'Element') -> None:
+        i = range(len(self))[i]
+        self._elements[i] = e
+        self.block[i] = -1
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def materialized(self) -> int:
+        """Gives the number of element objects created
+
+        Returns:
+            int: Number of element objects
+        """
+        return len(self._elements) - self._elements.count(None)
+
+    def setNeighbours(self, indptr: np.ndarray, indices: np.ndarray) -> None:
+        """Assign the nonlocal elements of all the elements as CSR arrays. The element objects get the enl attribute
+        as a view of the indices array when they are created.
+
+        Args:
+            indptr (np.ndarray): Start of the nonlocal elements of every element in indices
+            indices (np.ndarray): Nonlocal elements of all the elements
+        """
+        self.enlIndptr = np.asarray(indptr)
+        self.enlIndices = np.asarray(indices)
+        for i, e in enumerate(self._elements):
+            if e is not None:
+                e.enl = self.enlIndices[self.enlIndptr[i]:self.enlIndptr[i+1]]
+
+    def adjacency(self) -> tuple:
+        """Gives the nonlocal elements of all the elements as CSR arrays. The nonlocal elements of the element objects
+        already created are taken from their enl attribute, so they can be modified after setNeighbours.
+
+        Returns:
+            tuple: Start of the nonlocal elements of every element in indices and nonlocal elements of all the elements
+        """
+        indptr, indices = self.enlIndptr, self.enlIndices
+        if indptr is None:
+            indptr = np.zeros(len(self)+1, dtype=np.int64)
+            indices = np.zeros(0, dtype=np.int32)
+        changed = {}
+        for i, e in enumerate(self._elements):
+            if e is not None and not np.array_equal(getattr(e, 'enl', []), indices[indptr[i]:indptr[i+1]]):
+                changed[i] = np.asarray(e.enl, dtype=indices.dtype)
+        if changed:
+            neighbours = np.split(indices, indptr[1:-1])
+            for i, enl in changed.items():
+                neighbours[i] = enl
+            indptr = np.concatenate(
+                [[0], np.cumsum([len(enl) for enl in neighbours])]).astype(np.int64)
+            indices = np.concatenate(neighbours).astype(indices.dtype)
+        return indptr, indices
+
+    def groups(self) -> list:
+        """Groups the elements by block. Elements replaced by other objects are grouped by type and size.
+
+        Returns:
+            list: Element indices of every group
+        """
+        result = []
+        for b, block in enumerate(self.blocks):
+            idx = block.indices[self.block[block.indices] == b]
+            if len(idx):
+                result.append(idx)
+        others = {}
+        for i in np.where(self.block < 0)[0]:
+            e = self._elements[i]
+            key = (e.__class__, len(e.W), len(e.gdlm))
+            others.setdefault(key, []).append(i)
+        return result + [np.array(idx) for idx in others.values()]
+
+    def dofs(self) -> list:
+        """Gives the flattened degrees of freedom of every element
+
+        Returns:
+            list: Degrees of freedom of every element
+        """
+        return [self.blocks[b].gdlm[r] if b >= 0 else self._elements[i].gdlm for i, (b, r) in enumerate(zip(self.block, self.row))]
+
+    def setUe(self, U: np.ndarray) -> None:
+        """Assing the local solution of all the elements
+
+        Args:
+            U (np.ndarray): Global solution
+        """
+        u = np.asarray(U).flatten()
+        for block in self.blocks:
+            block.Ue[:, :, :] = u[block.gdl]
+        for i in np.where(self.block < 0)[0]:
+            self._elements[i].setUe(U)
@@ -3,6 +3,7 @@
 
 
 from .Element import *
+from .ElementBlock import *
 from .E1D import *
 from .E2D import *
 from .E3D import *
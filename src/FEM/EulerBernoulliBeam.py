@@ -55,9 +55,9 @@ class EulerBernoulliBeam(Core):
         """Calculate the element matrices usign Guass Legendre quadrature.
         """
         for e in tqdm(self.elements, unit='Element'):
-            _x, _ = e.T(e.Z.T)
+            _x = e._x
             _h = e.hermit(e.Z.T)
-            jac, _ = e.J(e.Z.T)
+            jac = e.jacs
             detjac = np.linalg.det(jac)
             # _j = np.linalg.inv(jac)
             # dpx = _j @ dpz
@@ -119,9 +119,10 @@ class EulerBernoulliBeamNonLineal(Core):
         cf (float, optional): Soil coeficient. Defaults to 0.
         fx (float or int or function, optional): Force function applied in the x direction to the beam. Defaults to 0.0
         fy (float or int or function, optional): Force function applied in the y direction to the beam. Defaults to 0.0
+        **kargs: Any of the Core options (sparse, verbose, name, ebcMode, workers).
     """
 
-    def __init__(self, geometry: Geometry, EI: float, EA: float, fx: float = 0.0, fy: float = 0.0) -> None:
+    def __init__(self, geometry: Geometry, EI: float, EA: float, fx: float = 0.0, fy: float = 0.0, **kargs) -> None:
         """Creates a Euler Bernoulli beam problem
 
         Args:
@@ -131,6 +132,7 @@ class EulerBernoulliBeamNonLineal(Core):
             cf (float, optional): Soil coeficient. Defaults to 0.
             fx (float or int or function, optional): Force function applied in the x direction to the beam. Defaults to 0.0
             fy (float or int or function, optional): Force function applied in the y direction to the beam. Defaults to 0.0
+            **kargs: Any of the Core options (sparse, verbose, name, ebcMode, workers).
         """
         self.Axx = EI
         self.Dxx = EA
@@ -147,7 +149,7 @@ class EulerBernoulliBeamNonLineal(Core):
         if geometry.nvn == 1:
             logging.warning(
                 'Border conditions lost, please usea a geometry with 2 variables per node (nvn=2)')
-        Core.__init__(self, geometry, solver=NoLineal.LoadControl)
+        Core.__init__(self, geometry, solver=NoLineal.LoadControl, **kargs)
         self.properties['EI'] = EI
         self.properties['EA'] = EA
         self.properties['fx'] = fx
@@ -155,6 +157,9 @@ class EulerBernoulliBeamNonLineal(Core):
         for i in range(len(self.elements)):
             self.elements[i] = EulerBernoulliElement(
                 self.elements[i].coords, self.elements[i].gdl, nvn=3)
+        # The Euler Bernoulli elements order the degrees of freedom by node,
+        # so the sparsity pattern of the Lineal elements is calculated again
+        self.geometry.pattern = None
         self.name = 'Euler Bernoulli non linear'
 
     def elementMatrices(self) -> None:
@@ -168,9 +173,9 @@ class EulerBernoulliBeamNonLineal(Core):
             f1 = np.zeros([2, 1])
             f2 = np.zeros([4, 1])
             # Integración completa
-            _x, _p = e.T(e.Z.T)
+            _x, _p = e._x, e._p
             _h = e.hermit(e.Z.T)
-            jac, dpz = e.J(e.Z.T)
+            jac, dpz = e.jacs, e.dpz
             detjac = np.linalg.det(jac)
             _j = np.linalg.inv(jac)
             dpx = _j @ dpz
@@ -3,6 +3,7 @@
 import time
 import triangle as tr
 import copy
+import itertools
 import numpy as np
 import json
 from ..Utils import isBetween, roundCorner, giveCoordsCircle, angleBetweenAngles, testNeighborg
@@ -16,7 +17,9 @@ from ..Elements.E2D.QTriangular import QTriangular
 from ..Elements.E2D.LTriangular import LTriangular
 from ..Elements.E3D.Brick import Brick, BrickO2
 from ..Elements.E3D.Tetrahedral import Tetrahedral, TetrahedralO2
+from ..Elements.ElementBlock import ElementBlock, ElementList
 from .Region import Region, Region1D, Region2D
+from ..Assembly import SparsityPattern
 from typing import Callable
 from tqdm import tqdm
 
@@ -95,24 +98,132 @@ class Geometry:
         """
 
         self.ngdl = int(len(self.gdls)*self.nvn)
+        self.pattern = None
+        self.blocks = []
+        self.intBorders = np.zeros(len(self.dictionary), dtype=bool)
         self.generateElements()
         self.calculateRegions()
 
-    def detectNonLocal(self, lr: float) -> list:
-        """Detect adjacent elements between a distance Lr. Uses KDTrees
+    def sparsityPattern(self) -> SparsityPattern:
+        """Calculates the global CSR sparsity pattern of the elements. The pattern is calculated only once
+        and reused by all the sparse matrices that use the elements degrees of freedom.
+
+        Returns:
+            SparsityPattern: Sparsity pattern and element scatter map
+        """
+        if self.pattern is None or not self.pattern.nelements == len(self.elements):
+            print('Calculating sparsity pattern')
+            if isinstance(self.elements, ElementList):
+                gdlm = self.elements.dofs()
+            else:
+                gdlm = [e.gdlm for e in self.elements]
+            self.pattern = SparsityPattern(gdlm, self.ngdl)
+            print('Done!')
+        return self.pattern
+
+    def nonlocalAdjacency(self, lr: float, distances: bool = False, workers: int = -1, gauss: bool = False) -> tuple:
+        """Detect adjacent elements between a distance Lr. All the centroids are queried in one KDTree call.
+        If gauss, the Gauss points are queried instead (see gaussAdjacency). The adjacent elements of every element are sorted by index.
 
         Args:
             lr (float): Distance to detect adjacent elements
+            distances (bool, optional): To calculate the centroids distances. Defaults to False.
+            workers (int, optional): Number of threads of the centroids KDTree query. If -1, all the processors are used. Defaults to -1.
+            gauss (bool, optional): To detect the elements with at least one pair of Gauss points closer than Lr instead of the elements with centroids closer than Lr. Defaults to False.
 
         Returns:
-            list: Non local element dictionary
+            tuple: CSR adjacency, indptr (n+1,) and indices arrays. The adjacent elements of element i are indices[indptr[i]:indptr[i+1]]. If distances, the distances array with the shape of indices.
         """
         print('Detecting non local elements')
-        diccionariosnl = []
-        for e in tqdm(self.elements, unit='Elements'):
-            linea = self.KDTree.query_ball_point(e._xcenter, lr)
-            diccionariosnl.append(linea)
-        return diccionariosnl
+        centers = self.KDTree.data
+        if gauss:
+            indptr, indices = self.gaussAdjacency(lr)
+            lengths = np.diff(indptr)
+        else:
+            neighbours = self.KDTree.query_ball_point(
+                centers, lr, workers=workers, return_sorted=True)
+            lengths = np.fromiter(map(len, neighbours),
+                                  dtype=np.int64, count=len(neighbours))
+            indptr = np.zeros(len(neighbours)+1, dtype=np.int64)
+            np.cumsum(lengths, out=indptr[1:])
+            indices = np.fromiter(itertools.chain.from_iterable(
+                neighbours), dtype=np.int32, count=indptr[-1])
+            del neighbours
+        if distances:
+            rows = np.repeat(np.arange(len(lengths)), lengths)
+            return indptr, indices, np.linalg.norm(centers[indices]-centers[rows], axis=1)
+        return indptr, indices
+
+    def gaussAdjacency(self, lr: float, chunk: int = 65536) -> tuple:
+        """Detect the elements with at least one pair of Gauss points closer than Lr. The pairs of Gauss points closer than Lr
+        are found with a KDTree of the Gauss points and reduced to pairs of elements. The points are sorted by the first coordinate
+        and processed by strips of chunk points, together with the points closer than Lr to the strip. Every pair is taken
+        in the strip of its first point.
+
+        Args:
+            lr (float): Distance to detect adjacent elements
+            chunk (int, optional): Number of Gauss points of every strip. Defaults to 65536.
+
+        Returns:
+            tuple: CSR adjacency, indptr (n+1,) and indices arrays, sorted by index
+        """
+        points = self.gaussPoints()
+        ne = len(points)
+        valid = ~np.isnan(points[..., 0])
+        owner = np.nonzero(valid)[0]
+        points = points[valid]
+        order = np.argsort(points[:, 0], kind='stable')
+        x = points[order, 0]
+        n = len(points)
+        # Every element is adjacent to itself
+        keys = [np.arange(ne, dtype=np.int64)*(ne+1)]
+        for k in range(0, n, chunk):
+            end = n
+            if k+chunk < n:
+                end = np.searchsorted(x, x[k+chunk-1]+lr, side='right')
+            strip = order[k:end]
+            pairs = KDTree(points[strip]).query_pairs(
+                lr, output_type='ndarray')
+            pairs = pairs[np.minimum(pairs[:, 0], pairs[:, 1]) < chunk]
+            a = owner[strip[pairs[:, 0]]]
+            b = owner[strip[pairs[:, 1]]]
+            keys.append(np.unique(np.minimum(a, b)*ne+np.maximum(a, b)))
+        keys = np.unique(np.concatenate(keys))
+        keys = np.unique(np.concatenate([keys, (keys % ne)*ne+keys//ne]))
+        indptr = np.zeros(ne+1, dtype=np.int64)
+        np.cumsum(np.bincount(keys//ne, minlength=ne), out=indptr[1:])
+        return indptr, (keys % ne).astype(np.int32)
+
+    def gaussPoints(self) -> np.ndarray:
+        """Gauss points of all the elements in global coordinates. Elements with less Gauss points are padded with nan.
+
+        Returns:
+            np.ndarray: Gauss points with shape (ne, ng, dim)
+        """
+        if self.blocks:
+            ng = max([block._x.shape[1] for block in self.blocks])
+            points = np.full([len(self.elements), ng, self.gdls.shape[1]], np.nan)
+            for block in self.blocks:
+                points[block.indices, :block._x.shape[1]] = block._x
+            return points
+        ng = max([len(e._x) for e in self.elements])
+        points = np.full([len(self.elements), ng, self.gdls.shape[1]], np.nan)
+        for i, e in enumerate(self.elements):
+            points[i, :len(e._x)] = e._x
+        return points
+
+    def detectNonLocal(self, lr: float, gauss: bool = False) -> list:
+        """Detect adjacent elements between a distance Lr. Uses KDTrees
+
+        Args:
+            lr (float): Distance to detect adjacent elements
+            gauss (bool, optional): To detect the elements with at least one pair of Gauss points closer than Lr. Defaults to False.
+
+        Returns:
+            list: Non local element dictionary. The adjacent elements of every element are views of the nonlocalAdjacency indices array.
+        """
+        indptr, indices = self.nonlocalAdjacency(lr, gauss=gauss)
+        return np.split(indices, indptr[1:-1])
 
     def detectNonLocalLegacy(self, lr: float) -> list:
         """Detect adjacent elements between a distance Lr. Uses iterative approach
@@ -138,19 +249,18 @@ class Geometry:
         return diccionariosnl
 
     def generateElements(self) -> None:
-        """Generate elements structure
+        """Generate elements structure. The elements are stored in blocks of elements with the same type.
+        The element objects are views of the block arrays and they are only created when accessed.
         """
         print('Generating element structure')
-        self.elements = [0.0]*len(self.dictionary)
-        for i, d in enumerate(tqdm(self.dictionary, unit='Element')):
-            coords = self.gdls[np.ix_(d)]
-            gdl = np.zeros([self.nvn, len(d)])
-            for j in range(self.nvn):
-                gdl[j, :] = (np.array(d)*self.nvn+j)
-            gdl = gdl.astype(int)
-            self.elements[i] = types[self.types[i]](
-                coords, gdl, fast=self.fast)
-            self.elements[i].index = i
+        groups = {}
+        for i, d in enumerate(self.dictionary):
+            groups.setdefault((self.types[i], len(d)), []).append(i)
+        for (etype, _), indices in tqdm(groups.items(), unit='Block'):
+            block = ElementBlock(types[etype], indices, [
+                                 self.dictionary[i] for i in indices], self.gdls, self.nvn, self.fast)
+            self.blocks.append(block)
+        self.elements = ElementList(self.blocks, len(self.dictionary))
         print('Done!')
 
     def show(self) -> None:
@@ -160,6 +270,14 @@ class Geometry:
     def calculateCentroids(self) -> None:
         """Calculate elements centroids
         """
+        if self.blocks:
+            self.centroids = np.zeros([len(self.elements), 1, self.gdls.shape[1]])
+            for block in self.blocks:
+                self.centroids[block.indices, 0] = block.centers
+                dist = block.coords-block.centers[:, None, :]
+                self.min_search_radius = max(
+                    np.max(np.sum(dist**2, axis=2)**0.5), self.min_search_radius)
+            return
         for e in self.elements:
             dist = e.coords-e._xcenter
             min_search_radius = max(np.sum(dist**2, axis=1)**0.5)
@@ -168,6 +286,28 @@ class Geometry:
             x, _ = e.T(e.center.T)
             self.centroids.append(x.tolist())
 
+    def elementSizes(self) -> np.ndarray:
+        """Calculates the size of every element as the minimum distance between two of its nodes
+
+        Returns:
+            np.ndarray: Element sizes
+        """
+        if self.blocks:
+            sizes = np.zeros(len(self.elements))
+            for block in self.blocks:
+                dist = np.sum((block.coords[:, :, None, :] -
+                               block.coords[:, None, :, :])**2, axis=3)**0.5
+                m = dist.shape[1]
+                dist[:, np.arange(m), np.arange(m)] = np.inf
+                sizes[block.indices] = np.min(dist, axis=(1, 2))
+            return sizes
+        sizes = []
+        for e in self.elements:
+            dist = np.sum((e.coords[:, None, :] -
+                           e.coords[None, :, :])**2, axis=2)**0.5
+            sizes.append(np.min(dist[~np.eye(len(e.coords), dtype=bool)]))
+        return np.array(sizes)
+
     def setCbe(self, cbe: list) -> None:
         """This method have to be used to assign essential boundary conditions. Thes method prevents to assign duplicated border conditions
 
@@ -395,6 +535,51 @@ class Geometry2D(Geometry):
         """
         Geometry.__init__(self, dictionary, gdls, types, nvn, regions, fast)
 
+    def borderSegments(self) -> np.ndarray:
+        """Creates the segments of the domain border. The border segments are the element sides (between corner nodes) that belong to only one element.
+
+        Returns:
+            np.ndarray: Segments start and end points with shape (n, 2, 2)
+        """
+        sides = []
+        for block in self.blocks:
+            corners = block.connectivity[:, :block.corners]
+            sides.append(np.stack(
+                [corners, np.roll(corners, -1, axis=1)], axis=-1).reshape([-1, 2]))
+        sides = np.concatenate(sides)
+        _, first, counts = np.unique(np.sort(sides, axis=1), axis=0,
+                                     return_index=True, return_counts=True)
+        return np.asarray(self.gdls)[sides[first[counts == 1]]]
+
+    def skinPoints(self, points: np.ndarray, lr: float) -> np.ndarray:
+        """Finds the points of the skin region, the points closer than Lr to the domain border
+
+        Args:
+            points (np.ndarray): Points with shape (n, 2)
+            lr (float): Skin region width
+
+        Returns:
+            np.ndarray: Boolean mask of the skin region points
+        """
+        segments = self.borderSegments()
+        a = segments[:, 0]
+        d = segments[:, 1]-a
+        half = np.linalg.norm(d, axis=1).max()/2
+        candidates = KDTree(a+d/2).query_ball_point(points, lr+half)
+        rows = np.repeat(np.arange(len(points)),
+                         [len(c) for c in candidates])
+        cols = np.fromiter(itertools.chain.from_iterable(
+            candidates), dtype=np.int64, count=len(rows))
+        # Distance to the closest point of every candidate segment
+        s = np.einsum('ij,ij->i', points[rows]-a[cols], d[cols]) / \
+            np.einsum('ij,ij->i', d[cols], d[cols])
+        s = np.clip(s, 0.0, 1.0)
+        distance = np.linalg.norm(
+            points[rows]-a[cols]-s[:, None]*d[cols], axis=1)
+        mask = np.zeros(len(points), dtype=bool)
+        mask[rows[distance < lr]] = True
+        return mask
+
     def generateRegionFromCoords(self, p0: list, p1: list) -> None:
         """Generates a geometry Region1D by specified coordinates
 
@@ -501,6 +686,7 @@ class Geometry2D(Geometry):
         vect_seg = coordenadas[1]-coordenadas[0]
         for e in a:
             e.intBorders = True
+            self.intBorders[e.index] = True
             for i in range(-1, len(e.borders)-1):
                 pertenece1 = isBetween(
                     coordenadas[0], coordenadas[1], e._coords[i])
@@ -75,8 +75,8 @@ class Heat1D(Core):
             m = len(e.gdl.T)
             K = np.zeros([m, m])
             F = np.zeros([m, 1])
-            _x, _p = e.T(e.Z.T)
-            jac, dpz = e.J(e.Z.T)
+            _x, _p = e._x, e._p
+            jac, dpz = e.jacs, e.dpz
             detjac = np.linalg.det(jac)
             _j = np.linalg.inv(jac)
             dpx = _j @ dpz
@@ -192,8 +192,8 @@ class Heat1DTransient(Heat1D, CoreParabolic):
             Ft = np.zeros([m, 1])
             Ktp1 = np.zeros([m, m])
             Ftp1 = np.zeros([m, 1])
-            _x, _p = e.T(e.Z.T)
-            jac, dpz = e.J(e.Z.T)
+            _x, _p = e._x, e._p
+            jac, dpz = e.jacs, e.dpz
             detjac = np.linalg.det(jac)
             _j = np.linalg.inv(jac)
             dpx = _j @ dpz
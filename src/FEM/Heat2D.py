@@ -3,6 +3,7 @@
 
 
 from .Core import Core, tqdm, np, Geometry
+from .Parallel import parallelTasks, parallelMap
 import matplotlib.pyplot as plt
 import matplotlib
 from typing import Callable, Tuple
@@ -64,15 +65,36 @@ class Heat2D(Core):
 
     def elementMatrices(self) -> None:
         """Calculate the element matrices using Gauss Legendre quadrature.
+        The elements are divided in chunks that are calculated in parallel if the problem has more than one worker.
         """
-        for ee, e in enumerate(tqdm(self.elements, unit='Element')):
+        tasks = parallelTasks(
+            [np.arange(len(self.elements))], self.workers)
+        results = parallelMap(self, 'chunkMatrices', tasks, self.workers)
+        for idx, matrices in zip(tasks, tqdm(results, total=len(tasks), unit='Chunk')):
+            for ee, (Ke, Fe) in zip(idx, matrices):
+                e = self.elements[ee]
+                e.Fe += Fe
+                e.Ke += Ke
+
+    def chunkMatrices(self, idx: np.ndarray) -> list:
+        """Calculate the element matrices of a chunk of elements using Gauss Legendre quadrature.
+
+        Args:
+            idx (np.ndarray): Element indices
+
+        Returns:
+            list: Stiffness matrix and force vector of every element
+        """
+        result = []
+        for ee in idx:
+            e = self.elements[ee]
             m = len(e.gdl.T)
             K = np.zeros([m, m])
             H = np.zeros([m, m])
             F = np.zeros([m, 1])
             P = np.zeros([m, 1])
-            _x, _p = e.T(e.Z.T)
-            jac, dpz = e.J(e.Z.T)
+            _x, _p = e._x, e._p
+            jac, dpz = e.jacs, e.dpz
             detjac = np.linalg.det(jac)
             _j = np.linalg.inv(jac)
             dpx = _j @ dpz
@@ -86,11 +108,11 @@ class Heat2D(Core):
                     for k in range(len(e.Z)):
                         F[i][0] += _p[k, i] * self.f(_x[k])*detjac[k]*e.W[k]
 
-            if e.intBorders:
+            if self.geometry.intBorders[ee]:
                 for j in range(len(e.borders)):
                     border = e.borders[j]
                     if len(border.properties['load_x']):
-                        _x, _p = e.T(e.Tj[j](border.Z.T))
+                        _x, _p = e.borderT(j)
                         _s = border.TS(border.Z.T)
                         detjac = border.coords[-1, 0]*0.5
                         for i in range(m):
@@ -102,8 +124,8 @@ class Heat2D(Core):
                                     for k in range(len(border.Z)):
                                         H[i, j] += fx(_s[k, 0])*_p[k, i] * _p[k, j] * \
                                             detjac*border.W[k]
-            e.Fe += F+P
-            e.Ke += K+H
+            result.append((K+H, F+P))
+        return result
 
     def defineConvectiveBoderConditions(self, region: int, beta: float = 0, Ta: float = 0) -> None:
         """Define convective borders
@@ -0,0 +1,473 @@
+"""Vectorized element kernels.
+
+The elements are grouped by type and number of Gauss points. For every group, the Gauss points
+geometry is stacked in arrays and the element matrices of the whole group are calculated
+with a few einsum calls instead of a Python loop over the elements.
+"""
+
+
+import numpy as np
+from scipy import sparse
+from typing import Callable
+from .Elements.ElementBlock import ElementList
+
+
+def elementGroups(elements: list, chunk: int = None) -> list:
+    """Groups the elements by type and number of Gauss points. All the elements in a group have element matrices with the same size.
+    Elements stored in different element blocks are not grouped together.
+
+    Args:
+        elements (list): Elements
+        chunk (int, optional): Maximum number of elements per group. Used to bound the memory of the stacked arrays. If not given, groups are not divided. Defaults to None.
+
+    Returns:
+        list: Element indices of every group
+    """
+    if isinstance(elements, ElementList):
+        groups = elements.groups()
+    else:
+        groups = {}
+        for i, e in enumerate(elements):
+            key = (e.__class__, len(e.W), len(e.gdlm),
+                   id(getattr(e, 'block', None)))
+            groups.setdefault(key, []).append(i)
+        groups = groups.values()
+    result = []
+    for idx in groups:
+        idx = np.array(idx)
+        if chunk:
+            result += [idx[i:i+chunk] for i in range(0, len(idx), chunk)]
+        else:
+            result.append(idx)
+    return result
+
+
+def blockRows(elements: list, idx: np.ndarray) -> tuple:
+    """Gives the element block and the block rows of a group of elements
+
+    Args:
+        elements (list): Elements
+        idx (np.ndarray): Indices of the group elements
+
+    Returns:
+        tuple: Element block and rows of the elements in the block. If the elements are not stored in the same block, None is returned as block.
+    """
+    if isinstance(elements, ElementList):
+        b = np.unique(elements.block[idx])
+        if len(b) == 1 and b[0] >= 0:
+            return elements.blocks[b[0]], elements.row[idx]
+        return None, None
+    block = getattr(elements[idx[0]], 'block', None)
+    if block is None:
+        return None, None
+    rows = []
+    for i in idx:
+        e = elements[i]
+        if e.block is not block:
+            return None, None
+        rows.append(e.blockIndex)
+    return block, np.array(rows)
+
+
+def elementDofs(elements: list, idx: np.ndarray) -> np.ndarray:
+    """Stacks the flattened degrees of freedom of a group of elements
+
+    Args:
+        elements (list): Elements
+        idx (np.ndarray): Indices of the group elements
+
+    Returns:
+        np.ndarray: Degrees of freedom with shape (ne, n)
+    """
+    block, rows = blockRows(elements, idx)
+    if block is not None:
+        return block.gdlm[rows]
+    return np.array([elements[i].gdlm for i in idx], dtype=int)
+
+
+def gaussPointsGeometry(elements: list, idx: np.ndarray) -> tuple:
+    """Stacks the Gauss points geometry of a group of elements
+
+    Args:
+        elements (list): Elements
+        idx (np.ndarray): Indices of the group elements
+
+    Returns:
+        tuple: Gauss points in global coordinates (ne, ng, dim), shape functions (ne, ng, m), shape functions derivatives in global coordinates (ne, ng, dim, m) and integration weights (detjac*W) (ne, ng)
+    """
+    block, rows = blockRows(elements, idx)
+    if block is not None:
+        p = np.broadcast_to(block._p, (len(rows),)+block._p.shape)
+        return block._x[rows], p, block.dpx[rows], block.detjac[rows]*block.W
+    x = np.array([elements[i]._x for i in idx])
+    p = np.array([elements[i]._p for i in idx])
+    dpx = np.array([elements[i].dpx for i in idx])
+    dv = np.array([elements[i].detjac*elements[i].W for i in idx])
+    return x, p, dpx, dv
+
+
+def strainMatrix2D(dpx: np.ndarray) -> np.ndarray:
+    """Creates the plane strain-displacement matrices (B) of several Gauss points
+
+    Args:
+        dpx (np.ndarray): Shape functions derivatives in global coordinates with shape (..., 2, m)
+
+    Returns:
+        np.ndarray: B matrices with shape (..., 3, 2m)
+    """
+    m = dpx.shape[-1]
+    B = np.zeros(dpx.shape[:-2]+(3, 2*m))
+    B[..., 0, :m] = dpx[..., 0, :]
+    B[..., 1, m:] = dpx[..., 1, :]
+    B[..., 2, :m] = dpx[..., 1, :]
+    B[..., 2, m:] = dpx[..., 0, :]
+    return B
+
+
+def strainMatrix3D(dpx: np.ndarray) -> np.ndarray:
+    """Creates the 3D strain-displacement matrices (B) of several Gauss points
+
+    Args:
+        dpx (np.ndarray): Shape functions derivatives in global coordinates with shape (..., 3, m)
+
+    Returns:
+        np.ndarray: B matrices with shape (..., 6, 3m)
+    """
+    m = dpx.shape[-1]
+    B = np.zeros(dpx.shape[:-2]+(6, 3*m))
+    B[..., 0, :m] = dpx[..., 0, :]
+    B[..., 1, m:2*m] = dpx[..., 1, :]
+    B[..., 2, 2*m:] = dpx[..., 2, :]
+    B[..., 3, :m] = dpx[..., 2, :]
+    B[..., 3, 2*m:] = dpx[..., 0, :]
+    B[..., 4, m:2*m] = dpx[..., 2, :]
+    B[..., 4, 2*m:] = dpx[..., 1, :]
+    B[..., 5, :m] = dpx[..., 1, :]
+    B[..., 5, m:2*m] = dpx[..., 0, :]
+    return B
+
+
+def stiffnessMatrices(B: np.ndarray, C: np.ndarray, w: np.ndarray) -> np.ndarray:
+    """Integrates B.T@C@B over the elements of a group
+
+    Args:
+        B (np.ndarray): B matrices with shape (ne, ng, s, n)
+        C (np.ndarray): Constitutive matrices of the elements with shape (ne, s, s)
+        w (np.ndarray): Integration weights with shape (ne, ng)
+
+    Returns:
+        np.ndarray: Element matrices with shape (ne, n, n)
+    """
+    CB = np.einsum('est,egtb->egsb', C, B)
+    return np.einsum('egsa,egsb,eg->eab', B, CB, w, optimize=True)
+
+
+def massMatrices(p: np.ndarray, nvn: int, w: np.ndarray) -> np.ndarray:
+    """Integrates P.T@P over the elements of a group, where P interpolates the nvn variables with the same shape functions
+
+    Args:
+        p (np.ndarray): Shape functions with shape (ne, ng, m)
+        nvn (int): Number of variables per node
+        w (np.ndarray): Integration weights with shape (ne, ng). Density must be included
+
+    Returns:
+        np.ndarray: Element matrices with shape (ne, nvn*m, nvn*m)
+    """
+    ne, _, m = p.shape
+    pp = np.einsum('ega,egb,eg->eab', p, p, w, optimize=True)
+    M = np.zeros([ne, nvn*m, nvn*m])
+    for i in range(nvn):
+        M[:, i*m:(i+1)*m, i*m:(i+1)*m] = pp
+    return M
+
+
+def attenuation(af: Callable, rho: np.ndarray) -> np.ndarray:
+    """Evaluates an attenuation function over an array of normalized distances.
+    The function is called once with the whole array. If it does not support arrays, it is evaluated point by point.
+
+    Args:
+        af (Callable): Attenuation function
+        rho (np.ndarray): Normalized distances
+
+    Returns:
+        np.ndarray: Attenuation values with the shape of rho
+    """
+    try:
+        a = np.asarray(af(rho), dtype=float)
+        if a.shape == rho.shape:
+            return a
+    except Exception:
+        pass
+    return np.vectorize(af, otypes=[float])(rho)
+
+
+def gammaFunctions(points: np.ndarray, dv: np.ndarray, rows: np.ndarray, cols: np.ndarray, l: float, af: Callable, chunk: int = None) -> np.ndarray:
+    """Integrates the attenuation function of every Gauss point over the Gauss points of its nonlocal elements
+    (gamma functions of the Pisano 2009 non homogeneous model). The pairs of elements are integrated by chunks.
+
+    Args:
+        points (np.ndarray): Gauss points of all the elements with shape (ne, ng, dim). Padded points must be finite
+        dv (np.ndarray): Integration weights (detjac*W) with shape (ne, ng). Padded weights must be 0
+        rows (np.ndarray): Element of every pair, sorted
+        cols (np.ndarray): Nonlocal element of every pair
+        l (float): Internal length
+        af (Callable): Attenuation function
+        chunk (int, optional): Number of pairs integrated at once. If not given, it is calculated from the number of Gauss points. Defaults to None.
+
+    Returns:
+        np.ndarray: Gamma functions with shape (ne, ng). Elements without pairs have 0
+    """
+    gammas = np.zeros(dv.shape)
+    ng = dv.shape[1]
+    chunk = chunk or max(1, 2**21//(ng*ng))
+    for k in range(0, len(rows), chunk):
+        i = rows[k:k+chunk]
+        j = cols[k:k+chunk]
+        ro = np.linalg.norm(points[i][:, :, None, :] -
+                            points[j][:, None, :, :], axis=-1)/l
+        values = np.einsum('pgq,pq->pg', attenuation(af, ro), dv[j])
+        starts = np.flatnonzero(np.r_[True, i[1:] != i[:-1]])
+        gammas[i[starts]] += np.add.reduceat(values, starts, axis=0)
+    return gammas
+
+
+def interiorGamma(af: Callable, l: float, lr: float, n: int = 64) -> float:
+    """Integrates the attenuation function over a circle of radius Lr. It is the gamma function of the points farther than Lr from the border.
+
+    Args:
+        af (Callable): Attenuation function
+        l (float): Internal length
+        lr (float): Influence distance
+        n (int, optional): Number of Gauss-Legendre points of the radial integral. Defaults to 64.
+
+    Returns:
+        float: Integral of the attenuation function
+    """
+    z, w = np.polynomial.legendre.leggauss(n)
+    r = lr*(z+1)/2
+    return np.pi*lr*np.sum(w*r*attenuation(af, r/l))
+
+
+def minimumAttenuation(af: Callable, threshold: float = None) -> float:
+    """Gives the minimum attenuation of the integrated Gauss points pairs
+
+    Args:
+        af (Callable): Attenuation function
+        threshold (float, optional): Minimum attenuation relative to af(0). Defaults to None.
+
+    Returns:
+        float: Minimum attenuation. None if threshold is not given
+    """
+    if threshold is None:
+        return None
+    return threshold*np.abs(attenuation(af, np.zeros(1)))[0]
+
+
+def prunedAttenuation(af: Callable, ro: np.ndarray, cutoff: float = None, amin: float = None) -> tuple:
+    """Evaluates an attenuation function over the normalized distances of Gauss points pairs.
+    The pairs farther than the cutoff distance are not evaluated and the pairs with lower attenuation than amin are set to 0.
+
+    Args:
+        af (Callable): Attenuation function
+        ro (np.ndarray): Normalized distances
+        cutoff (float, optional): Maximum normalized distance. Defaults to None.
+        amin (float, optional): Minimum attenuation. Defaults to None.
+
+    Returns:
+        tuple: Attenuation values with the shape of ro and mask of the remaining pairs. If nothing is pruned, the mask is None
+    """
+    if cutoff is None and amin is None:
+        return attenuation(af, ro), None
+    a = np.zeros(ro.shape)
+    inside = np.ones(ro.shape, dtype=bool)
+    if cutoff is not None:
+        inside = ro <= cutoff
+    a[inside] = attenuation(af, ro[inside])
+    if amin is not None:
+        inside &= np.abs(a) >= amin
+        a[~inside] = 0.0
+    return a, inside
+
+
+def nonlocalGeometry(elements: list, groups: list, strainMatrix: Callable, factor: np.ndarray = None) -> tuple:
+    """Stacks the Gauss points geometry and the B matrices of all the elements, group by group.
+    The nonlocal elements of any element can then be gathered with array indexing.
+
+    Args:
+        elements (list): Elements
+        groups (list): Element indices of every group, as given by elementGroups
+        strainMatrix (Callable): Function that creates the B matrices from the shape functions derivatives (strainMatrix2D or strainMatrix3D)
+        factor (np.ndarray, optional): Factor of the integration weights of every element (thickness). Defaults to None.
+
+    Returns:
+        tuple: Group of every element, row of every element in its group and, for every group, a tuple with the Gauss points (ne, ng, dim), B matrices (ne, ng, s, n), integration weights (ne, ng) and degrees of freedom (ne, n)
+    """
+    group = np.zeros(len(elements), dtype=int)
+    row = np.zeros(len(elements), dtype=int)
+    data = []
+    for g, idx in enumerate(groups):
+        group[idx] = g
+        row[idx] = np.arange(len(idx))
+        _x, _, dpx, dv = gaussPointsGeometry(elements, idx)
+        if factor is not None:
+            dv = np.asarray(factor, dtype=float)[idx][:, None]*dv
+        data.append((_x, strainMatrix(dpx), dv, elementDofs(elements, idx)))
+    return group, row, data
+
+
+def symmetricNeighbours(neighbours: list) -> bool:
+    """Checks if a nonlocal neighbours relation is symmetric, that is, if every element is a nonlocal element of its nonlocal elements
+
+    Args:
+        neighbours (list): Nonlocal elements of every element
+
+    Returns:
+        bool: True if the relation is symmetric
+    """
+    n = len(neighbours)
+    rows = np.repeat(np.arange(n), [len(enl) for enl in neighbours])
+    cols = np.concatenate(
+        [np.asarray(enl, dtype=int) for enl in neighbours]+[np.zeros(0, dtype=int)])
+    A = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    A.data[:] = 1.0
+    return (A != A.T).nnz == 0
+
+
+def nonlocalElementMatrices(geometry: tuple, ee: int, enl: np.ndarray, C: np.ndarray, l: float, af: Callable, Cs: np.ndarray = None, cutoff: float = None, threshold: float = None) -> list:
+    """Calculates the nonlocal matrices of an element and all its nonlocal elements.
+    The nonlocal elements are processed by groups, so all the Gauss points pairs of a group are integrated at once.
+
+    If the constitutive matrices of all the elements are given, the nonlocal relation is assumed to be symmetric.
+    Only the nonlocal elements with index greater or equal than ee are processed and both blocks of every pair are returned.
+    The block of the nonlocal element is the transpose of the element block if both elements have the same constitutive matrix.
+    Otherwise it is integrated with the nonlocal element constitutive matrix over the same Gauss points pairs.
+
+    If a cutoff distance or an attenuation threshold are given, the Gauss points pairs farther than the cutoff distance
+    or with lower attenuation are not integrated and the nonlocal elements without any remaining pair are skipped.
+
+    Args:
+        geometry (tuple): Stacked geometry, as given by nonlocalGeometry
+        ee (int): Element index
+        enl (np.ndarray): Indices of the nonlocal elements
+        C (np.ndarray): Constitutive matrix of the element
+        l (float): Internal length
+        af (Callable): Attenuation function
+        Cs (np.ndarray, optional): Constitutive matrices of all the elements. Only symmetric constitutive matrices are supported. Defaults to None.
+        cutoff (float, optional): Maximum normalized distance (distance/l) of the integrated Gauss points pairs. Defaults to None.
+        threshold (float, optional): Minimum attenuation of the integrated Gauss points pairs, relative to af(0). Defaults to None.
+
+    Returns:
+        list: Tuples with the rows degrees of freedom (nn, n), the nonlocal matrices (nn, n, nnl) and the columns degrees of freedom (nn, nnl)
+    """
+    group, row, data = geometry
+    _x, B, w, gdlm = data[group[ee]]
+    i = row[ee]
+    enl = np.asarray(enl, dtype=int)
+    if Cs is not None:
+        enl = enl[enl >= ee]
+    amin = minimumAttenuation(af, threshold)
+    result = []
+    for g in np.unique(group[enl]):
+        nb = enl[group[enl] == g]
+        rows = row[nb]
+        _xnl, Bnl, wnl, gdlmnl = data[g]
+        _xnl = _xnl[rows]
+        ro = np.linalg.norm(
+            _x[i][None, :, None, :]-_xnl[:, None, :, :], axis=-1)/l
+        a, inside = prunedAttenuation(af, ro, cutoff, amin)
+        if inside is not None:
+            keep = np.any(inside, axis=(1, 2))
+            if not np.any(keep):
+                continue
+            nb, rows, a = nb[keep], rows[keep], a[keep]
+        Bnl = Bnl[rows]
+        wnl = wnl[rows]
+        Knl = nonlocalStiffnessMatrices(B[i], C, w[i], Bnl, wnl, a)
+        erows = np.broadcast_to(gdlm[i], (len(rows), gdlm.shape[1]))
+        result.append((erows, Knl, gdlmnl[rows]))
+        if Cs is None:
+            continue
+        pair = nb > ee
+        if not np.any(pair):
+            continue
+        Kt = Knl[pair]
+        other = pair & ~np.all(Cs[nb] == C, axis=(1, 2))
+        if np.any(other):
+            Kt[other[pair]] = nonlocalStiffnessMatrices(
+                B[i], Cs[nb[other]], w[i], Bnl[other], wnl[other], a[other])
+        result.append((gdlmnl[rows][pair], Kt.transpose(0, 2, 1),
+                       erows[pair]))
+    return result
+
+
+def nonlocalStiffnessMatrices(B: np.ndarray, C: np.ndarray, w: np.ndarray, Bnl: np.ndarray, wnl: np.ndarray, a: np.ndarray) -> np.ndarray:
+    """Integrates B.T@C@Bnl over the Gauss points pairs of an element and a group of nonlocal elements
+
+    Args:
+        B (np.ndarray): B matrices of the element with shape (ng, s, n)
+        C (np.ndarray): Constitutive matrix of the element with shape (s, s), or a constitutive matrix for every nonlocal element with shape (nn, s, s)
+        w (np.ndarray): Integration weights of the element with shape (ng,)
+        Bnl (np.ndarray): B matrices of the nonlocal elements with shape (nn, gnl, s, nnl)
+        wnl (np.ndarray): Integration weights of the nonlocal elements with shape (nn, gnl)
+        a (np.ndarray): Attenuation of every Gauss points pair with shape (nn, ng, gnl)
+
+    Returns:
+        np.ndarray: Nonlocal matrices with shape (nn, n, nnl). Rows are the element degrees of freedom and columns the nonlocal element degrees of freedom
+    """
+    nn, gnl, s, nnl = Bnl.shape
+    ng, _, n = B.shape
+    if C.ndim == 3:
+        CBnl = np.einsum('jts,jqtb->jqsb', C, Bnl)
+    else:
+        CBnl = np.einsum('ts,jqtb->jqsb', C, Bnl)
+    CBnl = CBnl.reshape([nn, gnl, s*nnl])
+    W = a*w[None, :, None]*wnl[:, None, :]
+    return np.einsum('gsa,jgsb->jab', B, (W@CBnl).reshape([nn, ng, s, nnl]), optimize=True)
+
+
+def lumpedMasses(Me: np.ndarray, nvn: int, method: str = 'hrz') -> np.ndarray:
+    """Lumps the mass matrices of a group of elements into diagonal matrices
+
+    - rowsum: every diagonal entry is the sum of its row. High order elements can give zero or negative entries.
+    - hrz: Hinton-Rock-Zienkiewicz lumping. The diagonal of every variable block is scaled to keep the element mass. The entries are always positive.
+
+    Args:
+        Me (np.ndarray): Consistent mass matrices with shape (ne, nvn*m, nvn*m). The variables are ordered by blocks, as given by massMatrices
+        nvn (int): Number of variables per node
+        method (str, optional): Lumping method, 'rowsum' or 'hrz'. Defaults to 'hrz'.
+
+    Returns:
+        np.ndarray: Diagonals of the lumped mass matrices with shape (ne, nvn*m)
+    """
+    if method == 'rowsum':
+        return Me.sum(axis=2)
+    if not method == 'hrz':
+        raise ValueError(f'Unknown mass lumping method {method}')
+    ne, n, _ = Me.shape
+    m = n//nvn
+    blocks = Me.reshape([ne, nvn, m, nvn, m])
+    total = np.einsum('eiaib->ei', blocks)
+    diagonal = np.einsum('eiaia->eia', blocks)
+    return (diagonal*(total/diagonal.sum(axis=2))[:, :, None]).reshape([ne, n])
+
+
+def loadVectors(forces: list[Callable], x: np.ndarray, p: np.ndarray, w: np.ndarray) -> np.ndarray:
+    """Integrates P.T@f over the elements of a group
+
+    Args:
+        forces (list[Callable]): Force function of every variable. Each function receives a point in global coordinates
+        x (np.ndarray): Gauss points in global coordinates with shape (ne, ng, dim)
+        p (np.ndarray): Shape functions with shape (ne, ng, m)
+        w (np.ndarray): Integration weights with shape (ne, ng)
+
+    Returns:
+        np.ndarray: Element vectors with shape (ne, nvn*m)
+    """
+    ne, ng, m = p.shape
+    points = x.reshape([ne*ng, x.shape[-1]])
+    F = np.zeros([ne, len(forces)*m])
+    for i, f in enumerate(forces):
+        values = np.array([f(xk) for xk in points],
+                          dtype=float).reshape([ne, ng])
+        F[:, i*m:(i+1)*m] = np.einsum('ega,eg->ea', p, values*w)
+    return F
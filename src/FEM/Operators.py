@@ -0,0 +1,347 @@
+"""Matrix free operators of the nonlocal formulations.
+
+For large Lr/l ratios the nonlocal stiffness matrix is much denser than the local one. The operators of this module
+apply it to vectors without assembling it. By default, the pruned attenuation of the Gauss points pairs is calculated
+once and stored as a sparse matrix over the Gauss points, so every product is a sparse product between the strains and
+the stresses of the Gauss points. It needs one value per integrated Gauss points pair, which can be more memory than the
+assembled matrix (elements with many Gauss points and few nodes). With the onTheFly option only the shape functions
+derivatives, the Gauss points and the nonlocal elements of every element are stored and the attenuation is evaluated,
+by chunks of element pairs, every time the operator is applied. It uses the least memory but every product is much slower.
+"""
+
+
+import logging
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator
+from typing import Callable
+from .Kernels import gaussPointsGeometry, elementDofs, symmetricNeighbours, minimumAttenuation, prunedAttenuation
+
+
+def _accumulate(result: np.ndarray, idx: np.ndarray, values: np.ndarray) -> None:
+    order = np.argsort(idx, kind='stable')
+    idx = idx[order]
+    starts = np.flatnonzero(np.r_[True, idx[1:] != idx[:-1]])
+    result[idx[starts]] += np.add.reduceat(values[order], starts, axis=0)
+
+
+class NonLocalOperator(LinearOperator):
+    """Matrix free nonlocal stiffness matrix (KNL).
+    The operator is applied in three steps: the weighted strains of all the Gauss points are calculated, the strains
+    are averaged over the Gauss points of the nonlocal elements with the attenuation function and the averaged strains
+    are integrated as stresses with the element B matrices. If the nonlocal relation is symmetric, the attenuation
+    of every pair of elements is evaluated once. The pruned attenuation of the Gauss points pairs is calculated once and
+    stored as a sparse matrix (weights) over the Gauss points of all the elements, unless it is calculated on the fly.
+    The stored weights need one value per integrated Gauss points pair, which can be more memory than the assembled matrix.
+    Calculating them on the fly uses the least memory, but every product is much slower.
+
+    Args:
+        elements (list): Elements
+        groups (list): Element indices of every group, as given by elementGroups
+        strainMatrix (Callable): Function that creates the B matrices from the shape functions derivatives (strainMatrix2D or strainMatrix3D)
+        C (np.ndarray): Constitutive matrix of every element with shape (ne, s, s)
+        l (float): Internal length
+        af (Callable): Attenuation function
+        neighbours (list): Nonlocal elements of every element
+        ngdl (int): Number of degrees of freedom
+        factor (np.ndarray, optional): Factor of the integration weights of every element (thickness). Defaults to None.
+        cutoff (float, optional): Maximum normalized distance (distance/l) of the integrated Gauss points pairs. Defaults to None.
+        threshold (float, optional): Minimum attenuation of the integrated Gauss points pairs, relative to af(0). Defaults to None.
+        chunk (int, optional): Number of elements whose strains are calculated at once. Defaults to 4096.
+        onTheFly (bool, optional): To calculate the attenuation of the Gauss points pairs in every product instead of storing it. Use it if the stored weights do not fit in memory. Defaults to False.
+    """
+
+    def __init__(self, elements: list, groups: list, strainMatrix: Callable, C: np.ndarray, l: float, af: Callable, neighbours: list, ngdl: int, factor: np.ndarray = None, cutoff: float = None, threshold: float = None, chunk: int = 4096, onTheFly: bool = False) -> None:
+        """Matrix free nonlocal stiffness matrix (KNL). The stored weights need one value per integrated Gauss points pair,
+        which can be more memory than the assembled matrix. Calculating them on the fly uses the least memory, but every product is much slower.
+
+        Args:
+            elements (list): Elements
+            groups (list): Element indices of every group, as given by elementGroups
+            strainMatrix (Callable): Function that creates the B matrices from the shape functions derivatives (strainMatrix2D or strainMatrix3D)
+            C (np.ndarray): Constitutive matrix of every element with shape (ne, s, s)
+            l (float): Internal length
+            af (Callable): Attenuation function
+            neighbours (list): Nonlocal elements of every element
+            ngdl (int): Number of degrees of freedom
+            factor (np.ndarray, optional): Factor of the integration weights of every element (thickness). Defaults to None.
+            cutoff (float, optional): Maximum normalized distance (distance/l) of the integrated Gauss points pairs. Defaults to None.
+            threshold (float, optional): Minimum attenuation of the integrated Gauss points pairs, relative to af(0). Defaults to None.
+            chunk (int, optional): Number of elements whose strains are calculated at once. Defaults to 4096.
+            onTheFly (bool, optional): To calculate the attenuation of the Gauss points pairs in every product instead of storing it. Use it if the stored weights do not fit in memory. Defaults to False.
+        """
+        LinearOperator.__init__(self, dtype=float, shape=(ngdl, ngdl))
+        ne = len(elements)
+        data = [(idx,)+gaussPointsGeometry(elements, idx)+(elementDofs(elements, idx),)
+                for idx in groups]
+        ng = max([x.shape[1] for _, x, _, _, _, _ in data])
+        dim = data[0][1].shape[2]
+        m = max([dpx.shape[-1] for _, _, _, dpx, _, _ in data])
+        nvn = data[0][5].shape[1]//data[0][3].shape[-1]
+        # Elements with less Gauss points or nodes are padded with zero weights and zero derivatives
+        self.points = np.zeros([ne, ng, dim])
+        self.dpx = np.zeros([ne, ng, dim, m])
+        self.w = np.zeros([ne, ng])
+        gdlm = np.zeros([ne, nvn, m], dtype=np.int64)
+        valid = np.zeros([ne, nvn, m], dtype=bool)
+        for idx, x, _, dpx, dv, dofs in data:
+            g, mm = dpx.shape[1], dpx.shape[-1]
+            self.points[idx] = x[:, :1]
+            self.points[idx, :g] = x
+            self.dpx[idx, :g, :, :mm] = dpx
+            if factor is not None:
+                dv = np.asarray(factor, dtype=float)[idx][:, None]*dv
+            self.w[idx, :g] = dv
+            gdlm[idx, :, :mm] = dofs.reshape([len(idx), nvn, mm])
+            valid[idx, :, :mm] = True
+        self.gdlm = gdlm.reshape([ne, nvn*m])
+        self.valid = valid.reshape([ne, nvn*m])
+        self.strainMatrix = strainMatrix
+        self.C = np.asarray(C, dtype=float)
+        self.l = l
+        self.af = af
+        self.cutoff = cutoff
+        self.amin = minimumAttenuation(af, threshold)
+        self.chunk = chunk
+        self.pairsChunk = max(1, 2**21//(ng*ng))
+        self.neighbours = neighbours
+        self.symmetric = symmetricNeighbours(neighbours)
+        self.rows = np.repeat(np.arange(ne), [len(enl) for enl in neighbours])
+        self.cols = np.concatenate(
+            [np.asarray(enl, dtype=np.int64) for enl in neighbours]+[np.zeros(0, dtype=np.int64)])
+        if self.symmetric:
+            upper = self.cols >= self.rows
+            self.rows = self.rows[upper]
+            self.cols = self.cols[upper]
+        self.onTheFly = onTheFly
+        self.weights = None
+        if not onTheFly:
+            data, wrows, wcols = [], [], []
+            for k in range(0, len(self.rows), self.pairsChunk):
+                i = self.rows[k:k+self.pairsChunk]
+                j = self.cols[k:k+self.pairsChunk]
+                a = self.pairsAttenuation(i, j)
+                if self.symmetric:
+                    # The diagonal blocks are added again by the transposed product
+                    a[i == j] *= 0.5
+                p, g, q = np.nonzero(a)
+                data.append(a[p, g, q])
+                wrows.append(i[p]*ng+g)
+                wcols.append(j[p]*ng+q)
+            self.weights = sparse.csr_matrix((np.concatenate(data+[np.zeros(0)]), (np.concatenate(wrows+[np.zeros(0, dtype=np.int64)]), np.concatenate(wcols+[np.zeros(0, dtype=np.int64)]))),
+                                             shape=(ne*ng, ne*ng))
+        self._diagonal = None
+
+    def pairsAttenuation(self, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+        """Attenuation of the Gauss points pairs of several pairs of elements
+
+        Args:
+            i (np.ndarray): Element indices
+            j (np.ndarray): Nonlocal element indices
+
+        Returns:
+            np.ndarray: Attenuation with shape (len(i), ng, ng)
+        """
+        ro = np.linalg.norm(
+            self.points[i][:, :, None, :]-self.points[j][:, None, :, :], axis=-1)/self.l
+        a, _ = prunedAttenuation(self.af, ro, self.cutoff, self.amin)
+        return a
+
+    def strains(self, u: np.ndarray) -> np.ndarray:
+        """Strains of all the Gauss points multiplied by the integration weights
+
+        Args:
+            u (np.ndarray): Displacements vector
+
+        Returns:
+            np.ndarray: Weighted strains with shape (ne, ng, s)
+        """
+        eps = None
+        for k in range(0, len(self.w), self.chunk):
+            B = self.strainMatrix(self.dpx[k:k+self.chunk])
+            if eps is None:
+                eps = np.zeros([len(self.w), self.w.shape[1], B.shape[2]])
+            eps[k:k+self.chunk] = self.w[k:k+self.chunk, :, None] * \
+                np.einsum('egsn,en->egs', B, u[self.gdlm[k:k+self.chunk]])
+        return eps
+
+    def forces(self, sigma: np.ndarray) -> np.ndarray:
+        """Integrates the nonlocal strains of all the Gauss points
+
+        Args:
+            sigma (np.ndarray): Nonlocal strains with shape (ne, ng, s)
+
+        Returns:
+            np.ndarray: Forces vector
+        """
+        fe = np.zeros(self.gdlm.shape)
+        for k in range(0, len(self.w), self.chunk):
+            B = self.strainMatrix(self.dpx[k:k+self.chunk])
+            st = np.einsum('est,egt->egs',
+                           self.C[k:k+self.chunk], sigma[k:k+self.chunk])
+            fe[k:k+self.chunk] = np.einsum('egsn,egs->en', B,
+                                           self.w[k:k+self.chunk, :, None]*st)
+        return np.bincount(self.gdlm[self.valid], fe[self.valid], minlength=self.shape[0])
+
+    def _matvec(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=float).ravel()
+        eps = self.strains(x)
+        if not self.onTheFly:
+            e = eps.reshape([-1, eps.shape[2]])
+            sigma = self.weights@e
+            if self.symmetric:
+                sigma += self.weights.T@e
+            return self.forces(sigma.reshape(eps.shape))
+        sigma = np.zeros(eps.shape)
+        for k in range(0, len(self.rows), self.pairsChunk):
+            i = self.rows[k:k+self.pairsChunk]
+            j = self.cols[k:k+self.pairsChunk]
+            a = self.pairsAttenuation(i, j)
+            _accumulate(sigma, i, np.einsum('pgq,pqs->pgs', a, eps[j]))
+            if self.symmetric:
+                o = j > i
+                _accumulate(sigma, j[o], np.einsum(
+                    'pgq,pgs->pqs', a[o], eps[i[o]]))
+        return self.forces(sigma)
+
+    def _rmatvec(self, x: np.ndarray) -> np.ndarray:
+        return self._matvec(x)
+
+    def _adjoint(self) -> 'NonLocalOperator':
+        return self
+
+    def diagonal(self) -> np.ndarray:
+        """Diagonal of the nonlocal stiffness matrix. Only the pairs of elements with common degrees of freedom are integrated. The diagonal is calculated once.
+
+        Returns:
+            np.ndarray: Diagonal
+        """
+        if self._diagonal is not None:
+            return self._diagonal
+        ne = len(self.w)
+        E = sparse.csr_matrix((np.ones(self.valid.sum()), (np.repeat(np.arange(ne), self.valid.sum(axis=1)), self.gdlm[self.valid])),
+                              shape=(ne, self.shape[0]))
+        rows = np.repeat(np.arange(ne), [len(enl)
+                         for enl in self.neighbours])
+        cols = np.concatenate([np.asarray(enl, dtype=np.int64)
+                              for enl in self.neighbours]+[np.zeros(0, dtype=np.int64)])
+        N = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(ne, ne))
+        T = (E@E.T).multiply(N).tocoo()
+        d = np.zeros(self.shape[0])
+        for k in range(0, T.nnz, self.pairsChunk):
+            i = T.row[k:k+self.pairsChunk]
+            j = T.col[k:k+self.pairsChunk]
+            a = self.pairsAttenuation(i, j)
+            Bi = self.w[i][:, :, None, None]*self.strainMatrix(self.dpx[i])
+            Bj = self.w[j][:, :, None, None]*self.strainMatrix(self.dpx[j])
+            K = np.einsum('pgsa,pst,pgq,pqtb->pab', Bi,
+                          self.C[i], a, Bj, optimize=True)
+            same = (self.gdlm[i][:, :, None] == self.gdlm[j][:, None, :]) & \
+                self.valid[i][:, :, None] & self.valid[j][:, None, :]
+            np.add.at(d, np.broadcast_to(
+                self.gdlm[i][:, :, None], same.shape)[same], K[same])
+        self._diagonal = d
+        return d
+
+
+class StiffnessOperator(LinearOperator):
+    """Matrix free stiffness matrix of a nonlocal problem, K = z1*KL + z2*KNL, where KL is a sparse matrix and KNL a NonLocalOperator.
+    The essential border conditions are applied with the constrained method, with the same modes of the EssentialConditions class.
+    The local matrix with the same border conditions is stored in the local attribute, to be used by the preconditioners.
+
+    Args:
+        KL (sparse.csr_matrix): Local stiffness matrix
+        KNL (NonLocalOperator): Nonlocal stiffness operator
+        z1 (float): z1 factor
+        z2 (float): z2 factor
+        ebc (EssentialConditions, optional): Essential border conditions. Defaults to None.
+        mode (str, optional): Essential border conditions mode, 'symmetric', 'penalty' or 'elimination'. Defaults to None.
+        value (float, optional): Penalty value. Defaults to 0.0.
+    """
+
+    def __init__(self, KL: sparse.csr_matrix, KNL: NonLocalOperator, z1: float, z2: float, ebc: 'EssentialConditions' = None, mode: str = None, value: float = 0.0) -> None:
+        """Matrix free stiffness matrix of a nonlocal problem, K = z1*KL + z2*KNL.
+
+        Args:
+            KL (sparse.csr_matrix): Local stiffness matrix
+            KNL (NonLocalOperator): Nonlocal stiffness operator
+            z1 (float): z1 factor
+            z2 (float): z2 factor
+            ebc (EssentialConditions, optional): Essential border conditions. Defaults to None.
+            mode (str, optional): Essential border conditions mode, 'symmetric', 'penalty' or 'elimination'. Defaults to None.
+            value (float, optional): Penalty value. Defaults to 0.0.
+        """
+        n = KL.shape[0]
+        if mode == 'elimination':
+            n = len(ebc.free)
+        LinearOperator.__init__(self, dtype=float, shape=(n, n))
+        self.KL = KL
+        self.KNL = KNL
+        self.z1 = z1
+        self.z2 = z2
+        self.ebc = ebc
+        self.mode = mode
+        self.value = value
+        self.local = KL
+        if mode == 'elimination':
+            self.local = ebc.reduce(KL)
+        elif mode == 'symmetric':
+            self.local = ebc.symmetric(KL.copy())
+        elif mode == 'penalty':
+            self.local = ebc.penalty(KL.copy(), value)
+
+    def constrained(self, ebc: 'EssentialConditions', mode: str, value: float = 0.0) -> 'StiffnessOperator':
+        """Creates the operator with essential border conditions
+
+        Args:
+            ebc (EssentialConditions): Essential border conditions
+            mode (str): Essential border conditions mode, 'symmetric', 'penalty' or 'elimination'
+            value (float, optional): Penalty value. Defaults to 0.0.
+
+        Returns:
+            StiffnessOperator: Constrained operator
+        """
+        if self.mode is not None:
+            logging.error('The operator already has essential border conditions')
+            raise Exception(
+                'The operator already has essential border conditions')
+        return StiffnessOperator(self.KL, self.KNL, self.z1, self.z2, ebc, mode, value)
+
+    def _matvec(self, x: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=float).ravel()
+        u = x
+        if self.mode == 'elimination':
+            u = np.zeros(self.KL.shape[0])
+            u[self.ebc.free] = x
+        elif self.mode == 'symmetric':
+            u = x.copy()
+            u[self.ebc.gdl] = 0.0
+        y = self.z1*(self.KL@u) + self.z2*(self.KNL@u)
+        if self.mode == 'elimination':
+            return y[self.ebc.free]
+        if self.mode == 'symmetric':
+            y[self.ebc.gdl] = x[self.ebc.gdl]
+        elif self.mode == 'penalty':
+            y[self.ebc.gdl] += self.value*x[self.ebc.gdl]
+        return y
+
+    def _rmatvec(self, x: np.ndarray) -> np.ndarray:
+        return self._matvec(x)
+
+    def _adjoint(self) -> 'StiffnessOperator':
+        return self
+
+    def diagonal(self) -> np.ndarray:
+        """Diagonal of the operator
+
+        Returns:
+            np.ndarray: Diagonal
+        """
+        d = self.z1*self.KL.diagonal() + self.z2*self.KNL.diagonal()
+        if self.mode == 'elimination':
+            return d[self.ebc.free]
+        if self.mode == 'symmetric':
+            d[self.ebc.gdl] = 1.0
+        elif self.mode == 'penalty':
+            d[self.ebc.gdl] += self.value
+        return d
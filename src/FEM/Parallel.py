@@ -0,0 +1,80 @@
+"""Parallel execution of element computations using a process pool.
+
+The problem is given to the workers when the pool is created (fork start method), so the geometry arrays,
+the element blocks and the problem functions (usually lambdas, which can not be pickled) are shared with the
+workers memory instead of being serialized. Only the element indices of every chunk are sent to the workers
+and only the element (or triplet) blocks are sent back to be merged in the global matrices.
+"""
+
+
+import logging
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+
+_PROBLEM = None
+
+
+def _initializer(problem: 'Core') -> None:
+    global _PROBLEM
+    _PROBLEM = problem
+
+
+def _run(task: tuple):
+    method, args = task
+    return getattr(_PROBLEM, method)(*args)
+
+
+def parallelTasks(groups: list, workers: int, factor: int = 4, chunk: int = None) -> list:
+    """Divides the element groups in chunks, so every worker receives several chunks
+
+    Args:
+        groups (list): Element indices of every group
+        workers (int): Number of workers
+        factor (int, optional): Number of chunks per worker. Defaults to 4.
+        chunk (int, optional): Maximum number of elements per chunk. Used to bound the memory of the results. Defaults to None.
+
+    Returns:
+        list: Element indices of every chunk. Chunks do not mix elements of different groups.
+    """
+    total = sum([len(idx) for idx in groups])
+    size = total
+    if workers > 1:
+        size = int(np.ceil(total/(workers*factor)))
+    if chunk:
+        size = min(size, chunk)
+    size = max(1, size)
+    result = []
+    for idx in groups:
+        idx = np.asarray(idx)
+        result += [idx[i:i+size] for i in range(0, len(idx), size)]
+    return result
+
+
+def parallelMap(problem: 'Core', method: str, tasks: list, workers: int = 1):
+    """Calls a problem method for every task. If more than one worker is given, the tasks are executed in a process pool.
+    The results are given in the same order as the tasks.
+
+    Args:
+        problem (Core): Finite element problem
+        method (str): Name of the problem method
+        tasks (list): Arguments of every call. If a task is not a tuple, it is used as the only argument
+        workers (int, optional): Number of processes. Defaults to 1.
+
+    Yields:
+        Result of every call
+    """
+    tasks = [t if isinstance(t, tuple) else (t,) for t in tasks]
+    if workers > 1 and len(tasks) > 1 and not 'fork' in multiprocessing.get_all_start_methods():
+        logging.warning(
+            'Parallel execution needs the fork start method. Running in one process.')
+        workers = 1
+    if workers <= 1 or len(tasks) <= 1:
+        for args in tasks:
+            yield getattr(problem, method)(*args)
+        return
+    logging.info(f'Running {len(tasks)} chunks in {workers} processes')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'), initializer=_initializer, initargs=(problem,)) as pool:
+        for result in pool.map(_run, [(method, args) for args in tasks]):
+            yield result
@@ -45,9 +45,9 @@ class Poisson2D(Core):
         for e in tqdm(self.elements, unit='Element'):
             ee += 1
             # Gauss points in global coordinates and Shape functions evaluated in gauss points
-            _x, _p = e.T(e.Z.T)
+            _x, _p = e._x, e._p
             # Jacobian evaluated in gauss points and shape functions derivatives in natural coordinates
-            jac, dpz = e.J(e.Z.T)
+            jac, dpz = e.jacs, e.dpz
             detjac = np.linalg.det(jac)*e.W
             _j = np.linalg.inv(jac)  # Jacobian inverse
             dpx = _j @ dpz  # Shape function derivatives in global coordinates
@@ -0,0 +1,264 @@
+"""Define the structure of a lineal finite element solver using preconditioned iterative methods
+"""
+
+import numpy as np
+import logging
+from scipy import sparse
+from scipy.sparse.linalg import cg, minres, gmres, spilu, LinearOperator
+from .Lineal import LinealSparse
+
+
+METHODS = {'cg': cg, 'minres': minres, 'gmres': gmres}
+PRECONDITIONERS = ['none', 'jacobi', 'block-jacobi', 'ilu']
+
+
+class IterativeSparse(LinealSparse):
+    """Lineal Finite Element Solver using sparse matrix and preconditioned iterative methods.
+    The options can be changed in the solver attributes or given to the run (solve) method.
+    Matrix free stiffness operators are also supported. Their jacobi preconditioner uses the exact diagonal
+    and their block-jacobi and ilu preconditioners are built from the local stiffness matrix.
+
+    Args:
+        FEMObject (Core): Finite Element Problem
+        method (str, optional): Iterative method, 'cg', 'minres' or 'gmres'. Defaults to 'cg'.
+        preconditioner (str, optional): Preconditioner, 'none', 'jacobi', 'block-jacobi' (nodal blocks) or 'ilu'. Defaults to 'jacobi'.
+        rtol (float, optional): Relative tolerance of the residual norm. Defaults to 1e-10.
+        atol (float, optional): Absolute tolerance of the residual norm. Not used by minres. Defaults to 0.0.
+        maxiter (int, optional): Maximum number of iterations (restart cycles for gmres). If not given, the scipy default is used. Defaults to None.
+        warm (bool, optional): To use the current solution of the problem as initial guess. Defaults to True.
+        restart (int, optional): Number of iterations between restarts of gmres. If not given, the scipy default is used. Defaults to None.
+        history (bool, optional): To record the true relative residual of every cg and minres iteration. It costs one additional matrix product per iteration. gmres always records its preconditioned residual. Defaults to False.
+    """
+
+    def __init__(self, FEMObject: 'Core', method: str = 'cg', preconditioner: str = 'jacobi', rtol: float = 1e-10, atol: float = 0.0, maxiter: int = None, warm: bool = True, restart: int = None, history: bool = False):
+        """Lineal Finite Element Solver using sparse matrix and preconditioned iterative methods.
+        The options can be changed in the solver attributes or given to the run (solve) method.
+
+        Args:
+            FEMObject (Core): Finite Element Problem
+            method (str, optional): Iterative method, 'cg', 'minres' or 'gmres'. Defaults to 'cg'.
+            preconditioner (str, optional): Preconditioner, 'none', 'jacobi', 'block-jacobi' (nodal blocks) or 'ilu'. Defaults to 'jacobi'.
+            rtol (float, optional): Relative tolerance of the residual norm. Defaults to 1e-10.
+            atol (float, optional): Absolute tolerance of the residual norm. Not used by minres. Defaults to 0.0.
+            maxiter (int, optional): Maximum number of iterations (restart cycles for gmres). If not given, the scipy default is used. Defaults to None.
+            warm (bool, optional): To use the current solution of the problem as initial guess. Defaults to True.
+            restart (int, optional): Number of iterations between restarts of gmres. If not given, the scipy default is used. Defaults to None.
+            history (bool, optional): To record the true relative residual of every cg and minres iteration. It costs one additional matrix product per iteration. gmres always records its preconditioned residual. Defaults to False.
+        """
+        LinealSparse.__init__(self, FEMObject)
+        self.type = 'lineal-sparse-iterative'
+        self.method = method
+        self.preconditioner = preconditioner
+        self.rtol = rtol
+        self.atol = atol
+        self.maxiter = maxiter
+        self.warm = warm
+        self.restart = restart
+        self.history = history
+        self.fill_factor = 10
+        self.drop_tol = 1e-4
+        self.iterations = 0
+        self.residuals = []
+
+    def run(self, path: str = '', **kargs):
+        """Solves the equation system using a preconditioned iterative method
+
+        Args:
+            path (str, optional): Path where the solution is stored. Defaults to ''.
+            **kargs: Any of the solver options (method, preconditioner, rtol, atol, maxiter, warm, restart, history, fill_factor, drop_tol).
+        """
+        for key in ['method', 'preconditioner', 'rtol', 'atol', 'maxiter', 'warm', 'restart', 'history', 'fill_factor', 'drop_tol']:
+            if key in kargs:
+                setattr(self, key, kargs[key])
+        if self.method not in METHODS:
+            logging.error(f'Unknown iterative method {self.method}')
+            raise Exception(f'Unknown iterative method {self.method}')
+        if self.preconditioner not in PRECONDITIONERS:
+            logging.error(f'Unknown preconditioner {self.preconditioner}')
+            raise Exception(f'Unknown preconditioner {self.preconditioner}')
+        LinealSparse.run(self, path=path, **kargs)
+        self.solutions_info[-1].update({'method': self.method,
+                                        'preconditioner': self.preconditioner,
+                                        'iterations': self.iterations,
+                                        'residuals': self.residuals})
+
+    def systemDofs(self, n: int) -> np.ndarray:
+        """Gives the global degree of freedom of every unknown of a system
+
+        Args:
+            n (int): Size of the system. It can be the number of degrees of freedom or the number of free degrees of freedom.
+
+        Returns:
+            np.ndarray: Global degree of freedom of every unknown
+        """
+        ebc = self.system.ebc
+        if self.system.ebcMode == 'elimination' and ebc is not None and n == len(ebc.free):
+            return ebc.free
+        return np.arange(n)
+
+    def localMatrix(self, A) -> sparse.spmatrix:
+        """Gives the sparse matrix used to build the block-jacobi and ilu preconditioners.
+        Matrix free operators give their local matrix, with the same border conditions.
+
+        Args:
+            A (Union[sparse.spmatrix, StiffnessOperator]): System matrix
+
+        Returns:
+            sparse.spmatrix: Sparse matrix
+        """
+        if isinstance(A, LinearOperator):
+            return A.local
+        return A
+
+    def jacobi(self, A) -> LinearOperator:
+        """Creates the diagonal (Jacobi) preconditioner
+
+        Args:
+            A (sparse.spmatrix): System matrix
+
+        Returns:
+            LinearOperator: Inverse of the matrix diagonal
+        """
+        d = A.diagonal()
+        d[d == 0.0] = 1.0
+        inv = 1.0/d
+        return LinearOperator(A.shape, matvec=lambda r: inv*r.flatten(), dtype=float)
+
+    def blockJacobi(self, A) -> LinearOperator:
+        """Creates the nodal block Jacobi preconditioner. The blocks are the nvn x nvn submatrices
+        of the variables of every node. Missing (prescribed) variables are replaced by the identity.
+
+        Args:
+            A (sparse.spmatrix): System matrix
+
+        Returns:
+            LinearOperator: Inverse of the block diagonal
+        """
+        nvn = self.system.geometry.nvn
+        dofs = self.systemDofs(A.shape[0])
+        node = dofs // nvn
+        local = dofs % nvn
+        groups, group = np.unique(node, return_inverse=True)
+        A = self.localMatrix(A).tocoo()
+        same = group[A.row] == group[A.col]
+        blocks = np.zeros([len(groups), nvn, nvn])
+        blocks[:, np.arange(nvn), np.arange(nvn)] = 1.0
+        present = np.zeros([len(groups), nvn], dtype=bool)
+        present[group, local] = True
+        blocks[group, local, local] = 0.0
+        np.add.at(blocks, (group[A.row[same]], local[A.row[same]],
+                  local[A.col[same]]), A.data[same])
+        zero = present & (blocks[:, np.arange(nvn), np.arange(nvn)] == 0.0)
+        g, j = np.where(zero)
+        blocks[g, j, j] = 1.0
+        inv = np.linalg.inv(blocks)
+
+        def matvec(r):
+            x = np.zeros([len(groups), nvn])
+            x[group, local] = r.flatten()
+            y = np.einsum('gij,gj->gi', inv, x)
+            return y[group, local]
+        return LinearOperator(A.shape, matvec=matvec, dtype=float)
+
+    def ilu(self, A) -> LinearOperator:
+        """Creates the incomplete LU preconditioner using scipy's spilu function
+
+        Args:
+            A (sparse.spmatrix): System matrix
+
+        Returns:
+            LinearOperator: Approximated inverse of the matrix
+        """
+        factor = spilu(self.localMatrix(A).tocsc(), drop_tol=self.drop_tol,
+                       fill_factor=self.fill_factor)
+        return LinearOperator(A.shape, matvec=lambda r: factor.solve(r.flatten()), dtype=float)
+
+    def buildPreconditioner(self, A) -> LinearOperator:
+        """Creates the selected preconditioner
+
+        Args:
+            A (sparse.spmatrix): System matrix
+
+        Returns:
+            LinearOperator: Preconditioner. None if the system is not preconditioned
+        """
+        if self.preconditioner == 'jacobi':
+            return self.jacobi(A)
+        if self.preconditioner == 'block-jacobi':
+            return self.blockJacobi(A)
+        if self.preconditioner == 'ilu':
+            return self.ilu(A)
+        return None
+
+    def initialGuess(self, n: int) -> np.ndarray:
+        """Gives the initial guess of the iterative method from the current solution of the problem
+
+        Args:
+            n (int): Size of the system
+
+        Returns:
+            np.ndarray: Initial guess. None if warm start is not used or the solution does not match the system
+        """
+        if not self.warm:
+            return None
+        U = np.asarray(self.system.U, dtype=float).flatten()
+        if not np.any(U):
+            return None
+        if len(U) == n:
+            return U
+        dofs = self.systemDofs(n)
+        if len(dofs) == n and len(U) == self.system.ngdl:
+            return U[dofs]
+        return None
+
+    def solveSystem(self, A, b: np.ndarray) -> np.ndarray:
+        """Solves a linear equation system using the selected iterative method and preconditioner.
+        The number of iterations and the residual history are stored in the iterations and residuals attributes.
+        The residual history of cg and minres is only recorded if the history option is used.
+
+        Args:
+            A (sparse.spmatrix): System matrix
+            b (np.ndarray): Right hand side vector
+
+        Returns:
+            np.ndarray: Solution with the same shape of b
+        """
+        if not isinstance(A, LinearOperator):
+            A = sparse.csr_matrix(A)
+        shape = np.shape(b)
+        b = np.asarray(b, dtype=float).flatten()
+        x0 = self.initialGuess(len(b))
+        logging.info(
+            f'Solving with {self.method} and {self.preconditioner} preconditioner')
+        M = self.buildPreconditioner(A)
+        normb = np.linalg.norm(b) or 1.0
+        residuals = []
+        iterations = [0]
+        kargs = {'x0': x0, 'rtol': self.rtol,
+                 'maxiter': self.maxiter, 'M': M}
+        if self.method == 'gmres':
+            kargs['atol'] = self.atol
+            kargs['restart'] = self.restart
+            kargs['callback_type'] = 'pr_norm'
+            kargs['callback'] = lambda r: residuals.append(float(r))
+        else:
+            if self.method == 'cg':
+                kargs['atol'] = self.atol
+
+            def callback(x):
+                iterations[0] += 1
+                if self.history:
+                    residuals.append(float(np.linalg.norm(b-A@x)/normb))
+            kargs['callback'] = callback
+        x, info = METHODS[self.method](A, b, **kargs)
+        if info < 0:
+            logging.error(f'Iterative solver failed with code {info}')
+            raise Exception(f'Iterative solver failed with code {info}')
+        self.iterations = max(iterations[0], len(residuals))
+        self.residuals = residuals
+        if info > 0:
+            logging.warning(
+                f'Iterative solver did not converge in {self.iterations} iterations. Relative residual: {np.linalg.norm(b-A@x)/normb}')
+        else:
+            logging.info(f'Converged in {self.iterations} iterations')
+        return x.reshape(shape)
@@ -2,11 +2,15 @@
 """
 
 from scipy.linalg import eigh
-from scipy.sparse.linalg import eigsh
+from scipy.sparse.linalg import eigsh, lobpcg, spilu, cg, LinearOperator, aslinearoperator
 import numpy as np
 import logging
+import time
+from typing import Callable
+from scipy import sparse
 from scipy.sparse.linalg import spsolve
-from .Solver import Solver
+from .Solver import Solver, CachedFactorization
+from ..Assembly import EssentialConditions
 
 
 class Lineal(Solver):
@@ -36,13 +40,13 @@ class Lineal(Solver):
         self.system.ensembling()
         self.system.borderConditions()
         logging.info('Solving equation system...')
-        self.solutions = [np.linalg.solve(self.system.K, self.system.S)]
+        self.solutions = [self.solveConstrained(
+            self.system.K, self.system.S)]
         self.solutions_info = [{'solver-type': self.type}]
         self.setSolution()
         if not path == '':
             np.savetxt(path, self.system.U, delimiter=',')
-        for e in self.system.elements:
-            e.setUe(self.system.U)
+        self.system.setElementsSolution(self.system.U)
         logging.info('Done!')
 
 
@@ -70,60 +74,224 @@ class LinealSparse(Lineal):
         logging.info('Done!')
         self.system.ensembling()
         self.system.borderConditions()
-        logging.info('Converting to csr format')
-        self.system.K = self.system.K.tocsr()
+        if sparse.issparse(self.system.K):
+            logging.info('Converting to csr format')
+            self.system.K = self.system.K.tocsr()
         logging.info('Solving...')
-        self.solutions = [spsolve(self.system.K, self.system.S)]
+        self.solutions = [self.solveConstrained(
+            self.system.K, self.system.S)[:, 0]]
         self.solutions_info = [{'solver-type': self.type}]
         self.setSolution()
         if path:
             np.savetxt(path, self.system.U, delimiter=',')
-        for e in self.system.elements:
-            e.setUe(self.system.U)
+        self.system.setElementsSolution(self.system.U)
         logging.info('Solved!')
 
 
 class LinealEigen(Lineal):
     """Eigen value solver
 
+    The following methods are available:
+
+    - shift-invert: scipy's eigsh in shift-invert mode around sigma. The factorization of K-sigma*M is cached and reused while the matrices do not change. If K is a matrix free operator, the systems are solved with the conjugate gradient method preconditioned with the factorization of its local matrix.
+    - lobpcg: scipy's lobpcg with a preconditioner ('ilu', 'jacobi' or 'none'). No factorization is calculated, so it can be used in very large models.
+    - eigsh: scipy's eigsh searching the smallest magnitude eigenvalues.
+
     Args:
         FEMObject (Core): FEM problem
+        method (str, optional): Eigen value method, 'shift-invert', 'lobpcg' or 'eigsh'. Defaults to 'shift-invert'.
+        sigma (float, optional): Shift of the shift-invert method. If not given, a small negative shift is estimated from the matrices diagonals of every solved problem, so K-sigma*M is positive definite. Defaults to None.
+        preconditioner (str, optional): Preconditioner of the lobpcg method, 'ilu', 'jacobi' or 'none'. Defaults to 'ilu'.
+        tol (float, optional): Tolerance of the eigen value solver. If not given, the scipy default is used. Defaults to None.
+        maxiter (int, optional): Maximum number of iterations of the eigen value solver. If not given, the scipy default is used. Defaults to None.
     """
 
-    def __init__(self, FEMObject: 'Core'):
+    def __init__(self, FEMObject: 'Core', method: str = 'shift-invert', sigma: float = None, preconditioner: str = 'ilu', tol: float = None, maxiter: int = None):
         """Eigen value solver
 
+        The following methods are available:
+
+        - shift-invert: scipy's eigsh in shift-invert mode around sigma. The factorization of K-sigma*M is cached and reused while the matrices do not change. If K is a matrix free operator, the systems are solved with the conjugate gradient method preconditioned with the factorization of its local matrix.
+        - lobpcg: scipy's lobpcg with a preconditioner ('ilu', 'jacobi' or 'none'). No factorization is calculated, so it can be used in very large models.
+        - eigsh: scipy's eigsh searching the smallest magnitude eigenvalues.
+
         Args:
             FEMObject (Core): FEM problem
+            method (str, optional): Eigen value method, 'shift-invert', 'lobpcg' or 'eigsh'. Defaults to 'shift-invert'.
+            sigma (float, optional): Shift of the shift-invert method. If not given, a small negative shift is estimated from the matrices diagonals of every solved problem, so K-sigma*M is positive definite. Defaults to None.
+            preconditioner (str, optional): Preconditioner of the lobpcg method, 'ilu', 'jacobi' or 'none'. Defaults to 'ilu'.
+            tol (float, optional): Tolerance of the eigen value solver. If not given, the scipy default is used. Defaults to None.
+            maxiter (int, optional): Maximum number of iterations of the eigen value solver. If not given, the scipy default is used. Defaults to None.
         """
         Lineal.__init__(self, FEMObject)
         self.type = 'lineal-sparse-eigen'
+        self.method = method
+        self.sigma = sigma
+        self.preconditioner = preconditioner
+        self.tol = tol
+        self.maxiter = maxiter
+        self.factorization = CachedFactorization()
+        self.shift = None
+        self.inner_rtol = 1e-10
+        self.iterations = None
+        self.residuals = []
 
-    def run(self, path: str = '', k=20, **kargs):
-        """Solves the smallest k eigenvalues using scipy's eigen value solver
+    def estimateShift(self, K, M) -> float:
+        """Estimates a negative shift for the shift-invert method. The shift is a small fraction of the median ratio between the stiffness and mass matrices diagonals.
 
         Args:
-            path (str, optional): Path where the solution is stored. Defaults to ''.
-            k (int, optional): Number of eigenvalues to calculate. Defaults to 20.
+            K (sparse.spmatrix): Stiffness matrix
+            M (sparse.spmatrix): Mass matrix
+
+        Returns:
+            float: Shift
         """
-        logging.info('Creating element matrices...')
-        self.system.elementMatrices()
-        logging.info('Done!')
-        self.system.ensembling()
-        self.system.condensedSystem()
-        logging.info('Converting to csr format')
-        K = self.system.K.tocsr()
-        logging.info('Solving...')
-        # eigv, eigvec = largest_eigsh(
-        #     self.system.K, k, self.system.M, which='SM')
-        # N = self.system.K.shape[0]
-        # eigv, eigvec = eigh(
-        #     self.system.K.todense(), self.system.M.todense(), eigvals=(N-k, N-1))
-        eigv, eigvec = eigsh(
-            K, k, self.system.M, which='SM')
+        k = K.diagonal()
+        m = M.diagonal()
+        ratio = np.abs(k[m > 0]/m[m > 0])
+        if not len(ratio):
+            return -1e-6
+        return -1e-6*np.median(ratio)
+
+    def shiftInvert(self, K, M, k: int, X0: np.ndarray = None) -> tuple:
+        """Solves the k eigen values closest to sigma with the shift-invert method
+
+        Args:
+            K (sparse.spmatrix): Stiffness matrix
+            M (sparse.spmatrix): Mass matrix
+            k (int): Number of eigen values
+            X0 (np.ndarray, optional): Eigen vectors of a similar problem. Their sum is used as starting vector. Defaults to None.
+
+        Returns:
+            tuple: Eigen values and eigen vectors
+        """
+        # The estimated shift depends on the matrices, so it is not stored in the sigma option
+        sigma = self.sigma
+        if sigma is None:
+            sigma = self.estimateShift(K, M)
+        self.shift = sigma
+        logging.info(f'Shift-invert mode with sigma = {sigma}')
+        if isinstance(K, LinearOperator):
+            A = (K.local - sigma*M).tocsc()
+        else:
+            A = (K - sigma*M).tocsc()
+        if not self.factorization.same(A):
+            self.factorization.factorize(A)
+        self.iterations = 0
+
+        def matvec(b):
+            self.iterations += 1
+            return self.factorization.apply(b)
+        OPinv = LinearOperator(A.shape, matvec=matvec, dtype=float)
+        if isinstance(K, LinearOperator):
+            # The factorization of the local matrix preconditions the matrix free shifted system
+            P = OPinv
+            shifted = K - sigma*aslinearoperator(M)
+
+            def inverse(b):
+                x, info = cg(shifted, np.asarray(b, dtype=float).ravel(),
+                             rtol=self.inner_rtol, M=P)
+                if info > 0:
+                    logging.warning(
+                        f'The shifted system did not converge in {info} iterations')
+                return x
+            OPinv = LinearOperator(A.shape, matvec=inverse, dtype=float)
+        kargs = {'sigma': sigma, 'OPinv': OPinv, 'which': 'LM'}
+        if self.tol is not None:
+            kargs['tol'] = self.tol
+        if self.maxiter is not None:
+            kargs['maxiter'] = self.maxiter
+        if X0 is not None:
+            kargs['v0'] = X0.sum(axis=1)
+        return eigsh(K, k, M, **kargs)
+
+    def lobpcg(self, K, M, k: int, X0: np.ndarray = None) -> tuple:
+        """Solves the k smallest eigen values with the preconditioned LOBPCG method
+
+        Args:
+            K (sparse.spmatrix): Stiffness matrix
+            M (sparse.spmatrix): Mass matrix
+            k (int): Number of eigen values
+            X0 (np.ndarray, optional): Eigen vectors of a similar problem used as initial block. Defaults to None.
+
+        Returns:
+            tuple: Eigen values and eigen vectors
+        """
+        P = None
+        if self.preconditioner == 'jacobi':
+            d = K.diagonal()
+            d[d == 0.0] = 1.0
+            P = LinearOperator(K.shape, matvec=lambda r: r /
+                               d.reshape(r.shape[:1]+(1,)*(r.ndim-1)), dtype=float)
+        elif self.preconditioner == 'ilu':
+            if isinstance(K, LinearOperator):
+                factor = spilu(K.local.tocsc())
+            else:
+                factor = spilu(K.tocsc())
+            P = LinearOperator(K.shape, matvec=factor.solve, dtype=float)
+        if X0 is not None:
+            X = X0.copy()
+        else:
+            X = np.random.default_rng(0).random([K.shape[0], k])
+        kargs = {'B': M, 'M': P, 'largest': False,
+                 'retResidualNormsHistory': True}
+        if self.tol is not None:
+            kargs['tol'] = self.tol
+        kargs['maxiter'] = self.maxiter or 200
+        eigv, eigvec, history = lobpcg(K, X, **kargs)
+        self.iterations = len(history)
+        return eigv, eigvec
+
+    def solveEigen(self, K, M, k: int, X0: np.ndarray = None) -> tuple:
+        """Solves the k smallest eigen values of the (reduced) system matrices with the selected method.
+        The relative residuals of every eigen pair are stored in the residuals attribute.
+
+        Args:
+            K (sparse.spmatrix): Stiffness matrix
+            M (sparse.spmatrix): Mass matrix
+            k (int): Number of eigen values
+            X0 (np.ndarray, optional): Eigen vectors of a similar problem used as starting point. Ignored by the eigsh method. Defaults to None.
+
+        Returns:
+            tuple: Sorted eigen values and eigen vectors of the given matrices
+        """
+        if X0 is not None and X0.shape != (K.shape[0], k):
+            X0 = None
+        logging.info(f'Solving with {self.method}...')
+        if self.method == 'shift-invert':
+            eigv, eigvec = self.shiftInvert(K, M, k, X0)
+        elif self.method == 'lobpcg':
+            eigv, eigvec = self.lobpcg(K, M, k, X0)
+        elif self.method == 'eigsh':
+            self.iterations = None
+            kargs = {'which': 'SM'}
+            if self.tol is not None:
+                kargs['tol'] = self.tol
+            if self.maxiter is not None:
+                kargs['maxiter'] = self.maxiter
+            eigv, eigvec = eigsh(K, k, M, **kargs)
+        else:
+            logging.error(f'Unknown eigen value method {self.method}')
+            raise Exception(f'Unknown eigen value method {self.method}')
         idx = eigv.argsort()
         eigv = eigv[idx]
         eigvec = eigvec[:, idx]
+        # Matrix free operators are scaled with the norm of their local matrix
+        norm = abs(K.local if isinstance(K, LinearOperator) else K).sum(axis=1).max()
+        scale = norm*np.linalg.norm(eigvec, axis=0)
+        self.residuals = (np.linalg.norm(K@eigvec - (M@eigvec)*eigv, axis=0) /
+                          np.maximum(scale, np.finfo(float).tiny)).tolist()
+        logging.info(f'Maximum relative residual: {max(self.residuals)}')
+        return eigv, eigvec
+
+    def setEigen(self, eigv: np.ndarray, eigvec: np.ndarray, path: str = '') -> None:
+        """Assigns the eigen values and eigen vectors to the system and to the solver solutions
+
+        Args:
+            eigv (np.ndarray): Eigen values
+            eigvec (np.ndarray): Eigen vectors of all the degrees of freedom
+            path (str, optional): Path where the solution is stored. Defaults to ''.
+        """
         self.system.eigv = eigv
         self.system.eigvec = eigvec
         if path:
@@ -136,8 +304,123 @@ class LinealEigen(Lineal):
             eeevalues.append(eigenvalue)
 
         self.solutions = np.array(eeevalues)
+        sigma = self.shift if self.method == 'shift-invert' else None
         self.solutions_info = [
-            {'solver-type': self.type, 'eigv': ei} for ei in self.system.eigv]
+            {'solver-type': self.type, 'eigv': ei, 'method': self.method, 'sigma': sigma, 'iterations': self.iterations, 'residual': r} for ei, r in zip(self.system.eigv, self.residuals)]
 
         self.setSolution(0)
+
+    def run(self, path: str = '', k=20, **kargs):
+        """Solves the smallest k eigenvalues using scipy's eigen value solvers
+
+        Args:
+            path (str, optional): Path where the solution is stored. Defaults to ''.
+            k (int, optional): Number of eigenvalues to calculate. Defaults to 20.
+            **kargs: Any of the solver options (method, sigma, preconditioner, tol, maxiter).
+        """
+        for key in ['method', 'sigma', 'preconditioner', 'tol', 'maxiter']:
+            if key in kargs:
+                setattr(self, key, kargs[key])
+        if len(self.solutions):
+            logging.info('Restarting matrices of the previous solution')
+            self.system.restartMatrix()
+            if self.system.sparse:
+                self.system.M = self.system.restartSparse(self.system.M)
+            else:
+                self.system.M[:, :] = 0.0
+            if getattr(self.system, 'Ml', None) is not None:
+                self.system.Ml[:] = 0.0
+        logging.info('Creating element matrices...')
+        self.system.elementMatrices()
+        logging.info('Done!')
+        self.system.ensembling()
+        self.system.condensedSystem()
+        logging.info('Converting to csr format')
+        K = self.system.K
+        if sparse.issparse(K):
+            K = K.tocsr()
+        M = self.system.M.tocsr()
+        ebc = self.system.ebc
+        elimination = self.system.ebcMode == 'elimination' and ebc is not None
+        if elimination:
+            logging.info(
+                f'Removing {len(ebc.gdl)} prescribed degrees of freedom')
+            K = ebc.reduce(K)
+            M = ebc.reduce(M)
+        eigv, eigvec = self.solveEigen(K, M, k)
+        if elimination:
+            eigvec = ebc.expand(eigvec, homogeneous=True)
+        self.setEigen(eigv, eigvec, path)
+        logging.info('Solved!')
+
+    def sweep(self, Z: list, k: int = 20, path: str = '', callback: Callable = None, **kargs) -> list:
+        """Solves the smallest k eigenvalues of a nonlocal problem for several z1 factors.
+        The local and nonlocal matrices (KL, KNL) and the mass matrix are calculated and converted
+        to csr format only once, the essential border conditions are created only once
+        and every eigen value problem starts from the eigen vectors of the previous z1 factor.
+        As in the borderConditions method, the symmetric and penalty modes only modify the stiffness matrix.
+
+        Args:
+            Z (list): z1 factors. z2 is calculated as 1-z1.
+            k (int, optional): Number of eigenvalues to calculate. Defaults to 20.
+            path (str, optional): Filename of the results of every z1 factor. It is formatted with the z1 factor, for example 'results_{z1}.json'. If given, the problem is exported to JSON after every z1 factor. Defaults to ''.
+            callback (Callable, optional): Function called with the result record of every z1 factor as soon as it is solved. Defaults to None.
+            **kargs: Any of the solver options (method, sigma, preconditioner, tol, maxiter).
+
+        Returns:
+            list: Result record of every z1 factor
+        """
+        system = self.system
+        if not hasattr(system, 'KL') or not hasattr(system, 'KNL'):
+            logging.error('The parameter sweep needs a nonlocal problem')
+            raise Exception('The parameter sweep needs a nonlocal problem')
+        for key in ['method', 'sigma', 'preconditioner', 'tol', 'maxiter']:
+            if key in kargs:
+                setattr(self, key, kargs[key])
+        if not sparse.issparse(system.KL) and system.KL.n == 0:
+            logging.info('Creating element matrices...')
+            system.elementMatrices()
+            logging.info('Done!')
+        ebc = None
+        if system.cbe:
+            ebc = EssentialConditions(system.cbe, system.ngdl)
+        system.ebc = ebc
+        M = None
+        X0 = None
+        records = []
+        for z in Z:
+            logging.info(f'Solving for z1={z}')
+            start = time.time()
+            system.z1 = z
+            system.z2 = 1.0-z
+            system.properties['z1'] = system.z1
+            system.properties['z2'] = system.z2
+            system.ensembling()
+            K = system.K
+            if M is None:
+                M = system.M.tocsr()
+                if ebc is not None and system.ebcMode == 'elimination':
+                    M = ebc.reduce(M)
+            if ebc is not None:
+                if system.ebcMode == 'elimination':
+                    K = ebc.reduce(K)
+                elif system.ebcMode == 'symmetric':
+                    K = ebc.symmetric(K)
+                else:
+                    K = ebc.penalty(K, ebc.penaltyValue(K))
+            eigv, eigvec = self.solveEigen(K, M, k, X0)
+            X0 = eigvec
+            if ebc is not None and system.ebcMode == 'elimination':
+                eigvec = ebc.expand(eigvec, homogeneous=True)
+            self.setEigen(eigv, eigvec)
+            record = {'z1': z, 'eigv': eigv, 'method': self.method,
+                      'iterations': self.iterations, 'residuals': self.residuals,
+                      'time': time.time()-start}
+            if path:
+                record['path'] = path.format(z1=z)
+                system.exportJSON(record['path'])
+            records.append(record)
+            if callback is not None:
+                callback(record)
         logging.info('Solved!')
+        return records
@@ -3,8 +3,9 @@
 import numpy as np
 import copy
 import logging
+import time
 from tqdm import tqdm
-from .Solver import Solver
+from .Solver import Solver, CachedFactorization
 
 
 class NonLinealSolver(Solver):
@@ -39,66 +40,163 @@ class Newton(NonLinealSolver):
             FEMObject (Core): Finite Element Model. The model have to calculate tangent matrix T in the self.elementMatrices() method.
         """
 
-    def __init__(self, FEMObject: 'Core', tol: float = 10**(-10), n: int = 50) -> None:
+    def __init__(self, FEMObject: 'Core', tol: float = 10**(-10), n: int = 50, rtol: float = None, refactor: int = 1, stall: float = 0.5, linesearch: bool = False, maxls: int = 10) -> None:
         """Creates a Newton Raphson iterative solver
 
         Args:
             FEMObject (Core): Finite Element Model. The model have to calculate tangent matrix T in the self.elementMatrices() method.
             tol (float, optional): Tolerance for the maximum absolute value for the delta vector. Defaults to 10**(-10).
             n (int, optional): Maximum number of iterations per step. Defaults to 50.
+            rtol (float, optional): Tolerance for the norm of the residual vector. If given, the iterations also stop when the residual norm is lower than this value. Defaults to None.
+            refactor (int, optional): Number of iterations between tangent matrix factorizations. Values greater than 1 give the modified Newton method. Defaults to 1.
+            stall (float, optional): If the ratio between two consecutive residual norms is greater than this value, the tangent matrix is factorized again in the next iteration. Only used by the modified Newton method. Defaults to 0.5.
+            linesearch (bool, optional): To use a backtracking line search over the residual norm. Defaults to False.
+            maxls (int, optional): Maximum number of step halvings of the line search. Defaults to 10.
         """
         NonLinealSolver.__init__(self, FEMObject, tol, n)
         self.type = 'non-lineal-newton'
+        self.rtol = rtol
+        self.refactor = refactor
+        self.stall = stall
+        self.linesearch = linesearch
+        self.maxls = maxls
+        self.factorization = CachedFactorization()
+        self._factorize = True
+
+    def solveSystem(self, A, b: np.ndarray) -> np.ndarray:
+        """Solves a linear equation system using the last factorization of the tangent matrix.
+        The tangent matrix is factorized only in the iterations selected by the modified Newton method.
+
+        Args:
+            A (Union[np.ndarray, sparse.spmatrix]): Tangent matrix
+            b (np.ndarray): Right hand side vector
+
+        Returns:
+            np.ndarray: Solution with the same shape of b
+        """
+        if self._factorize or self.factorization.factor is None:
+            self.factorization.factorize(A)
+        return self.factorization.apply(b)
+
+    def residualNorm(self, R: np.ndarray) -> float:
+        """Calculates the norm of the residual vector. In elimination mode, the reactions of the prescribed degrees of freedom are not included.
+
+        Args:
+            R (np.ndarray): Residual vector
+
+        Returns:
+            float: Euclidean norm of the residual
+        """
+        ebc = self.system.ebc
+        if self.system.ebcMode == 'elimination' and ebc is not None:
+            R = ebc.reduceVector(R)
+        return np.linalg.norm(R)
+
+    def residual(self) -> np.ndarray:
+        """Calculates the matrices and the residual vector with the current solution
+
+        Returns:
+            np.ndarray: Residual vector
+        """
+        self.system.restartMatrix()
+        logging.debug('Matrix at 0')
+        self.system.elementMatrices()
+        logging.debug('Calculating element matrix')
+        self.system.ensembling()
+        logging.debug('Matrices enssembling')
+        self.system.borderConditions()
+        logging.debug('Border conditions')
+        R = self.system.K@self.system.U - self.system.S
+        logging.debug('Residual')
+        return R
+
+    def updateElements(self) -> None:
+        """Assings the current solution to the elements
+        """
+        for e in self.system.elements:
+            e.restartMatrix()
+            e.setUe(self.system.U)
+        logging.debug('Updated elements')
 
     def solve(self, path: str = '', **kargs) -> None:
         """Solves the equation system using newtons method
-        """
 
+        Args:
+            path (str, optional): Path where the solution is stored. Defaults to ''.
+            **kargs: Any of the solver options (tol, rtol, refactor, stall, linesearch, maxls).
+        """
+        for key in ['tol', 'rtol', 'refactor', 'stall', 'linesearch', 'maxls']:
+            if key in kargs:
+                setattr(self, key, kargs[key])
         logging.info('Starting newton iterations.')
-        logging.info(f'tol: {self.tol}, maxiter: {self.maxiter}')
+        logging.info(
+            f'tol: {self.tol}, rtol: {self.rtol}, maxiter: {self.maxiter}, refactor: {self.refactor}, linesearch: {self.linesearch}')
         self.system.U = np.zeros(self.system.U.shape)+1.0
         # self.setSolution(0)
         for i in self.system.cbe:
             self.system.U[int(i[0])] = i[1]
 
-        for e in self.system.elements:
-            e.restartMatrix()
-            e.setUe(self.system.U)
+        self.updateElements()
         warn = 'Max number of iterations. Not convergence achived!'
+        self.factorization = CachedFactorization()
+        residuals = []
+        times = []
+        R = None
+        last = 0
         for i in tqdm(range(self.maxiter), unit="Newton iteration", disable=False):
             logging.debug(
                 f'----------------- Newton iteration {i} -------------------')
-            self.system.restartMatrix()
-            logging.debug('Matrix at 0')
-            self.system.elementMatrices()
-            logging.debug('Calculating element matrix')
-            self.system.ensembling()
-            logging.debug('Matrices enssembling')
-            self.system.borderConditions()
-            logging.debug('Border conditions')
-            R = self.system.K@self.system.U - self.system.S
-            logging.debug('Residual')
+            t0 = time.time()
+            if R is None:
+                R = self.residual()
+            rnorm = self.residualNorm(R)
+            residuals.append(float(rnorm))
+            if self.rtol is not None and rnorm < self.rtol:
+                err = 0.0
+                times.append(time.time()-t0)
+                warn = 'No warnings'
+                logging.info(
+                    f'----------------- Residual norm {rnorm} -------------------')
+                break
+            self._factorize = (i-last) % max(self.refactor, 1) == 0
+            if len(residuals) > 1 and rnorm > self.stall*residuals[-2]:
+                self._factorize = True
+            if self._factorize:
+                last = i
             try:
-                du = -np.linalg.solve(self.system.T, R)
+                du = -self.solveConstrained(self.system.T,
+                                            R, homogeneous=True)
             except Exception as e:
                 logging.error(e)
                 raise e
 
             logging.debug('delta u')
-            self.system.U += du
-            for e in self.system.elements:
-                e.restartMatrix()
-                e.setUe(self.system.U)
-            logging.debug('Updated elements')
+            U = self.system.U.copy()
+            self.system.U = U + du
+            self.updateElements()
+            R = None
+            if self.linesearch:
+                step = 1.0
+                for _ in range(self.maxls):
+                    R = self.residual()
+                    if self.residualNorm(R) < (1.0-1e-4*step)*rnorm:
+                        break
+                    step *= 0.5
+                    self.system.U = U + step*du
+                    self.updateElements()
+                    R = None
+                du = step*du
+                logging.debug(f'Line search step {step}')
             err = np.max(np.abs(du))
+            times.append(time.time()-t0)
             logging.info(
-                f'----------------- Iteration error {err} -------------------')
+                f'----------------- Iteration error {err}, residual norm {rnorm}, time {times[-1]:.3f} s -------------------')
             if err < self.tol:
                 warn = 'No warnings'
                 break
         self.solutions = [self.system.U]
         self.solutions_info = [
-            {'solver-type': self.type, 'last-it-error': err, 'n-it': i, 'warnings': warn}]
+            {'solver-type': self.type, 'last-it-error': err, 'n-it': i, 'warnings': warn, 'residuals': residuals, 'times': times, 'factorizations': self.factorization.factorizations}]
         logging.info('Done!')
 
 
@@ -148,7 +246,8 @@ class DirectIteration(NonLinealSolver):
             logging.debug('Border conditions')
             uim11 = self.system.U.copy()
             try:
-                self.system.U = np.linalg.solve(self.system.K, self.system.S)
+                self.system.U = self.solveConstrained(
+                    self.system.K, self.system.S)
             except Exception as e:
                 logging.error(e)
                 raise e
@@ -1,3 +1,13 @@
+"""Define the structure of a base finite element solver
+"""
+
+import numpy as np
+import logging
+from scipy import sparse
+from scipy.linalg import lu_factor, lu_solve
+from scipy.sparse.linalg import spsolve, splu, LinearOperator
+
+
 class Solver():
     """Base Finite Element Solver.
     """
@@ -17,6 +27,49 @@ class Solver():
         """Solves the equation system
         """
 
+    def solveSystem(self, A, b: np.ndarray) -> np.ndarray:
+        """Solves a linear equation system. If the matrix is sparse, scipy's spsolve function is used.
+
+        Args:
+            A (Union[np.ndarray, sparse.spmatrix]): System matrix
+            b (np.ndarray): Right hand side vector
+
+        Returns:
+            np.ndarray: Solution with the same shape of b
+        """
+        if isinstance(A, LinearOperator):
+            logging.error(
+                'Matrix free operators must be solved with an iterative solver')
+            raise Exception(
+                'Matrix free operators must be solved with an iterative solver')
+        if sparse.issparse(A):
+            return spsolve(A.tocsc(), b).reshape(b.shape)
+        return np.linalg.solve(A, b)
+
+    def solveConstrained(self, A, b: np.ndarray, homogeneous: bool = False) -> np.ndarray:
+        """Solves a linear equation system whose unknowns include the prescribed degrees of freedom.
+        If the problem uses the elimination mode for the essential border conditions, only the free degrees of freedom
+        are solved, A_ff u_f = b_f - A_fp u_p, and the prescribed values are scattered in the solution.
+        Otherwise, the system is solved as it is.
+
+        Args:
+            A (Union[np.ndarray, sparse.spmatrix]): System matrix
+            b (np.ndarray): Right hand side vector
+            homogeneous (bool, optional): If True, the prescribed degrees of freedom are 0 (the system is solved for an increment). Defaults to False.
+
+        Returns:
+            np.ndarray: Solution with the same shape of b
+        """
+        ebc = self.system.ebc
+        if not self.system.ebcMode == 'elimination' or ebc is None:
+            return self.solveSystem(A, b)
+        shape = b.shape
+        b = np.asarray(b).reshape([-1, 1])
+        if not homogeneous:
+            b = b - ebc.lift(A)
+        uf = self.solveSystem(ebc.reduce(A), ebc.reduceVector(b))
+        return ebc.expand(uf, homogeneous).reshape(shape)
+
     def setSolution(self, step=-1, elements: bool = False) -> None:
         """Sets the solution to the FEM Object.
 
@@ -28,5 +81,87 @@ class Solver():
 
         self.system.U = self.solutions[step]
         if elements:
-            for e in self.system.elements:
-                e.setUe(self.system.U)
+            self.system.setElementsSolution(self.system.U)
+
+
+class CachedFactorization():
+    """Factorization of a system matrix that is reused while the matrix does not change.
+    Sparse matrices are factorized with scipy's splu function and dense matrices with scipy's lu_factor function.
+    Every time a system is solved, the matrix is compared with the factorized one, so any change
+    in the matrix (time step, material data, border conditions) produces a new factorization.
+    """
+
+    def __init__(self) -> None:
+        """Factorization of a system matrix that is reused while the matrix does not change.
+        Sparse matrices are factorized with scipy's splu function and dense matrices with scipy's lu_factor function.
+        Every time a system is solved, the matrix is compared with the factorized one, so any change
+        in the matrix (time step, material data, border conditions) produces a new factorization.
+        """
+        self.A = None
+        self.factor = None
+        self.factorizations = 0
+        self.reused = False
+
+    def same(self, A) -> bool:
+        """Checks if a matrix is equal to the factorized matrix
+
+        Args:
+            A (Union[np.ndarray, sparse.spmatrix]): System matrix
+
+        Returns:
+            bool: True if the factorization can be used to solve the matrix systems
+        """
+        if self.A is None or self.A.shape != A.shape:
+            return False
+        if sparse.issparse(A):
+            if not sparse.issparse(self.A):
+                return False
+            A = A.tocsc()
+            A.sort_indices()
+            return A.nnz == self.A.nnz and np.array_equal(A.indptr, self.A.indptr) and np.array_equal(A.indices, self.A.indices) and np.array_equal(A.data, self.A.data)
+        return not sparse.issparse(self.A) and np.array_equal(A, self.A)
+
+    def factorize(self, A) -> None:
+        """Factorizes a system matrix
+
+        Args:
+            A (Union[np.ndarray, sparse.spmatrix]): System matrix
+        """
+        logging.info('Factorizing system matrix...')
+        if sparse.issparse(A):
+            self.A = A.tocsc(copy=True)
+            self.A.sort_indices()
+            self.factor = splu(self.A)
+        else:
+            self.A = np.array(A)
+            self.factor = lu_factor(self.A)
+        self.factorizations += 1
+
+    def solve(self, A, b: np.ndarray) -> np.ndarray:
+        """Solves a linear equation system. The matrix is factorized only if it is different from the last factorized matrix
+
+        Args:
+            A (Union[np.ndarray, sparse.spmatrix]): System matrix
+            b (np.ndarray): Right hand side vector
+
+        Returns:
+            np.ndarray: Solution with the same shape of b
+        """
+        self.reused = self.same(A)
+        if not self.reused:
+            self.factorize(A)
+        return self.apply(b)
+
+    def apply(self, b: np.ndarray) -> np.ndarray:
+        """Solves a linear equation system using the last factorized matrix
+
+        Args:
+            b (np.ndarray): Right hand side vector
+
+        Returns:
+            np.ndarray: Solution with the same shape of b
+        """
+        b = np.asarray(b, dtype=float)
+        if sparse.issparse(self.A):
+            return self.factor.solve(b).reshape(b.shape)
+        return lu_solve(self.factor, b).reshape(b.shape)
@@ -3,17 +3,21 @@
 
 import numpy as np
 import logging
+from scipy import sparse
 from scipy.sparse.linalg import spsolve
-from .Solver import Solver
+from .Solver import Solver, CachedFactorization
+from ..Assembly import EssentialConditions
 from tqdm import tqdm
 
 
 class Parabolic(Solver):
     """Lineal Finite Element Solver.
+    The factorization of the system matrix is reused between time steps while the matrix does not change.
     """
 
     def __init__(self, FEMObject: 'Core'):
-        """Lineal Finite Element Solver
+        """Lineal Finite Element Solver.
+        The factorization of the system matrix is reused between time steps while the matrix does not change.
 
         Args:
             FEMObject (Core): Finite Element Problem
@@ -21,6 +25,19 @@ class Parabolic(Solver):
         Solver.__init__(self, FEMObject)
         self.type = 'lineal-transient'
         self.solutions = []
+        self.factorization = CachedFactorization()
+
+    def solveSystem(self, A, b: np.ndarray) -> np.ndarray:
+        """Solves a linear equation system using the cached factorization of the system matrix
+
+        Args:
+            A (Union[np.ndarray, sparse.spmatrix]): System matrix
+            b (np.ndarray): Right hand side vector
+
+        Returns:
+            np.ndarray: Solution with the same shape of b
+        """
+        return self.factorization.solve(A, b)
 
     def run(self, t0, tf, steps, dt=None):
         if not dt:
@@ -39,10 +56,324 @@ class Parabolic(Solver):
             self.system.ensembling()
             self.system.borderConditions()
             logging.info('Solving equation system...')
-            self.solutions.append(np.linalg.solve(
+            self.solutions.append(self.solveConstrained(
                 self.system.K, self.system.S))
             self.system.t += self.system.dt
             self.solutions_info.append(
-                {'solver-type': self.type, "time": self.system.t, "dt": self.system.dt})
+                {'solver-type': self.type, "time": self.system.t, "dt": self.system.dt, "factorized": not self.factorization.reused})
             self.setSolution(elements=True)
+        logging.info(
+            f'Done! {self.factorization.factorizations} factorizations in {steps} steps')
+
+
+class Hyperbolic(Solver):
+    """Newmark-beta and HHT-alpha time integration of M@a + K@u = F.
+
+    The problem must calculate the stiffness matrix K, the mass matrix M and the force vector F.
+    The essential border conditions are constant in time, so only the free degrees of freedom are integrated.
+    The time of the problem (t, dt) is updated only in transient problems.
+    The factorization of the effective matrix M + (1+alpha)*beta*dt**2*K is calculated once.
+    If beta is 0 and the mass matrix is lumped, the method is the explicit central differences method and no factorization is used.
+
+    If the parameters are not given and the problem has the Reddy's parameters (alpha, gamma) of CoreHiperbolic,
+    Newmark gamma is alpha and Newmark beta is gamma/2. HHT-alpha parameters are used otherwise.
+
+    Args:
+        FEMObject (Core): Finite Element Problem
+        alpha (float, optional): HHT-alpha numerical dissipation parameter. Must be between -1/3 and 0. Defaults to 0.0.
+        beta (float, optional): Newmark beta parameter. If not given, (1-alpha)**2/4 is used. Defaults to None.
+        gamma (float, optional): Newmark gamma parameter. If not given, (1-2*alpha)/2 is used. Defaults to None.
+        lumped (bool, optional): To use a lumped mass matrix. The lumped mass vector Ml of the problem is used if it is calculated. Otherwise, the row sum lumped mass matrix is used. Defaults to False.
+    """
+
+    def __init__(self, FEMObject: 'Core', alpha: float = 0.0, beta: float = None, gamma: float = None, lumped: bool = False):
+        """Newmark-beta and HHT-alpha time integration of M@a + K@u = F.
+
+        The problem must calculate the stiffness matrix K, the mass matrix M and the force vector F.
+        The essential border conditions are constant in time, so only the free degrees of freedom are integrated.
+        The time of the problem (t, dt) is updated only in transient problems.
+        The factorization of the effective matrix M + (1+alpha)*beta*dt**2*K is calculated once.
+        If beta is 0 and the mass matrix is lumped, the method is the explicit central differences method and no factorization is used.
+
+        If the parameters are not given and the problem has the Reddy's parameters (alpha, gamma) of CoreHiperbolic,
+        Newmark gamma is alpha and Newmark beta is gamma/2. HHT-alpha parameters are used otherwise.
+
+        Args:
+            FEMObject (Core): Finite Element Problem
+            alpha (float, optional): HHT-alpha numerical dissipation parameter. Must be between -1/3 and 0. Defaults to 0.0.
+            beta (float, optional): Newmark beta parameter. If not given, (1-alpha)**2/4 is used. Defaults to None.
+            gamma (float, optional): Newmark gamma parameter. If not given, (1-2*alpha)/2 is used. Defaults to None.
+            lumped (bool, optional): To use a lumped mass matrix. The lumped mass vector Ml of the problem is used if it is calculated. Otherwise, the row sum lumped mass matrix is used. Defaults to False.
+        """
+        Solver.__init__(self, FEMObject)
+        self.type = 'lineal-hyperbolic'
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.lumped = lumped
+        self.factorization = CachedFactorization()
+        self.velocity = None
+        self.acceleration = None
+
+    def parameters(self) -> tuple:
+        """Gives the time integration parameters
+
+        Returns:
+            tuple: alpha, beta and gamma parameters
+        """
+        alpha, beta, gamma = self.alpha, self.beta, self.gamma
+        if beta is None and gamma is None and hasattr(self.system, 'du0'):
+            gamma = self.system.alpha
+            beta = self.system.gamma/2
+        if beta is None:
+            beta = (1-alpha)**2/4
+        if gamma is None:
+            gamma = (1-2*alpha)/2
+        if not -1/3 <= alpha <= 0:
+            logging.warning(
+                f'HHT-alpha parameter {alpha} is out of the [-1/3, 0] range. The method may be unstable.')
+        return alpha, beta, gamma
+
+    def lumpedMass(self, M) -> np.ndarray:
+        """Calculates the row sum lumped mass matrix
+
+        Args:
+            M (Union[np.ndarray, sparse.spmatrix]): Consistent mass matrix
+
+        Returns:
+            np.ndarray: Diagonal of the lumped mass matrix
+        """
+        m = np.asarray(M.sum(axis=1)).flatten()
+        if np.any(m <= 0):
+            logging.warning(
+                'The lumped mass matrix has non positive entries. Row sum lumping of high order elements is not recommended.')
+        return m
+
+    def massDiagonal(self, ebc: EssentialConditions) -> np.ndarray:
+        """Gives the lumped mass matrix of the free degrees of freedom. If the problem calculates the lumped mass vector Ml, it is used.
+        Otherwise, the row sum lumped mass matrix is calculated from the consistent mass matrix.
+
+        Args:
+            ebc (EssentialConditions): Essential border conditions of the problem
+
+        Returns:
+            np.ndarray: Diagonal of the lumped mass matrix
+        """
+        Ml = getattr(self.system, 'Ml', None)
+        if Ml is not None and np.any(Ml):
+            return ebc.reduceVector(np.asarray(Ml, dtype=float))
+        return self.lumpedMass(ebc.reduce(self.system.M))
+
+    def saveSteps(self, steps: int, save) -> np.ndarray:
+        """Gives the time steps to be saved. The step 0 is the initial condition.
+
+        Args:
+            steps (int): Number of time steps
+            save (Union[int, list]): If int, every save steps are saved, including the initial condition and the last step. If list, the steps to save.
+
+        Returns:
+            np.ndarray: Sorted steps to be saved
+        """
+        if isinstance(save, int):
+            idx = list(range(0, steps+1, max(save, 1))) + [steps]
+        else:
+            idx = list(save)
+        return np.unique(np.array(idx, dtype=int))
+
+    def run(self, t0: float, tf: float, steps: int, dt: float = None, save=1, path: str = None, **kargs):
+        """Solves the time integration
+
+        Args:
+            t0 (float): Initial time
+            tf (float): Final time
+            steps (int): Number of time steps
+            dt (float, optional): Time step. If not given, (tf-t0)/steps is used. Defaults to None.
+            save (Union[int, list], optional): If int, every save steps are saved, including the initial condition and the last step. If list, the steps to save (0 is the initial condition). Defaults to 1.
+            path (str, optional): Path of a .npy file where the saved steps are streamed. If given, solutions is a memory mapped array with shape (nsaved, ngdl, 1). Defaults to None.
+            **kargs: Any of the solver options (alpha, beta, gamma, lumped).
+        """
+        for key in ['alpha', 'beta', 'gamma', 'lumped']:
+            if key in kargs:
+                setattr(self, key, kargs[key])
+        if not dt:
+            dt = (tf-t0)/steps
+        transient = hasattr(self.system, 'u0')
+        if transient:
+            self.system.dt = dt
+            self.system.t = t0
+        t = t0
+        alpha, beta, gamma = self.parameters()
+        explicit = beta == 0 and self.lumped
+        logging.info(
+            f'Time integration with alpha = {alpha}, beta = {beta}, gamma = {gamma}, dt = {dt}')
+        if hasattr(self.system, 'du0'):
+            self.system.apply_initial_condition()
+        if len(self.solutions):
+            logging.info('Restarting matrices of the previous solution')
+            self.system.restartMatrix()
+            if getattr(self.system, 'M', None) is not None:
+                if self.system.sparse:
+                    self.system.M = self.system.restartSparse(self.system.M)
+                else:
+                    self.system.M[:, :] = 0.0
+            if getattr(self.system, 'Ml', None) is not None:
+                self.system.Ml[:] = 0.0
+
+        logging.info('Creating element matrices...')
+        self.system.elementMatrices()
+        logging.info('Done!')
+        self.system.ensembling()
+        self.system.naturalConditions()
+        if getattr(self.system, 'M', None) is None and getattr(self.system, 'Ml', None) is None:
+            logging.error('The problem does not have a mass matrix.')
+            raise Exception('The problem does not have a mass matrix.')
+        ebc = EssentialConditions(self.system.cbe, self.system.ngdl)
+        f = ebc.reduceVector(self.system.F + self.system.Q -
+                             ebc.lift(self.system.K))[:, 0]
+        K = ebc.reduce(self.system.K)
+        if self.lumped:
+            m = self.massDiagonal(ebc)
+            M = sparse.diags(m) if sparse.issparse(K) else np.diag(m)
+        else:
+            M = ebc.reduce(self.system.M)
+        U = np.asarray(self.system.U, dtype=float).reshape([-1, 1])
+        u = ebc.reduceVector(U)[:, 0]
+        v = np.zeros(u.shape)
+        if hasattr(self.system, 'dU'):
+            v = ebc.reduceVector(self.system.dU)[:, 0]
+
+        logging.info('Initial acceleration...')
+        if self.lumped:
+            a = (f - K@u)/m
+        else:
+            a = CachedFactorization().solve(M, f - K@u)
+
+        saved = self.saveSteps(steps, save)
+        shape = (len(saved), self.system.ngdl, 1)
+        if path:
+            self.solutions = np.lib.format.open_memmap(
+                path, mode='w+', dtype=float, shape=shape)
+        else:
+            self.solutions = np.zeros(shape)
+        self.solutions_info = []
+        k = 0
+        if saved[0] == 0:
+            self.solutions[0] = ebc.expand(u)
+            self.solutions_info.append(
+                {'solver-type': self.type, "time": t, "dt": dt, "step": 0})
+            k = 1
+
+        if explicit:
+            logging.info('Explicit central differences')
+        else:
+            A = M + (1+alpha)*beta*dt**2*K
+            if not self.factorization.same(A):
+                self.factorization.factorize(A)
+        for n in tqdm(range(1, steps+1), unit='Step'):
+            ustar = u + dt*v + dt**2*(0.5-beta)*a
+            vstar = v + dt*(1-gamma)*a
+            r = f - (1+alpha)*(K@ustar)
+            if alpha:
+                r += alpha*(K@u)
+            if explicit:
+                a = r/m
+            else:
+                a = self.factorization.apply(r)
+            u = ustar + beta*dt**2*a
+            v = vstar + gamma*dt*a
+            t += dt
+            if k < len(saved) and saved[k] == n:
+                self.solutions[k] = ebc.expand(u)
+                self.solutions_info.append(
+                    {'solver-type': self.type, "time": t, "dt": dt, "step": n})
+                k += 1
+        if path:
+            self.solutions.flush()
+        self.velocity = ebc.expand(v, homogeneous=True)
+        self.acceleration = ebc.expand(a, homogeneous=True)
+        if hasattr(self.system, 'dU'):
+            self.system.dU = self.velocity
+            self.system.ddU = self.acceleration
+        if transient:
+            self.system.t = t
+        self.system.U = ebc.expand(u)
+        self.system.solution_info = self.solutions_info[-1] if self.solutions_info else {}
+        self.system.setElementsSolution(self.system.U)
         logging.info('Done!')
+
+
+class CentralDifference(Hyperbolic):
+    """Explicit central differences time integration of M@a + K@u = F with a lumped (diagonal) mass matrix.
+    Every time step uses one matrix-vector product and no factorization is calculated.
+
+    If the problem calculates the lumped mass vector Ml (lumping parameter), it is used. Otherwise, the row sum lumped mass matrix is used.
+    The problem must have the waveSpeeds method to estimate the critical time step.
+
+    Args:
+        FEMObject (Core): Finite Element Problem
+        safety (float, optional): Factor applied to the critical time step when the time step is not given. Defaults to 0.9.
+    """
+
+    def __init__(self, FEMObject: 'Core', safety: float = 0.9):
+        """Explicit central differences time integration of M@a + K@u = F with a lumped (diagonal) mass matrix.
+        Every time step uses one matrix-vector product and no factorization is calculated.
+
+        If the problem calculates the lumped mass vector Ml (lumping parameter), it is used. Otherwise, the row sum lumped mass matrix is used.
+        The problem must have the waveSpeeds method to estimate the critical time step.
+
+        Args:
+            FEMObject (Core): Finite Element Problem
+            safety (float, optional): Factor applied to the critical time step when the time step is not given. Defaults to 0.9.
+        """
+        Hyperbolic.__init__(self, FEMObject, alpha=0.0,
+                            beta=0.0, gamma=0.5, lumped=True)
+        self.type = 'lineal-explicit'
+        self.safety = safety
+
+    def criticalTimeStep(self) -> float:
+        """Estimates the critical time step as the minimum ratio between the element size and the element wave speed
+
+        Returns:
+            float: Critical time step
+        """
+        if not hasattr(self.system, 'waveSpeeds'):
+            logging.error(
+                'The problem does not have wave speeds. The time step must be given.')
+            raise Exception(
+                'The problem does not have wave speeds. The time step must be given.')
+        h = self.system.geometry.elementSizes()
+        c = self.system.waveSpeeds()
+        return float(np.min(h/c))
+
+    def run(self, t0: float, tf: float, steps: int = None, dt: float = None, save=1, path: str = None, **kargs):
+        """Solves the time integration. If the time step and the number of steps are not given, the time step is the critical time step multiplied by the safety factor.
+
+        Args:
+            t0 (float): Initial time
+            tf (float): Final time
+            steps (int, optional): Number of time steps. Defaults to None.
+            dt (float, optional): Time step. If not given, (tf-t0)/steps is used. Defaults to None.
+            save (Union[int, list], optional): If int, every save steps are saved, including the initial condition and the last step. If list, the steps to save (0 is the initial condition). Defaults to 1.
+            path (str, optional): Path of a .npy file where the saved steps are streamed. Defaults to None.
+        """
+        if 'safety' in kargs:
+            self.safety = kargs['safety']
+        critical = None
+        if hasattr(self.system, 'waveSpeeds'):
+            critical = self.criticalTimeStep()
+        if not dt and not steps:
+            if critical is None:
+                critical = self.criticalTimeStep()
+            steps = int(np.ceil((tf-t0)/(self.safety*critical)))
+            dt = (tf-t0)/steps
+            logging.info(f'Critical time step. Using dt = {dt}')
+        elif not dt:
+            dt = (tf-t0)/steps
+        elif not steps:
+            # The time step is reduced so the last step ends at tf
+            steps = int(np.ceil((tf-t0)/dt))
+            dt = (tf-t0)/steps
+        if critical is not None and dt > critical:
+            logging.warning(
+                f'Time step {dt} is greater than the critical time step {critical}. The method may be unstable.')
+        Hyperbolic.run(self, t0, tf, steps, dt=dt, save=save, path=path)
@@ -2,6 +2,7 @@
 """
 
 from .Lineal import *
+from .Iterative import *
 from .NoLineal import *
 from .Solver import *
 from .Transient import *
@@ -3,6 +3,7 @@
 
 
 from .Core import Core, Geometry
+from .Parallel import parallelTasks, parallelMap
 from tqdm import tqdm
 import numpy as np
 import matplotlib.pyplot as plt
@@ -49,26 +50,42 @@ class Torsion2D(Core):
         self.properties['G'] = self.G
 
     def elementMatrices(self) -> None:
-        """Calculate the element matrices usign Reddy's (2005) finite element model
+        """Calculate the element matrices usign Reddy's (2005) finite element model.
+        The elements are divided in chunks that are calculated in parallel if the problem has more than one worker.
         """
-        ee = -1
-        for e in tqdm(self.elements, unit='Element'):
-            ee += 1
+        tasks = parallelTasks(
+            [np.arange(len(self.elements))], self.workers)
+        results = parallelMap(self, 'chunkMatrices', tasks, self.workers)
+        for idx, matrices in zip(tasks, tqdm(results, total=len(tasks), unit='Chunk')):
+            for ee, (Ke, Fe) in zip(idx, matrices):
+                e = self.elements[ee]
+                e.Fe[:, 0] = Fe
+                e.Ke = Ke
+
+    def chunkMatrices(self, idx: np.ndarray) -> list:
+        """Calculate the element matrices of a chunk of elements usign Reddy's (2005) finite element model
+
+        Args:
+            idx (np.ndarray): Element indices
+
+        Returns:
+            list: Stiffness matrix and force vector of every element
+        """
+        result = []
+        for ee in idx:
+            e = self.elements[ee]
             # Gauss points in global coordinates and Shape functions evaluated in gauss points
-            _x, _p = e.T(e.Z.T)
+            _x, _p = e._x, e._p
             # Jacobian evaluated in gauss points and shape functions derivatives in natural coordinates
-            jac, dpz = e.J(e.Z.T)
+            jac, dpz = e.jacs, e.dpz
             detjac = np.linalg.det(jac)*e.W
             _j = np.linalg.inv(jac)  # Jacobian inverse
             dpx = _j @ dpz  # Shape function derivatives in global coordinates
-            # for k in range(len(_x)): #Iterate over gauss points on domain
-            # 	for i in range(e.n): #self part must be vectorized
-            # 		for j in range(e.n):
-            # 			e.Ke[i,j] += (dpx[k][0][i]*dpx[k][0][j] + dpx[k][1][i]*dpx[k][1][j])*detjac[k]*e.W[k]
-            # 		e.Fe[i][0] += 2*self.G*self._phi*_p[k][i]*detjac[k]*e.W[k]
-            e.Fe[:, 0] = self._phi*detjac@_p
-            e.Ke = (np.transpose(dpx, axes=[0, 2, 1])
-                    @ dpx).T @ detjac/2/self.G[ee]
+            Fe = self._phi*detjac@_p
+            Ke = (np.transpose(dpx, axes=[0, 2, 1])
+                  @ dpx).T @ detjac/2/self.G[ee]
+            result.append((Ke, Fe))
+        return result
 
     def postProcess(self, levels=30, derivatives=True) -> None:
         """Create graphs for stress function and derivatives.